@@ -0,0 +1,388 @@
+import asyncio
+import numpy as np
+import pandas as pd
+import threading
+
+from import_batch_ftcg import backend, planner, server
+from import_batch_ftcg.cache import ExpansionCache
+from typing import Any, Coroutine, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class AsyncFts:
+    """
+    Client asyncio du serveur de Terminologies FHIR. En HTTP/2, toutes les
+    expansions et leurs pages sont multiplexées sur une seule connexion ; un
+    sémaphore limite le nombre de requêtes simultanées
+    """
+
+    def __init__(self, endpoint: str, cache: Optional[ExpansionCache] = None,
+                 timeout: Tuple[float, float] = (10, 300), retries: int = 5,
+                 backoff: float = 1, page_size: int = 5000, max_in_flight: int = 32,
+                 http2: bool = True, version: Optional[str] = None):
+        """
+        Args:
+            endpoint: Endpoint de votre serveur de Terminologies FHIR
+            cache: Cache persistant des expansions ECL. Si absent, chaque requête
+                ECL est envoyée au FTS
+            timeout: Délais maximaux de connexion et de lecture, en secondes
+            retries: Nombre maximal de nouvelles tentatives après une erreur de
+                connexion ou une réponse 429/5xx
+            backoff: Facteur de l'attente exponentielle entre deux tentatives, en
+                secondes
+            page_size: Nombre de codes demandés par page d'expansion
+            max_in_flight: Nombre maximal de requêtes envoyées simultanément au FTS
+            http2: Si vrai, HTTP/2 est négocié avec le FTS (HTTPS)
+            version: URI de version de l'édition interrogée (voir `server.Fts`)
+
+        Raises:
+            ImportError: httpx n'est pas installé (`pip install .[async]`)
+            ValueError: La version n'est pas une URI de version de l'édition
+                internationale
+        """
+        if httpx is None:
+            raise ImportError("Le client asynchrone nécessite httpx : "
+                              "pip install .[async]")
+        version = server.edition_version(version)
+        if version is not None \
+                and not version.startswith(f"{backend.INTERNATIONAL}/version/"):
+            raise ValueError(f"Version de l'édition invalide : {version}")
+        self.endpoint = endpoint
+        self.edition = version or backend.INTERNATIONAL
+        self.pinned = version
+        self.ecl_base_url = f"{endpoint}/ValueSet/$expand?url={self.edition}?fhir_vs=ecl/" # noqa
+        self.cache = cache
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.page_size = page_size
+        self.max_in_flight = max_in_flight
+        self.http2 = http2
+        # Le client, le sémaphore et les expansions en cours sont liés à la boucle
+        # d'événements : ils sont créés à la première requête
+        self._client = None
+        self._in_flight = None
+        self._expansions: Dict[str, asyncio.Task] = {}
+        # Version de l'édition annoncée par le FTS, récupérée au plus une fois pour
+        # invalider les expansions en cache (voir `_current`)
+        self._current_version: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "AsyncFts":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Ferme les connexions au FTS."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def ecl(self, ecl: str) -> pd.Index:
+        """Envoie une requête ECL au FTS. Ses sous-requêtes élémentaires (voir
+        `planner.split`) sont expansées en parallèle, une seule fois par instance,
+        puis combinées localement
+
+        Args:
+            ecl: Requête ECL
+
+        Returns:
+            Index (immuable et sans doublon) des SCTID correspondant à la requête
+            ECL, à tester avec `server.isin`
+        """
+        return (await self.ecl_many([ecl]))[ecl]
+
+    async def ecl_many(self, ecls: Iterable[str],
+                       candidates: Optional[Iterable[int]] = None
+                       ) -> Dict[str, pd.Index]:
+        """Envoie en parallèle plusieurs requêtes ECL au FTS
+
+        Args:
+            ecls: Requêtes ECL
+            candidates: Ignoré : les hiérarchies sont expansées entièrement
+
+        Returns:
+            Dictionnaire associant chaque requête ECL à l'index des SCTID
+            correspondants
+        """
+        plans = {ecl: planner.split(ecl) for ecl in ecls}
+        leaves = list(dict.fromkeys(leaf for _, split in plans.values()
+                                    for leaf in split))
+        codes = await asyncio.gather(*(self._expand(leaf) for leaf in leaves))
+        expansions = dict(zip(leaves, codes))
+        return {ecl: planner.combine(ecl, node, expansions)
+                for ecl, (node, _) in plans.items()}
+
+    async def fsn(self, concepts: Iterable[int]) -> pd.Series:
+        """Récupère en parallèle le FSN de concepts (opération `CodeSystem/$lookup`)
+
+        Args:
+            concepts: SCTID des concepts
+
+        Returns:
+            FSN de chaque concept (indexés par SCTID, sans doublon), absents pour
+            les concepts inconnus du FTS
+        """
+        concepts = list(dict.fromkeys(concepts))
+        lookups = await asyncio.gather(*(self._lookup_code(c) for c in concepts))
+        terms = []
+        for parameters in lookups:
+            term = None
+            for designation in server.lookup_parameters(parameters, "designation"):
+                parts = {p.get("name"): p for p in designation.get("part", [])}
+                if parts.get("use", {}).get("valueCoding", {}).get("code") \
+                        == backend.FSN:
+                    term = parts.get("value", {}).get("valueString")
+            terms.append(term)
+        return pd.Series(terms, name="fsn", dtype=object,
+                         index=pd.Index(concepts, dtype=np.int64, name="conceptId"))
+
+    async def version(self) -> Optional[str]:
+        """Récupère la version de l'édition annoncée par le FTS
+
+        Returns:
+            URI de version de l'édition, ou None si le FTS ne l'indique pas
+        """
+        parameters = await self._lookup_code(138875005)
+        version = server.lookup_parameters(parameters, "version")
+        return server.edition_version(next((p.get("valueString", p.get("valueUri"))
+                                            for p in version), None))
+
+    def _expand(self, ecl: str) -> asyncio.Task:
+        """Expanse une requête ECL élémentaire au plus une fois par instance : les
+        appels simultanés attendent la même tâche."""
+        task = self._expansions.get(ecl)
+        if task is None or (task.done() and task.exception() is not None):
+            task = self._expansions[ecl] = asyncio.ensure_future(self._fetch(ecl))
+        return task
+
+    async def _fetch(self, ecl: str) -> pd.Index:
+        """Récupère l'expansion d'une requête ECL élémentaire dans le cache
+        persistant si elle y est présente, sinon auprès du FTS.
+
+        Args:
+            ecl: Requête ECL élémentaire
+
+        Returns:
+            Index des SCTID correspondant à la requête ECL
+        """
+        entry = None
+        if self.cache is not None:
+            entry = await asyncio.to_thread(self.cache.lookup, self.endpoint,
+                                            self.edition, ecl)
+            if entry is not None and not entry.fresh:
+                # Pas de requête conditionnelle : une expansion expirée est
+                # téléchargée de nouveau
+                entry = None
+            if entry is not None and entry.version is not None \
+                    and self.pinned is None:
+                # Comme `server.Fts._lookup` : une expansion obtenue avec une autre
+                # version que celle du FTS est invalidée
+                current = await self._current()
+                if current is not None and current != entry.version:
+                    entry = None
+        if entry is not None:
+            return backend.sctids(entry.codes)
+
+        first = await self._page(self._url(ecl), 0, self.page_size)
+        codes = [code for page in await self.pages(ecl, first) for code in page]
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.set, self.endpoint, self.edition, ecl,
+                                    codes, first.etag, first.modified, first.version)
+
+        return backend.sctids(codes)
+
+    def _current(self) -> asyncio.Task:
+        """Récupère, une seule fois par instance, la version de l'édition annoncée
+        par le FTS, et supprime du cache les expansions obtenues avec une autre
+        version (voir `server.Fts._current`) : les appels simultanés attendent la
+        même tâche."""
+        if self._current_version is None:
+            self._current_version = asyncio.ensure_future(self._invalidate())
+        return self._current_version
+
+    async def _invalidate(self) -> Optional[str]:
+        """Récupère la version de l'édition annoncée par le FTS et supprime du
+        cache les expansions obtenues avec une autre version.
+
+        Returns:
+            URI de version de l'édition, ou None si le FTS ne l'indique pas
+        """
+        try:
+            current = await self.version()
+        except httpx.HTTPStatusError:
+            # FTS ne prenant pas en charge `CodeSystem/$lookup` : les expansions en
+            # cache restent valides jusqu'à leur expiration
+            return None
+        if current is not None:
+            await asyncio.to_thread(self.cache.invalidate, self.endpoint,
+                                    self.edition, current)
+        return current
+
+    def _url(self, ecl: str) -> str:
+        """Construit l'URL de l'expansion d'une requête ECL (sans pagination)."""
+        return f"{self.ecl_base_url}{quote(ecl)}"
+
+    async def pages(self, ecl: str,
+                    first: Optional[server.Page] = None) -> List[List[str]]:
+        """Récupère l'expansion d'une requête ECL page par page : une fois le total
+        connu, toutes les pages suivantes sont demandées en même temps
+
+        Args:
+            ecl: Requête ECL
+            first: Première page de l'expansion, si elle a déjà été récupérée
+
+        Returns:
+            Listes des SCTID de chaque page, dans l'ordre de l'expansion
+
+        Raises:
+            ValueError: Le FTS a expansé une autre version que la version fixée
+        """
+        url = self._url(ecl)
+        if first is None:
+            first = await self._page(url, 0, self.page_size)
+        total, codes = first.total, first.codes
+        pages, size = [codes], len(codes)
+        if total is None:
+            # Sans total annoncé, les pages sont lues l'une après l'autre jusqu'à
+            # la première page vide : une page incomplète peut venir d'un FTS
+            # plafonnant leur taille
+            while codes:
+                codes = (await self._page(url, sum(map(len, pages)),
+                                          self.page_size)).codes
+                pages.append(codes)
+            return pages
+
+        # Le FTS peut plafonner la taille des pages : les pages suivantes reprennent
+        # la taille de la première
+        if size > 0:
+            rest = await asyncio.gather(*(self._page(url, offset, size)
+                                          for offset in range(size, total, size)))
+            pages.extend(page.codes for page in rest)
+        received = sum(map(len, pages))
+        if received != total:
+            raise ValueError(f"Expansion incomplète pour '{ecl}' : {received} codes "
+                             f"reçus sur {total} annoncés")
+        return pages
+
+    async def _page(self, url: str, offset: int, count: int) -> server.Page:
+        """Récupère une page d'expansion.
+
+        Args:
+            url: URL de l'expansion de la requête ECL
+            offset: Position du premier code de la page
+            count: Nombre de codes demandés
+
+        Returns:
+            Page d'expansion
+
+        Raises:
+            ValueError: Le FTS a expansé une autre version que la version fixée
+        """
+        response = await self._get(server.page_url(url, offset, count))
+        response.raise_for_status()
+        page = server.Page(*server.expansion(response.json()["expansion"]),
+                           response.headers.get("ETag"),
+                           server.http_date(response.headers.get("Last-Modified")))
+        return server.pinned(page, self.pinned)
+
+    async def _lookup_code(self, code: int) -> Optional[Dict[str, Any]]:
+        """Envoie une opération `CodeSystem/$lookup` sur un concept.
+
+        Args:
+            code: SCTID du concept
+
+        Returns:
+            Ressource Parameters renvoyée par le FTS, ou None si le concept est
+            inconnu
+        """
+        response = await self._get(
+            f"{self.endpoint}/CodeSystem/$lookup?system=http://snomed.info/sct"
+            f"&version={self.edition}&code={code}")
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    async def _get(self, url: str) -> "httpx.Response":
+        """Envoie une requête GET, sous le sémaphore, avec de nouvelles tentatives
+        (attente exponentielle, ou `Retry-After`) après une erreur de connexion ou
+        une réponse 429/5xx.
+
+        Args:
+            url: URL de la requête
+
+        Returns:
+            Dernière réponse du FTS
+        """
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                headers={"Accept": "application/fhir+json",
+                         "Accept-Encoding": "gzip, deflate"})
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._in_flight:
+                    response = await self._client.get(url)
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+                continue
+            if response.status_code not in (429, 500, 502, 503, 504) \
+                    or attempt == self.retries:
+                return response
+            delay = response.headers.get("Retry-After", "")
+            await asyncio.sleep(float(delay) if delay.isdigit()
+                                else self.backoff * 2 ** attempt)
+
+
+class SyncFts(backend.Terminology):
+    """
+    Façade synchrone d'un `AsyncFts`, utilisable partout où `server.Fts` l'est (par
+    exemple par `control.run_quality_control`). Les requêtes sont exécutées dans
+    une boucle d'événements dédiée, dans un thread : les connexions sont conservées
+    d'un appel à l'autre
+    """
+
+    def __init__(self, fts: AsyncFts):
+        """
+        Args:
+            fts: Client asyncio du FTS
+        """
+        self.fts = fts
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def _run(self, coroutine: Coroutine) -> Any:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def ecl(self, ecl: str) -> pd.Index:
+        return self._run(self.fts.ecl(ecl))
+
+    def ecl_many(self, ecls: Iterable[str],
+                 candidates: Optional[Iterable[int]] = None) -> Dict[str, pd.Index]:
+        return self._run(self.fts.ecl_many(ecls, candidates))
+
+    def fsn(self, concepts: Iterable[int]) -> pd.Series:
+        return self._run(self.fts.fsn(concepts))
+
+    def version(self) -> Optional[str]:
+        return self._run(self.fts.version())
+
+    def close(self) -> None:
+        """Ferme les connexions au FTS et arrête la boucle d'événements."""
+        self._run(self.fts.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Optional, Union
+
+# Édition internationale de la SNOMED CT
+INTERNATIONAL = "http://snomed.info/sct/900000000000207008"
+# SCTID du type de description 'Fully specified name'
+FSN = "900000000000003001"
+# SCTID du type de description 'Synonym'
+SYNONYM = "900000000000013009"
+
+
+def sctids(codes: Iterable[Union[int, str]]) -> pd.Index:
+    """Construit l'index des SCTID d'une expansion, représentés par des entiers.
+
+    Args:
+        codes: SCTID, éventuellement sous forme de chaînes (réponses JSON)
+
+    Returns:
+        Index (int64, immuable et sans doublon) des SCTID, à tester avec
+        `server.isin`
+    """
+    if not isinstance(codes, (list, np.ndarray, pd.Index)):
+        codes = list(codes)
+    return pd.Index(np.asarray(codes, dtype=np.int64)).unique()
+
+
+class Terminology(ABC):
+    """
+    Interface commune des sources de terminologie interrogées par la lecture de la
+    Common French et les contrôles qualité : serveur FHIR (`server.Fts`), serveur
+    Snowstorm (`snowstorm.Snowstorm`) ou fichiers RF2 (`local.LocalTerminology`)
+    """
+
+    @abstractmethod
+    def ecl(self, ecl: str) -> pd.Index:
+        """Récupère les SCTID correspondant à une requête ECL
+
+        Args:
+            ecl: Requête ECL
+
+        Returns:
+            Index (int64, immuable et sans doublon) des SCTID correspondant à la
+            requête ECL, à tester avec `server.isin`
+        """
+
+    def ecl_many(self, ecls: Iterable[str],
+                 candidates: Optional[Iterable[int]] = None) -> Dict[str, pd.Index]:
+        """Récupère les SCTID correspondant à plusieurs requêtes ECL
+
+        Args:
+            ecls: Requêtes ECL
+            candidates: Concepts dont l'appartenance aux requêtes ECL est testée.
+                Une implémentation peut se limiter à ces concepts
+
+        Returns:
+            Dictionnaire associant chaque requête ECL à l'index des SCTID
+            correspondants
+        """
+        return {ecl: self.ecl(ecl) for ecl in dict.fromkeys(ecls)}
+
+    @abstractmethod
+    def fsn(self, concepts: Iterable[int]) -> pd.Series:
+        """Récupère le FSN (Fully specified name) de concepts
+
+        Args:
+            concepts: SCTID des concepts
+
+        Returns:
+            FSN de chaque concept (indexés par SCTID entiers, sans doublon),
+            absents pour les concepts inconnus
+        """
+
+    @abstractmethod
+    def version(self) -> Optional[str]:
+        """Récupère la version de l'édition interrogée
+
+        Returns:
+            URI de version de l'édition (ex:
+            http://snomed.info/sct/900000000000207008/version/20240101), ou None
+            si elle n'est pas connue
+        """
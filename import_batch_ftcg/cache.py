@@ -0,0 +1,273 @@
+import pandas as pd
+import sqlite3
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import closing
+from typing import Callable, Dict, Hashable, List, NamedTuple, Optional
+
+from import_batch_ftcg import ecl as ecl_
+
+
+class Entry(NamedTuple):
+    """Expansion lue dans le cache, avec les informations permettant de la
+    revalider auprès du FTS une fois expirée"""
+    codes: List[str]
+    fresh: bool
+    etag: Optional[str] = None
+    modified: Optional[str] = None
+    version: Optional[str] = None
+
+
+class ExpansionCache:
+    """
+    Cache persistant (SQLite) des expansions ECL, partageable entre plusieurs
+    processus travaillant sur le même fichier
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600,
+                 max_size: int = 512 * 1024 * 1024, timeout: float = 60):
+        """
+        Args:
+            path: Chemin vers le fichier SQLite du cache
+            ttl: Durée de validité d'une expansion, en secondes
+            max_size: Taille maximale des expansions stockées (compressées), en
+                octets. Les expansions les moins récemment utilisées sont
+                supprimées au-delà
+            timeout: Délai d'attente du verrou SQLite lorsqu'un autre processus
+                écrit dans le cache, en secondes
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.timeout = timeout
+
+        with closing(self._connect()) as db:
+            # Le mode WAL permet des lectures concurrentes pendant une écriture
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS expansion (
+                              endpoint TEXT NOT NULL,
+                              edition TEXT NOT NULL,
+                              ecl TEXT NOT NULL,
+                              codes BLOB NOT NULL,
+                              size INTEGER NOT NULL,
+                              created REAL NOT NULL,
+                              accessed REAL NOT NULL,
+                              etag TEXT,
+                              modified TEXT,
+                              version TEXT,
+                              PRIMARY KEY (endpoint, edition, ecl))""")
+            # Migration des caches créés avant l'ajout des validateurs
+            columns = {row[1] for row in db.execute("PRAGMA table_info(expansion)")}
+            for column in ("etag", "modified", "version"):
+                if column not in columns:
+                    db.execute(f"ALTER TABLE expansion ADD COLUMN {column} TEXT")
+            db.execute("""CREATE INDEX IF NOT EXISTS expansion_accessed
+                          ON expansion (accessed)""")
+
+    def _connect(self) -> sqlite3.Connection:
+        # Une connexion par opération : les connexions SQLite ne peuvent pas être
+        # partagées entre threads
+        return sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+
+    def get(self, endpoint: str, edition: str, ecl: str) -> Optional[List[str]]:
+        """Récupère une expansion du cache.
+
+        Args:
+            endpoint: Endpoint du serveur de Terminologies FHIR
+            edition: Édition (et version) de la SNOMED CT interrogée
+            ecl: Requête ECL
+
+        Returns:
+            Liste des SCTID correspondant à la requête ECL, ou None si l'expansion
+            est absente ou expirée
+        """
+        entry = self.lookup(endpoint, edition, ecl)
+        return entry.codes if entry is not None and entry.fresh else None
+
+    def lookup(self, endpoint: str, edition: str, ecl: str) -> Optional[Entry]:
+        """Récupère une expansion du cache, même expirée, avec ses validateurs.
+
+        Args:
+            endpoint: Endpoint du serveur de Terminologies FHIR
+            edition: Édition (et version) de la SNOMED CT interrogée
+            ecl: Requête ECL
+
+        Returns:
+            Expansion en cache, ou None si elle est absente
+        """
+        key = (endpoint, edition, ecl_.normalize(ecl))
+        now = time.time()
+        with closing(self._connect()) as db:
+            row = db.execute("""SELECT codes, created, etag, modified, version
+                                FROM expansion
+                                WHERE endpoint = ? AND edition = ? AND ecl = ?""",
+                             key).fetchone()
+            if row is None:
+                return None
+            db.execute("""UPDATE expansion SET accessed = ?
+                          WHERE endpoint = ? AND edition = ? AND ecl = ?""",
+                       (now, *key))
+
+        codes = zlib.decompress(row[0]).decode()
+        return Entry(codes.split("\n") if codes else [], row[1] > now - self.ttl,
+                     *row[2:])
+
+    def touch(self, endpoint: str, edition: str, ecl: str) -> None:
+        """Prolonge la validité d'une expansion confirmée inchangée par le FTS.
+
+        Args:
+            endpoint: Endpoint du serveur de Terminologies FHIR
+            edition: Édition (et version) de la SNOMED CT interrogée
+            ecl: Requête ECL
+        """
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute("""UPDATE expansion SET created = ?, accessed = ?
+                          WHERE endpoint = ? AND edition = ? AND ecl = ?""",
+                       (now, now, endpoint, edition, ecl_.normalize(ecl)))
+
+    def set(self, endpoint: str, edition: str, ecl: str, codes: List[str],
+            etag: Optional[str] = None, modified: Optional[str] = None,
+            version: Optional[str] = None) -> None:
+        """Ajoute une expansion au cache puis supprime les expansions les moins
+        récemment utilisées si la taille maximale est dépassée.
+
+        Args:
+            endpoint: Endpoint du serveur de Terminologies FHIR
+            edition: Édition (et version) de la SNOMED CT interrogée
+            ecl: Requête ECL
+            codes: Liste des SCTID correspondant à la requête ECL
+            etag: En-tête `ETag` de la première page d'expansion
+            modified: En-tête `Last-Modified` de la première page d'expansion
+            version: Version de l'édition annoncée dans l'expansion
+        """
+        blob = zlib.compress("\n".join(codes).encode())
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute("""INSERT OR REPLACE INTO expansion
+                              (endpoint, edition, ecl, codes, size, created,
+                               accessed, etag, modified, version)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                           (endpoint, edition, ecl_.normalize(ecl), blob, len(blob),
+                            now, now, etag, modified, version))
+                # Les expansions expirées sont conservées si elles peuvent être
+                # revalidées auprès du FTS
+                db.execute("""DELETE FROM expansion WHERE created <= ?
+                              AND etag IS NULL AND modified IS NULL
+                              AND version IS NULL""", (now - self.ttl,))
+                # Éviction LRU : conserve les expansions les plus récemment
+                # utilisées dont la taille cumulée reste sous la limite
+                db.execute("""DELETE FROM expansion WHERE rowid IN (
+                                  SELECT rowid FROM (
+                                      SELECT rowid, SUM(size) OVER (
+                                          ORDER BY accessed DESC, rowid DESC) AS total
+                                      FROM expansion)
+                                  WHERE total > ?)""", (self.max_size,))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def invalidate(self, endpoint: str, edition: str, version: str) -> int:
+        """Supprime les expansions obtenues avec une autre version de l'édition que
+        celle annoncée par le FTS.
+
+        Args:
+            endpoint: Endpoint du serveur de Terminologies FHIR
+            edition: Édition de la SNOMED CT interrogée
+            version: Version de l'édition actuellement annoncée par le FTS
+
+        Returns:
+            Nombre d'expansions supprimées
+        """
+        with closing(self._connect()) as db:
+            return db.execute("""DELETE FROM expansion
+                                 WHERE endpoint = ? AND edition = ?
+                                 AND version IS NOT NULL AND version != ?""",
+                              (endpoint, edition, version)).rowcount
+
+    def clear(self) -> None:
+        """Vide le cache."""
+        with closing(self._connect()) as db:
+            db.execute("DELETE FROM expansion")
+
+
+class MemoryCache:
+    """
+    Cache mémoire LRU des expansions ECL, partagé entre les threads d'un processus.
+    Les appels simultanés pour une même clé partagent une seule expansion en cours
+    """
+
+    def __init__(self, max_codes: int = 5_000_000):
+        """
+        Args:
+            max_codes: Nombre total maximal de codes conservés. Les expansions les
+                moins récemment utilisées sont supprimées au-delà
+        """
+        self.max_codes = max_codes
+        self.codes = 0
+        self._entries: "OrderedDict[Hashable, pd.Index]" = OrderedDict()
+        self._pending: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, expand: Callable[[], pd.Index]) -> pd.Index:
+        """Récupère une expansion du cache ou la calcule. Si la même clé est déjà
+        en cours de calcul dans un autre thread, attend son résultat (ou son
+        exception) au lieu de la recalculer.
+
+        Args:
+            key: Clé de l'expansion
+            expand: Fonction calculant l'expansion si elle est absente
+
+        Returns:
+            Expansion associée à la clé
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            codes = expand()
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._pending[key]
+            self._entries[key] = codes
+            self.codes += len(codes)
+            # Éviction LRU : une expansion plus grande que la limite n'est pas
+            # conservée
+            while self.codes > self.max_codes:
+                _, evicted = self._entries.popitem(last=False)
+                self.codes -= len(evicted)
+        future.set_result(codes)
+        return codes
+
+    def clear(self) -> None:
+        """Vide le cache (les calculs en cours ne sont pas interrompus)."""
+        with self._lock:
+            self._entries.clear()
+            self.codes = 0
@@ -1,6 +1,21 @@
 import pandas as pd
 
-from import_batch_ftcg import server
+from import_batch_ftcg import backend, server
+from typing import Dict, Optional
+
+# Requêtes ECL des périmètres des règles de contrôle qualité (hors pa3)
+QC_ECL = ("<< 260787004", "<< 123037004", "<< 123037004 MINUS << 64572001",
+          "<< 373873005", "<< 243796009", "<< 123038009")
+# Requêtes ECL des Clinical finding traumatiques, avec et sans site cutané,
+# utilisées par la règle pa3
+PA3_ECL = ("<< 417746004: 363698007 = << 39937001",
+           "<< 417746004: 363698007 != << 39937001")
+# Colonnes des règles de contrôle qualité, dans l'ordre où `run_quality_control`
+# les ajoute
+RULES = ("ar2", "ar6", "bs2", "bs3", "bs5", "bs6", "bs7", "bs8", "bs9", "bs10",
+         "bs11", "bs12", "bs13", "co2", "co6", "pa3", "pa3.1", "pa4", "pa6", "pa7",
+         "pa8", "pa9", "me1", "me2", "me3", "me4", "sb1", "sb2", "sb3", "pr2", "pr3",
+         "pr4", "pr9", "pr10", "pr12", "pr13", "pr14", "pr15", "hs1", "ec2", "ec4")
 
 
 def _get_correct_case(cf_cs: pd.DataFrame) -> pd.DataFrame:
@@ -422,20 +437,26 @@ def _check_co6(cf: pd.DataFrame, co: pd.Series) -> pd.DataFrame:
     return cf
 
 
-def _check_pa3(cf: pd.DataFrame, fts: server.Fts) -> pd.DataFrame:
+def _check_pa3(cf: pd.DataFrame, fts: backend.Terminology,
+               scopes: Optional[Dict[str, pd.Index]] = None) -> pd.DataFrame:
     """Identifie les descriptions ne respectant pas la règle pa3.
 
     args:
         cf: Descriptions de la Common French à importer.
-        fts: Serveur de Terminologies FHIR contenant la version de l'édition
-            internationale dont dépend votre édition nationale non publiée
+        fts: Source de terminologie (FTS, Snowstorm ou RF2) contenant la
+            version de l'édition internationale dont dépend votre édition
+            nationale non publiée
+        scopes: Expansions déjà récupérées des requêtes `PA3_ECL`. Si absent, les
+            requêtes sont envoyées au FTS.
 
     returns:
         DataFrame de la Common French avec une colonne identifiant les
         descriptions ne respectant pas la règle pa3.
     """
-    skin_trauma = (cf.loc[:, "conceptId"].isin(fts.ecl("<< 417746004: 363698007 = << 39937001"))) # noqa
-    trauma = (cf.loc[:, "conceptId"].isin(fts.ecl("<< 417746004: 363698007 != << 39937001"))) # noqa
+    if scopes is None:
+        scopes = fts.ecl_many(PA3_ECL, candidates=cf.loc[:, "conceptId"])
+    skin_trauma = (server.isin(cf.loc[:, "conceptId"], scopes[PA3_ECL[0]]))
+    trauma = (server.isin(cf.loc[:, "conceptId"], scopes[PA3_ECL[1]]))
     sctid = cf.loc[skin_trauma
                    & (cf.loc[:, "fsn"].str.contains("injury", regex=False, case=False))
                    & (~cf.loc[:, "fsn"].str.contains("(?:crush)", case=False)) # noqa
@@ -1119,14 +1140,16 @@ def _check_ec4(cf: pd.DataFrame) -> pd.DataFrame:
     return cf
 
 
-def run_quality_control(cf: pd.DataFrame, fts: server.Fts) -> pd.DataFrame:
+def run_quality_control(cf: pd.DataFrame,
+                        fts: backend.Terminology) -> pd.DataFrame:
     """Lance l'ensemble des contrôles qualité et correction automatiques sur les
     traduction à importer.
 
     args:
         cf: Descriptions de la Common French à importer.
-        fts: Serveur de Terminologies FHIR contenant la version de l'édition
-            internationale dont dépend votre édition nationale non publiée
+        fts: Source de terminologie (FTS, Snowstorm ou RF2) contenant la
+            version de l'édition internationale dont dépend votre édition
+            nationale non publiée
 
     returns:
         DataFrame avec les traductions à importer prête pour la relecture.
@@ -1142,13 +1165,19 @@ def run_quality_control(cf: pd.DataFrame, fts: server.Fts) -> pd.DataFrame:
     cf.update(correction)
     cf = cf.reset_index()
 
+    # Expansion en parallèle de l'ensemble des périmètres ECL des règles
+    ecls = list(QC_ECL)
+    if cf.loc[:, "fsn"].str.endswith(" (disorder)").any():
+        ecls.extend(PA3_ECL)
+    scopes = fts.ecl_many(ecls, candidates=cf.loc[:, "conceptId"])
+
     # Contrôles des règles sur les articles
-    sb = (cf.loc[:, "conceptId"].isin(fts.ecl("<< 260787004")))
+    sb = (server.isin(cf.loc[:, "conceptId"], scopes["<< 260787004"]))
     cf = _check_ar2(cf)
     cf = _check_ar6(cf, sb)
 
     # Contrôles des règles de Body Structure
-    bs = (cf.loc[:, "conceptId"].isin(fts.ecl("<< 123037004")))
+    bs = (server.isin(cf.loc[:, "conceptId"], scopes["<< 123037004"]))
     if not cf.loc[bs].empty:
         cf = _check_bs2(cf)
         cf = _check_bs3(cf, bs, pt, syn)
@@ -1163,13 +1192,14 @@ def run_quality_control(cf: pd.DataFrame, fts: server.Fts) -> pd.DataFrame:
         cf = _check_bs13(cf)
 
     # Contrôles des règles de Clinical finding
-    co = (cf.loc[:, "conceptId"].isin(fts.ecl("<< 123037004 MINUS << 64572001")))
+    co = (server.isin(cf.loc[:, "conceptId"],
+                      scopes["<< 123037004 MINUS << 64572001"]))
     pa = (cf.loc[:, "fsn"].str.endswith(" (disorder)"))
     if not cf.loc[co].empty:
         cf = _check_co2(cf, co)
         cf = _check_co6(cf, co)
     if not cf.loc[pa].empty:
-        cf = _check_pa3(cf, fts)
+        cf = _check_pa3(cf, fts, scopes)
         cf = _check_pa3_1(cf)
         cf = _check_pa4(cf)
         cf = _check_pa6(cf)
@@ -1178,7 +1208,7 @@ def run_quality_control(cf: pd.DataFrame, fts: server.Fts) -> pd.DataFrame:
         cf = _check_pa9(cf)
 
     # Contrôles des règles de Pharmaceutical / biological product
-    me = (cf.loc[:, "conceptId"].isin(fts.ecl("<< 373873005")))
+    me = (server.isin(cf.loc[:, "conceptId"], scopes["<< 373873005"]))
     if not cf.loc[me].empty:
         cf = _check_me1(cf, me)
         cf = _check_me2(cf, me)
@@ -1206,12 +1236,12 @@ def run_quality_control(cf: pd.DataFrame, fts: server.Fts) -> pd.DataFrame:
         cf = _check_pr15(cf, pr)
 
     # Contrôles des règles de Situation with explicit context
-    hs = (cf.loc[:, "conceptId"].isin(fts.ecl("<< 243796009")))
+    hs = (server.isin(cf.loc[:, "conceptId"], scopes["<< 243796009"]))
     if not cf.loc[hs].empty:
         cf = _check_hs1(cf, hs)
 
     # Contrôles des règles de Specimen
-    ec = (cf.loc[:, "conceptId"].isin(fts.ecl("<< 123038009")))
+    ec = (server.isin(cf.loc[:, "conceptId"], scopes["<< 123038009"]))
     if not cf.loc[ec].empty:
         cf = _check_ec2(cf)
         cf = _check_ec4(cf)
@@ -0,0 +1,181 @@
+import re
+
+from typing import List, NamedTuple, Tuple, Union
+
+# Découpage d'une requête ECL en unités lexicales : opérateurs de contraintes,
+# opérateurs d'attributs, ponctuation, mots-clés et SCTID
+_TOKEN = re.compile(r"<<!?|>>!?|<!?|>!?|!=|=|\^|\*|:|,|\(|\)|\{|\}|[A-Za-z]+|\d+")
+# Termes optionnels entre barres verticales (ex: |Organism|)
+_TERM = re.compile(r"\|[^|]*\|")
+# Opérateurs de hiérarchie pris en charge
+OPERATORS = ("", "<<", "<", ">>", ">", "<<!", "<!", ">>!", ">!")
+# Opérateurs binaires pris en charge
+COMPOUNDS = ("AND", "OR", "MINUS")
+
+
+class Concept(NamedTuple):
+    """Contrainte sur un concept (ou `*`) précédée d'un opérateur de hiérarchie"""
+    operator: str
+    sctid: str
+
+
+class Compound(NamedTuple):
+    """Combinaison de deux contraintes par AND, OR ou MINUS"""
+    operator: str
+    left: "Node"
+    right: "Node"
+
+
+class Attribute(NamedTuple):
+    """Contrainte d'attribut d'un raffinement (`name = value` ou `name != value`)"""
+    name: "Node"
+    comparison: str
+    value: "Node"
+
+
+class Refinement(NamedTuple):
+    """Contrainte raffinée par une conjonction d'attributs"""
+    focus: "Node"
+    attributes: Tuple[Attribute, ...]
+
+
+Node = Union[Concept, Compound, Refinement]
+
+
+def normalize(ecl: str) -> str:
+    """Normalise une requête ECL pour qu'elle puisse servir de clé de cache.
+
+    Une requête prise en charge par `parse` est réécrite par `to_string` (termes
+    entre barres verticales retirés, espaces uniformisés et mots-clés en
+    majuscules). Une autre requête n'est pas interprétée : seuls ses espaces sont
+    uniformisés, pour que deux requêtes différentes ne partagent jamais une clé.
+
+    args:
+        ecl: Requête ECL
+
+    returns:
+        Requête ECL normalisée
+    """
+    try:
+        return to_string(parse(ecl))
+    except ValueError:
+        return " ".join(ecl.split())
+
+
+def _tokenize(ecl: str) -> List[str]:
+    text = _TERM.sub(" ", ecl)
+    # Un caractère non reconnu (guillemets, #, point...) ne doit pas être ignoré
+    if _TOKEN.sub("", text).strip():
+        raise ValueError(f"Syntaxe ECL non prise en charge : '{ecl}'")
+    return _TOKEN.findall(text)
+
+
+def parse(ecl: str) -> Node:
+    """Analyse le sous-ensemble de l'ECL utilisé par le projet : opérateurs de
+    hiérarchie, AND, OR, MINUS, parenthèses et raffinements par une conjonction
+    d'attributs (`=` et `!=`). Comme en ECL 2, des opérateurs binaires différents
+    doivent être séparés par des parenthèses.
+
+    args:
+        ecl: Requête ECL
+
+    returns:
+        Arbre syntaxique de la requête
+
+    raises:
+        ValueError: La requête contient une syntaxe non prise en charge
+    """
+    tokens = [t.upper() if t.isalpha() else t for t in _tokenize(ecl)]
+    node, position = _parse_expression(tokens, 0)
+    if position != len(tokens):
+        raise ValueError(f"Syntaxe ECL non prise en charge : '{ecl}'")
+
+    return node
+
+
+def to_string(node: Node) -> str:
+    """Écrit l'arbre syntaxique d'une requête ECL sous forme normalisée.
+
+    args:
+        node: Arbre syntaxique de la requête
+
+    returns:
+        Requête ECL normalisée
+    """
+    if isinstance(node, Concept):
+        return f"{node.operator} {node.sctid}" if node.operator else node.sctid
+    if isinstance(node, Compound):
+        return f"{_format_operand(node.left)} {node.operator} " \
+               f"{_format_operand(node.right)}"
+
+    attributes = " , ".join(f"{_format_operand(a.name)} {a.comparison} "
+                            f"{_format_operand(a.value)}" for a in node.attributes)
+    return f"{_format_operand(node.focus)} : {attributes}"
+
+
+def _format_operand(node: Node) -> str:
+    return to_string(node) if isinstance(node, Concept) else f"( {to_string(node)} )"
+
+
+def _expect(tokens: List[str], position: int) -> str:
+    if position >= len(tokens):
+        raise ValueError("Requête ECL incomplète")
+    return tokens[position]
+
+
+def _parse_expression(tokens: List[str], position: int) -> Tuple[Node, int]:
+    node, position = _parse_refined(tokens, position)
+    previous = None
+    while position < len(tokens) and tokens[position] in COMPOUNDS:
+        operator = tokens[position]
+        # Comme en ECL 2, des opérateurs binaires différents (ou plusieurs MINUS)
+        # ne peuvent se suivre sans parenthèses : leur ordre d'évaluation serait
+        # ambigu
+        if previous is not None and (operator != previous or operator == "MINUS"):
+            raise ValueError(f"Opérateurs {previous} et {operator} combinés sans "
+                             f"parenthèses")
+        previous = operator
+        right, position = _parse_refined(tokens, position + 1)
+        node = Compound(operator, node, right)
+
+    return node, position
+
+
+def _parse_refined(tokens: List[str], position: int) -> Tuple[Node, int]:
+    focus, position = _parse_sub(tokens, position)
+    if position >= len(tokens) or tokens[position] != ":":
+        return focus, position
+
+    # Dans un raffinement, AND et la virgule combinent les attributs
+    attributes = []
+    while True:
+        name, position = _parse_sub(tokens, position + 1)
+        comparison = _expect(tokens, position)
+        if comparison not in ("=", "!="):
+            raise ValueError(f"Comparaison d'attribut non prise en charge : "
+                             f"'{comparison}'")
+        value, position = _parse_sub(tokens, position + 1)
+        attributes.append(Attribute(name, comparison, value))
+        if position >= len(tokens) or tokens[position] not in (",", "AND"):
+            return Refinement(focus, tuple(attributes)), position
+
+
+def _parse_sub(tokens: List[str], position: int) -> Tuple[Node, int]:
+    token = _expect(tokens, position)
+    operator = ""
+    if token in OPERATORS:
+        operator, position = token, position + 1
+        token = _expect(tokens, position)
+
+    if token == "(":
+        node, position = _parse_expression(tokens, position + 1)
+        if _expect(tokens, position) != ")":
+            raise ValueError("Parenthèse fermante manquante")
+        if operator:
+            raise ValueError("Opérateur de hiérarchie sur une expression composée "
+                             "non pris en charge")
+        return node, position + 1
+    if token == "*" or token.isdigit():
+        return Concept(operator, token), position + 1
+
+    raise ValueError(f"Syntaxe ECL non prise en charge : '{token}'")
@@ -1,8 +1,24 @@
+import glob
+import gzip
+import hashlib
+import numpy as np
+import os
 import pandas as pd
+import sqlite3
+import zipfile
 
-from import_batch_ftcg import server
+from contextlib import ExitStack, closing, contextmanager, suppress
+from fnmatch import fnmatch
+from import_batch_ftcg import backend, control, server
 from os import path as op
-from typing import Set
+from typing import (IO, Any, Callable, Dict, Generator, List, Optional, Set, Tuple,
+                    Union)
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv, feather
+except ImportError:
+    pa = None
 
 CASE = {
     "900000000000448009": "ci",
@@ -15,95 +31,520 @@ ACCEPT = {
     "900000000000549004": "ACCEPTABLE"
 }
 
+# Hiérarchies 'Environment or geographical location' et 'Organism', exclues de
+# l'import
+EXCLUDED_ECL = "<< 308916002 OR << 410607006"
+# Version du format des fichiers du cache des entrées, à incrémenter lorsque
+# leur contenu change
+INPUT_CACHE_FORMAT = 2
+# Taille des morceaux lus dans les fichiers RF2 de la Common French, en octets :
+# la mémoire utilisée pendant la lecture dépend des descriptions conservées et
+# non de la taille du fichier
+CHUNK_SIZE = 16 << 20
+
+
+def locate(path: str, pattern: str) -> str:
+    """Localise un fichier RF2 d'une release à partir du motif de son nom, sans
+    extraire l'archive de la release.
+
+    args:
+        path: Fichier RF2 (éventuellement compressé par gzip), dossier d'une
+            release (ou l'un de ses sous-dossiers) ou archive ZIP d'une release
+        pattern: Motif (fnmatch) du nom du fichier recherché. Le même nom suivi de
+            l'extension .gz convient également
+
+    returns:
+        Chemin du fichier RF2, lisible par `read_rf2`. Le chemin d'un fichier
+        d'une archive ZIP est celui de l'archive suivi de celui du fichier dans
+        l'archive (ex: release.zip/Snapshot/Terminology/sct2_Description_...txt)
+    """
+    if op.isdir(path):
+        names = [op.relpath(name, path) for name in
+                 glob.glob(op.join(glob.escape(path), "**", "*"), recursive=True)]
+    elif op.isfile(path) and zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            names = archive.namelist()
+    else:
+        return path
+
+    matches = sorted(name for name in names
+                     if fnmatch(op.basename(name), pattern)
+                     or fnmatch(op.basename(name), f"{pattern}.gz"))
+    if not matches:
+        raise ValueError(f"Aucun fichier '{pattern}' dans {path}")
+    if len(matches) > 1:
+        raise ValueError(f"Plusieurs fichiers '{pattern}' dans {path} : "
+                         + ", ".join(matches))
+    return op.join(path, matches[0])
+
+
+def _archive(path: str) -> Tuple[Optional[str], str]:
+    """Sépare le chemin d'un fichier d'une archive ZIP (voir `locate`) en chemin
+    de l'archive et chemin du fichier dans l'archive (None et le chemin donné
+    pour un fichier hors archive)."""
+    archive = path
+    while archive and not op.exists(archive) and op.dirname(archive) != archive:
+        archive = op.dirname(archive)
+    if archive == path or not archive or not zipfile.is_zipfile(archive):
+        return None, path
+    return archive, op.relpath(path, archive).replace(os.sep, "/")
+
+
+@contextmanager
+def _source(path: str) -> Generator[Union[str, IO[bytes]], None, None]:
+    """Ouvre un fichier RF2, dans une archive ZIP ou compressé par gzip. Un
+    fichier ordinaire est lu directement par son chemin."""
+    archive, member = _archive(path)
+    if archive is None and not path.endswith(".gz"):
+        yield path
+        return
+
+    with ExitStack() as stack:
+        if archive is None:
+            stream = stack.enter_context(open(path, "rb"))
+        else:
+            stream = stack.enter_context(
+                stack.enter_context(zipfile.ZipFile(archive)).open(member))
+        if member.endswith(".gz"):
+            stream = stack.enter_context(gzip.GzipFile(fileobj=stream))
+        yield stream
+
+
+def _stat(path: str) -> os.stat_result:
+    """Informations sur un fichier, ou sur l'archive ZIP qui le contient."""
+    archive, _ = _archive(path)
+    return os.stat(archive or path)
+
+
+def read_rf2(path: str, columns: List[str],
+             dtype: Optional[Dict[str, type]] = None) -> pd.DataFrame:
+    """Lit un fichier RF2 (TSV sans guillemets). Si pyarrow est installé, le
+    fichier est lu par blocs en parallèle par le lecteur CSV d'Arrow, sinon par
+    celui de pandas.
+
+    args:
+        path: Chemin vers le fichier RF2, éventuellement compressé par gzip ou
+            dans une archive ZIP (voir `locate`)
+        columns: Colonnes à lire
+        dtype: Type des colonnes lues (`str` ou type numpy, `str` par défaut)
+
+    returns:
+        DataFrame contenant les colonnes demandées, sans valeur manquante
+    """
+    dtype = {column: (dtype or {}).get(column, str) for column in columns}
+    with _source(path) as source:
+        if pa is None:
+            return pd.read_csv(source, sep="\t", quoting=3, na_filter=False,
+                               dtype=dtype, usecols=columns).loc[:, columns]
+
+        table = csv.read_csv(source, read_options=csv.ReadOptions(use_threads=True),
+                             **_arrow_options(dtype))
+    return table.to_pandas()
+
+
+def read_rf2_chunks(path: str, columns: List[str],
+                    dtype: Optional[Dict[str, type]] = None,
+                    block_size: Optional[int] = None
+                    ) -> Generator[pd.DataFrame, None, None]:
+    """Lit un fichier RF2 (TSV sans guillemets) par morceaux successifs, pour le
+    filtrer sans jamais le charger entièrement en mémoire.
+
+    args:
+        path: Chemin vers le fichier RF2, éventuellement compressé par gzip ou
+            dans une archive ZIP (voir `locate`)
+        columns: Colonnes à lire
+        dtype: Type des colonnes lues (`str` ou type numpy, `str` par défaut)
+        block_size: Taille des morceaux lus, en octets (`CHUNK_SIZE` par défaut)
+
+    yields:
+        DataFrame contenant les colonnes demandées pour chaque morceau du fichier
+        (au moins un, éventuellement vide)
+    """
+    dtype = {column: (dtype or {}).get(column, str) for column in columns}
+    block_size = block_size or CHUNK_SIZE
+    with _source(path) as source:
+        if pa is None:
+            # pandas découpe le fichier en nombre de lignes, estimé à partir de la
+            # taille moyenne d'une ligne de descriptions RF2
+            chunks = pd.read_csv(source, sep="\t", quoting=3, na_filter=False,
+                                 dtype=dtype, usecols=columns,
+                                 chunksize=max(1, block_size // 100))
+            for chunk in chunks:
+                yield chunk.loc[:, columns]
+            return
+
+        reader = csv.open_csv(source,
+                              read_options=csv.ReadOptions(block_size=block_size),
+                              **_arrow_options(dtype))
+        empty = True
+        for batch in reader:
+            empty = False
+            yield batch.to_pandas()
+        if empty:
+            yield reader.schema.empty_table().to_pandas()
+
+
+def _arrow_options(dtype: Dict[str, type]) -> Dict[str, Any]:
+    """Options du lecteur CSV d'Arrow pour les colonnes d'un fichier RF2."""
+    # Les termes RF2 peuvent contenir des guillemets : ils ne délimitent pas les
+    # champs
+    return {
+        "parse_options": csv.ParseOptions(delimiter="\t", quote_char=False),
+        "convert_options": csv.ConvertOptions(
+            include_columns=list(dtype), strings_can_be_null=False,
+            column_types={column: pa.string() if t is str
+                          else pa.from_numpy_dtype(np.dtype(t))
+                          for column, t in dtype.items()})}
+
 
-def read_common_french(path: str, date: str, fts: server.Fts) -> pd.DataFrame:
+def _recode(codes: pd.Series, mapping: Dict[str, str]) -> pd.Series:
+    """Remplace des SCTID par leur libellé, une seule fois par valeur distincte
+    (recodage des catégories), les SCTID inconnus étant remplacés par NaN."""
+    return codes.astype("category").map(mapping)
+
+
+def _cached(cache_dir: Optional[str], name: str, paths: List[str],
+            read: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+    """Lit une entrée déjà filtrée et typée dans le cache des entrées (fichier
+    Arrow IPC non compressé, projeté en mémoire), ou la construit et l'y ajoute.
+    Le fichier en cache est identifié par l'empreinte (chemin, taille et date de
+    modification) des fichiers lus : il est reconstruit dès que l'un d'eux change.
+
+    args:
+        cache_dir: Dossier du cache des entrées. Si absent, ou si pyarrow n'est
+            pas installé, l'entrée est toujours construite
+        name: Nom de l'entrée
+        paths: Chemins des fichiers lus pour construire l'entrée
+        read: Construit l'entrée à partir de ces fichiers
+
+    returns:
+        DataFrame de l'entrée (index par défaut)
+    """
+    if cache_dir is None or pa is None:
+        return read()
+
+    fingerprint = hashlib.sha1(str(INPUT_CACHE_FORMAT).encode())
+    for p in paths:
+        stat = _stat(p)
+        fingerprint.update(f"|{op.abspath(p)}|{stat.st_size}|{stat.st_mtime_ns}"
+                           .encode())
+    cached = op.join(cache_dir, f"{name}-{fingerprint.hexdigest()[:16]}.arrow")
+    if op.exists(cached):
+        return feather.read_table(cached, memory_map=True).to_pandas()
+
+    df = read().reset_index(drop=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Écriture dans un fichier temporaire renommé ensuite : une exécution
+    # simultanée ne lit jamais un fichier incomplet
+    tmp = f"{cached}.{os.getpid()}.tmp"
+    feather.write_feather(pa.Table.from_pandas(df, preserve_index=False), tmp,
+                          compression="uncompressed")
+    os.replace(tmp, cached)
+    # Suppression des versions précédentes de l'entrée (une exécution simultanée
+    # peut les avoir déjà supprimées)
+    for previous in glob.glob(op.join(cache_dir, f"{glob.escape(name)}-*.arrow")):
+        if previous != cached:
+            with suppress(FileNotFoundError):
+                os.remove(previous)
+    return df
+
+
+def read_common_french(path: str, date: str, fts: backend.Terminology,
+                       cache_dir: Optional[str] = None) -> pd.DataFrame:
     """Lecture de la dernière release de la Common French.
 
     args:
-        path: Chemin vers le dossier Snapshot de la Common French
+        path: Chemin vers l'archive ZIP de la release de la Common French, ou vers
+            son dossier (ou son dossier Snapshot) une fois extraite
         date: Date de release de la Common French
-        fts: Serveur de Terminologies FHIR contenant la version de l'édition
-            internationale dont dépend votre édition nationale non publiée
+        fts: Source de terminologie (FTS, Snowstorm ou RF2) contenant la
+            version de l'édition internationale dont dépend votre édition
+            nationale non publiée
+        cache_dir: Dossier du cache des entrées, conservant les descriptions
+            lues d'une exécution à l'autre (voir `_cached`)
 
     returns:
         DataFrame contenant les informations de descriptions
     """
-    # Vérification du dossier donné en paramètre
-    if op.basename(op.normpath(path)) != "Snapshot":
-        raise ValueError("Le chemin ne pointe pas vers le dossier Snapshot")
-
-    # Lecture des descriptions de la Common French
-    p = op.join(path, f"Terminology/sct2_Description_Snapshot_CommonFrench-Extension_{date}.txt") # noqa
-    desc = pd.read_csv(p, sep="\t", quoting=3, na_filter=False,
-                       dtype={"id": str, "active": pd.CategoricalDtype(["1", "0"]),
-                              "conceptId": str, "typeId": str, "term": str},
-                       usecols=["id", "active", "conceptId", "typeId", "term",
-                                "caseSignificanceId"],
-                       converters={"caseSignificanceId": lambda x: CASE.get(x)})
-
-    # Extraire les FSN
-    active = (desc.loc[:, "active"] == "1")
-    fsn = desc.loc[(desc.loc[:, "typeId"] == "900000000000003001") & active,
-                   ["conceptId", "term"]]
+    # Recherche des fichiers Snapshot de la release, lus sans extraire l'archive
+    if not op.exists(path):
+        raise ValueError("Le chemin vers la Common French est invalide.")
+    desc_path = locate(path, f"sct2_Description_Snapshot*_{date}.txt")
+    lang_path = locate(path, f"der2_cRefset_LanguageSnapshot*_{date}.txt")
+    desc = _cached(cache_dir, "common_french", [desc_path, lang_path],
+                   lambda: _read_common_french(desc_path, lang_path))
+
+    # Retirer les traductions des hiérarchies
+    # 'Environment or geographical location' et 'Organism'
+    scope = fts.ecl_many([EXCLUDED_ECL],
+                         candidates=desc.loc[:, "conceptId"])[EXCLUDED_ECL]
+    desc = desc.loc[~server.isin(desc.loc[:, "conceptId"], scope)]
+
+    return desc
+
+
+def _read_common_french(desc_path: str, lang_path: str) -> pd.DataFrame:
+    """Lit les synonymes actifs de la Common French avec leur FSN et leur
+    acceptabilité.
+
+    args:
+        desc_path: Chemin vers le fichier de descriptions de la Common French
+        lang_path: Chemin vers le refset de langue de la Common French
+
+    returns:
+        DataFrame contenant les informations de descriptions
+    """
+    # Lecture des descriptions de la Common French par morceaux : seuls les FSN
+    # et les synonymes actifs sont conservés
+    synonyms, fsns = [], []
+    for chunk in read_rf2_chunks(desc_path, ["id", "active", "conceptId", "typeId",
+                                             "term", "caseSignificanceId"],
+                                 dtype={"id": np.int64, "conceptId": np.int64}):
+        chunk = chunk.loc[chunk.loc[:, "active"] == "1"]
+        # Extraire les FSN
+        fsns.append(chunk.loc[chunk.loc[:, "typeId"] == backend.FSN,
+                              ["conceptId", "term"]])
+        # Conserver seulement les synonymes actifs
+        synonyms.append(chunk.loc[chunk.loc[:, "typeId"] == backend.SYNONYM,
+                                  ["id", "conceptId", "term", "caseSignificanceId"]])
+    desc = pd.concat(synonyms, ignore_index=True)
+    desc.loc[:, "caseSignificanceId"] = _recode(desc.loc[:, "caseSignificanceId"],
+                                                CASE)
+    fsn = pd.concat(fsns, ignore_index=True)
     fsn.columns = ["conceptId", "fsn"]
 
-    # Conserver seulement les synonymes actifs
-    desc = desc.loc[(desc.loc[:, "typeId"] == "900000000000013009") & active]
-    # Supprimer les colonnes 'active' et 'typeId' qui ne sont plus nécessaires
-    desc = desc.drop(["active", "typeId"], axis=1)
     # Ajouter la colonne des FSN
     desc = pd.merge(desc, fsn, how="left", on="conceptId", validate="1:1")
 
-    # Lecture du refset de langue de la Common French
-    p = op.join(path, f"Refset/Language/der2_cRefset_LanguageSnapshot_CommonFrench-Extension_{date}.txt") # noqa
-    lang = pd.read_csv(p, sep="\t", na_filter=False,
-                       dtype={"referencedComponentId": str},
-                       usecols=["referencedComponentId", "acceptabilityId"],
-                       converters={"acceptabilityId": lambda x: ACCEPT.get(x)})
+    # Lecture du refset de langue de la Common French, limitée aux synonymes
+    # conservés
+    lang = pd.concat(
+        [chunk.loc[chunk.loc[:, "referencedComponentId"].isin(desc.loc[:, "id"])]
+         for chunk in read_rf2_chunks(lang_path, ["referencedComponentId",
+                                                  "acceptabilityId"],
+                                      dtype={"referencedComponentId": np.int64})],
+        ignore_index=True)
+    lang.loc[:, "acceptabilityId"] = _recode(lang.loc[:, "acceptabilityId"], ACCEPT)
 
     # Ajouter l'acceptabilité au DataFrame des descriptions
     desc = pd.merge(desc, lang, how="left", left_on="id",
                     right_on="referencedComponentId", validate="1:1")
     # Supprimer la colonne 'referencedComponentId' qui n'est plus nécessaire
-    desc = desc.drop(["referencedComponentId"], axis=1)
+    return desc.drop(["referencedComponentId"], axis=1)
 
-    # Retirer les traductions des hiérarchies
-    # 'Environment or geographical location' et 'Organism'
-    env = fts.ecl("<< 308916002")
-    org = fts.ecl("<< 410607006")
-    desc = desc.loc[(~desc.loc[:, "conceptId"].isin(env))
-                    & (~desc.loc[:, "conceptId"].isin(org))]
 
-    return desc
+def fill_missing_fsn(cf: pd.DataFrame, fts: backend.Terminology) -> pd.DataFrame:
+    """Complète les FSN absents de la Common French (concepts sans FSN français
+    actif) par les FSN anglais de l'édition internationale, récupérés en une seule
+    fois pour l'ensemble des concepts concernés.
+
+    args:
+        cf: Descriptions de la Common French
+        fts: Source de terminologie (FTS, Snowstorm ou RF2 avec descriptions)
+
+    returns:
+        DataFrame de la Common French dont la colonne 'fsn' est complétée
+    """
+    missing = cf.loc[:, "fsn"].isna()
+    if not missing.any():
+        return cf
+
+    fsn = fts.fsn(cf.loc[missing, "conceptId"].unique())
+    cf = cf.copy()
+    cf.loc[missing, "fsn"] = cf.loc[missing, "conceptId"].map(fsn)
+    return cf
+
 
+def read_changes(path: str, date: str, since: Optional[str] = None,
+                 delta: bool = False) -> Tuple[Set[int], Set[int]]:
+    """Liste les concepts et les descriptions de la Common French modifiés depuis
+    une release précédente, d'après l'effectiveTime des descriptions (FSN,
+    synonymes et descriptions inactivées) et des membres du refset de langue.
 
-def get_fr_edition(path: str, unpub_path: str) -> Set[str]:
+    args:
+        path: Chemin vers l'archive ZIP de la release de la Common French, ou vers
+            son dossier une fois extraite (voir `locate`)
+        date: Date de release de la Common French
+        since: Date de la release précédente : seules les lignes plus récentes
+            sont retenues. Si absente, toutes les lignes lues sont retenues
+        delta: Si vrai, les fichiers Delta de la release sont lus à la place des
+            fichiers Snapshot
+
+    returns:
+        SCTID des concepts dont une description a été modifiée et SCTID des
+        descriptions dont l'acceptabilité a été modifiée
+    """
+    kind = "Delta" if delta else "Snapshot"
+    desc_path = locate(path, f"sct2_Description_{kind}*_{date}.txt")
+    lang_path = locate(path, f"der2_cRefset_Language{kind}*_{date}.txt")
+
+    concepts, descriptions = set(), set()
+    for chunk in read_rf2_chunks(desc_path, ["effectiveTime", "conceptId"],
+                                 dtype={"conceptId": np.int64}):
+        if since is not None:
+            chunk = chunk.loc[chunk.loc[:, "effectiveTime"] > since]
+        concepts.update(chunk.loc[:, "conceptId"])
+    for chunk in read_rf2_chunks(lang_path, ["effectiveTime", "referencedComponentId"],
+                                 dtype={"referencedComponentId": np.int64}):
+        if since is not None:
+            chunk = chunk.loc[chunk.loc[:, "effectiveTime"] > since]
+        descriptions.update(chunk.loc[:, "referencedComponentId"])
+    return concepts, descriptions
+
+
+def select_changes(cf: pd.DataFrame, state: Optional[pd.DataFrame] = None,
+                   changes: Optional[Tuple[Set[int], Set[int]]] = None
+                   ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Sépare les descriptions de la Common French à traiter de celles dont le
+    résultat de la dernière exécution est conservé. Les descriptions d'un même
+    concept sont toujours traitées ensemble, les contrôles qualité comparant les
+    descriptions d'un concept entre elles.
+
+    args:
+        cf: Descriptions de la Common French à importer
+        state: Descriptions traitées lors de la dernière exécution (voir
+            `read_state`). Les descriptions absentes de cet état sont traitées
+        changes: Concepts et descriptions modifiés depuis la dernière exécution
+            (voir `read_changes`). Si `state` et `changes` sont absents, toutes
+            les descriptions sont traitées
+
+    returns:
+        Descriptions à traiter et descriptions conservées de la dernière exécution
+    """
+    if state is None and changes is None:
+        return cf, cf.iloc[:0]
+
+    todo = pd.Series(False, index=cf.index)
+    if changes is not None:
+        todo |= cf.loc[:, "conceptId"].isin(changes[0])
+        todo |= cf.loc[:, "id"].isin(changes[1])
+    if state is not None:
+        todo |= ~cf.loc[:, "id"].isin(state.loc[:, "id"])
+    todo = cf.loc[:, "conceptId"].isin(cf.loc[todo, "conceptId"])
+
+    if state is None:
+        return cf.loc[todo], cf.iloc[:0]
+    return cf.loc[todo], state.loc[state.loc[:, "id"].isin(cf.loc[~todo, "id"])]
+
+
+def merge_changes(cf: pd.DataFrame, processed: pd.DataFrame,
+                  kept: pd.DataFrame) -> pd.DataFrame:
+    """Fusionne les descriptions traitées et celles conservées de la dernière
+    exécution (voir `select_changes`), dans l'ordre de la Common French : le
+    résultat est celui d'une exécution complète.
+
+    args:
+        cf: Descriptions de la Common French à importer
+        processed: Descriptions traitées
+        kept: Descriptions conservées de la dernière exécution
+
+    returns:
+        DataFrame des descriptions à importer, avec les colonnes des contrôles
+        qualité non respectés par au moins une description, dans l'ordre des
+        règles (voir `control.RULES`)
+    """
+    frames = [df for df in (kept, processed) if not df.empty]
+    merged = pd.concat(frames, ignore_index=True) if frames else processed
+    order = pd.Index(merged.loc[:, "id"]).get_indexer(cf.loc[:, "id"])
+    merged = merged.iloc[order[order >= 0]].reset_index(drop=True)
+
+    # Une règle n'est plus signalée si les descriptions concernées ont été
+    # corrigées depuis la dernière exécution
+    rules = [rule for rule in control.RULES
+             if rule in merged.columns and merged.loc[:, rule].notna().any()]
+    return merged.loc[:, [*cf.columns, *rules]]
+
+
+def read_state(path: str, version: Optional[str] = None
+               ) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    """Lit l'état de la dernière exécution de l'import incrémental.
+
+    args:
+        path: Chemin vers le fichier SQLite de l'état
+        version: Version de l'édition interrogée par cette exécution. Les
+            contrôles qualité dépendant des hiérarchies de l'édition, l'état
+            obtenu avec une autre version est ignoré
+
+    returns:
+        Descriptions traitées lors de la dernière exécution et date de release de
+        la Common French lue, ou None si le fichier n'existe pas ou si l'état a
+        été obtenu avec une autre version de l'édition
+    """
+    if not op.exists(path):
+        return None, None
+
+    with closing(sqlite3.connect(path)) as db:
+        release, previous = db.execute("SELECT date, version FROM release").fetchone()
+        if previous != version:
+            return None, None
+        state = pd.read_sql("SELECT * FROM descriptions", db)
+    return state.astype({"id": np.int64, "conceptId": np.int64}), release
+
+
+def write_state(path: str, cf: pd.DataFrame, date: str,
+                version: Optional[str] = None) -> None:
+    """Sauvegarde l'état de l'import incrémental, relu par l'exécution suivante.
+
+    args:
+        path: Chemin vers le fichier SQLite de l'état
+        cf: Descriptions traitées (contrôles qualité compris)
+        date: Date de release de la Common French lue
+        version: Version de l'édition interrogée
+    """
+    # Écriture dans un fichier temporaire renommé ensuite : l'état précédent est
+    # conservé si l'écriture échoue
+    tmp = f"{path}.{os.getpid()}.tmp"
+    if op.exists(tmp):
+        os.remove(tmp)
+    with closing(sqlite3.connect(tmp)) as db:
+        cf.to_sql("descriptions", db, index=False)
+        db.execute("CREATE TABLE release (date TEXT, version TEXT)")
+        db.execute("INSERT INTO release VALUES (?, ?)", (date, version))
+        db.commit()
+    os.replace(tmp, path)
+
+
+def get_fr_edition(path: str, unpub_path: str,
+                   cache_dir: Optional[str] = None) -> Set[int]:
     """Liste les SCTID de concepts ayant des descriptions FR actives ou non, mise à
     jour avec les modifications non-publiées.
 
     args:
         path: Chemin vers le fichier des descriptions FR de l'édition nationale
+            (éventuellement compressé par gzip), ou vers l'archive ZIP (ou le
+            dossier) de sa release
         unpub_path: Chemin vers l'extrait du rapport "New and change components"
+            (éventuellement compressé par gzip)
+        cache_dir: Dossier du cache des entrées, conservant les SCTID lus d'une
+            exécution à l'autre (voir `_cached`)
 
     returns:
         Liste de SCITD
     """
     # Vérification des chemins donné en paramètre
-    if not op.isfile(path) or not op.exists(path):
+    if not op.exists(path):
         raise ValueError("Le chemin vers le fichier de descriptions est invalide.")
     if not op.isfile(unpub_path) or not op.exists(unpub_path):
         raise ValueError("Le chemin vers le fichier de modifications est invalide.")
+    path = locate(path, "sct2_Description_Snapshot-fr*.txt")
 
     # Lecture de l'édition nationale publiée
-    df = pd.read_csv(path, sep="\t", na_filter=False, dtype=str, usecols=["conceptId"])
-    published = set(df.loc[:, "conceptId"].unique())
+    df = _cached(cache_dir, "fr_edition", [path],
+                 lambda: read_rf2(path, ["conceptId"], dtype={"conceptId": np.int64})
+                 .drop_duplicates())
+    published = set(df.loc[:, "conceptId"])
 
     # Lecture des modifications non publiées de l'édition nationale
-    unpub = pd.read_csv(unpub_path, sep="\t", na_filter=False, dtype=str,
-                        usecols=["Id", "isNew"])
+    def read_unpublished() -> pd.DataFrame:
+        with _source(unpub_path) as source:
+            unpub = pd.read_csv(source, sep="\t", na_filter=False, dtype=str,
+                                usecols=["Id", "isNew"])
+        return unpub.loc[unpub.loc[:, "isNew"] == "Y", ["Id"]].astype(np.int64)
+
+    unpub = _cached(cache_dir, "unpublished", [unpub_path], read_unpublished)
 
     # Ajout des SCTID de nouvelles descriptions
-    return published.union(list(unpub.loc[unpub.loc[:, "isNew"] == "Y", "Id"]))
+    return published.union(list(unpub.loc[:, "Id"]))
 
 
 def write_batch_file(cf: pd.DataFrame, path: str) -> None:
@@ -116,6 +557,8 @@ def write_batch_file(cf: pd.DataFrame, path: str) -> None:
     """
     # Supprimer les colonnes inutiles
     cf = cf.drop(["id", "fsn"], axis=1)
+    # Les SCTID, manipulés sous forme d'entiers, sont écrits tels quels
+    cf = cf.astype({"conceptId": str})
     # Ajouter les colonnes nécessaire au respect du fichier d'import en batch
     cf.insert(1, "termRef", [""] * len(cf))
     cf.insert(2, "preferredTerm", [""] * len(cf))
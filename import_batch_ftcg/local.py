@@ -0,0 +1,429 @@
+import argparse
+import json
+import numpy as np
+import pandas as pd
+
+from import_batch_ftcg import backend, ecl as ecl_, io
+from os import path as op
+from typing import Dict, Iterable, Optional, Tuple
+
+# SCTID de l'attribut 'Is a'
+IS_A = 116680003
+# Signature des fichiers de fermeture transitive précalculée
+MAGIC = b"FTCGISA1"
+# Alignement (en octets) des tableaux dans ces fichiers
+ALIGNMENT = 64
+
+
+def _rows(indptr: np.ndarray, indices: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Concatène les lignes d'une matrice creuse au format CSR.
+
+    Args:
+        indptr: Positions de début de chaque ligne dans `indices`
+        indices: Valeurs des lignes mises bout à bout
+        rows: Lignes à concaténer
+
+    Returns:
+        Valeurs des lignes demandées
+    """
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return indices[offsets + np.arange(offsets.size)]
+
+
+def _csr(rows: np.ndarray, values: np.ndarray,
+         n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Construit une matrice creuse au format CSR à partir de couples (ligne, valeur).
+
+    Args:
+        rows: Lignes de chaque valeur
+        values: Valeurs
+        n: Nombre de lignes de la matrice
+
+    Returns:
+        Positions de début de chaque ligne et valeurs triées par ligne
+    """
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, values[order]
+
+
+def _unique(values: np.ndarray) -> np.ndarray:
+    """Trie et dédoublonne un tableau d'entiers (plus rapide que `np.unique` sur
+    des tableaux de plusieurs millions d'éléments).
+
+    Args:
+        values: Tableau d'entiers
+
+    Returns:
+        Valeurs distinctes triées
+    """
+    values = np.sort(values)
+    return values[np.concatenate((values[:1] == values[:1],
+                                  values[1:] != values[:-1]))]
+
+
+def _align(offset: int) -> int:
+    """Arrondit une position au multiple de `ALIGNMENT` supérieur."""
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _transitive_closure(parents: Tuple[np.ndarray, np.ndarray],
+                        n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Calcule la fermeture transitive de la relation 'Is a'. Les couples
+    (concept, ancêtre) sont étendus niveau par niveau, la hiérarchie étant un
+    graphe orienté acyclique : le parcours s'arrête après le plus long chemin.
+
+    Args:
+        parents: Relations 'Is a' de chaque concept vers ses parents (CSR)
+        n: Nombre de concepts
+
+    Returns:
+        Descendants (hors concept lui-même) de chaque concept (CSR)
+    """
+    indptr, _ = parents
+    concept = np.repeat(np.arange(n, dtype=np.int64), np.diff(indptr))
+    ancestor = _rows(*parents, np.arange(n, dtype=np.int64))
+    # Chaque couple est encodé par un entier pour être dédoublonné
+    levels = [concept * n + ancestor]
+    while levels[-1].size:
+        if len(levels) > n:
+            raise ValueError("La relation 'Is a' contient un cycle")
+        concept, ancestor = np.divmod(levels[-1], n)
+        lengths = indptr[ancestor + 1] - indptr[ancestor]
+        levels.append(_unique(np.repeat(concept, lengths) * n
+                              + _rows(*parents, ancestor)))
+
+    concept, ancestor = np.divmod(_unique(np.concatenate(levels)), n)
+    return _csr(ancestor, concept.astype(np.int32), n)
+
+
+class LocalTerminology(backend.Terminology):
+    """
+    Moteur ECL local, sans serveur de Terminologies, construit à partir du fichier
+    de relations (Snapshot) de l'édition internationale ou d'une fermeture
+    transitive précalculée (voir `save`)
+    """
+
+    def __init__(self, path: str, descriptions: Optional[str] = None):
+        """
+        Args:
+            path: Chemin vers le fichier sct2_Relationship_Snapshot de l'édition
+                internationale dont dépend votre édition nationale non publiée (ou
+                vers l'archive ZIP de sa release, voir `io.locate`), ou vers la
+                fermeture transitive précalculée à partir de ce fichier
+            descriptions: Chemin vers le fichier sct2_Description_Snapshot-en de la
+                même édition (ou vers l'archive ZIP de sa release), dont seuls les
+                FSN actifs sont chargés (voir `fsn`)
+        """
+        path = io.locate(path, "sct2_Relationship_Snapshot*.txt")
+        precomputed = False
+        if op.isfile(path):
+            with open(path, "rb") as f:
+                precomputed = f.read(len(MAGIC)) == MAGIC
+        if precomputed:
+            self._open(path)
+        else:
+            self._read(path)
+        self.fsns = None if descriptions is None else self._read_fsn(
+            io.locate(descriptions, "sct2_Description_Snapshot-en*.txt"))
+
+    @staticmethod
+    def _read_fsn(path: str) -> pd.Series:
+        """Charge les FSN actifs du fichier de descriptions.
+
+        Args:
+            path: Chemin vers le fichier sct2_Description_Snapshot-en
+
+        Returns:
+            FSN indexés par SCTID
+        """
+        desc = io.read_rf2(path, ["active", "conceptId", "typeId", "term"],
+                           dtype={"conceptId": np.int64})
+        desc = desc.loc[(desc.loc[:, "active"] == "1")
+                        & (desc.loc[:, "typeId"] == backend.FSN)]
+        return pd.Series(desc.loc[:, "term"].values, name="fsn",
+                         index=pd.Index(desc.loc[:, "conceptId"].values,
+                                        name="conceptId")) \
+            .groupby(level=0).last()
+
+    def _read(self, path: str) -> None:
+        """Construit les index de la hiérarchie à partir du fichier de relations.
+
+        Args:
+            path: Chemin vers le fichier sct2_Relationship_Snapshot
+        """
+        rel = io.read_rf2(path, ["effectiveTime", "active", "sourceId",
+                                 "destinationId", "typeId"],
+                          dtype={"sourceId": np.int64, "destinationId": np.int64,
+                                 "typeId": np.int64})
+        self._build(rel.loc[rel.loc[:, "active"] == "1"])
+        # La release est datée par la relation la plus récente
+        self.release = rel.loc[:, "effectiveTime"].max() if len(rel) else None
+
+    @classmethod
+    def from_relationships(cls, rel: pd.DataFrame) -> "LocalTerminology":
+        """Construit le moteur ECL à partir de relations déjà chargées (par exemple
+        une hiérarchie synthétique).
+
+        Args:
+            rel: Relations actives (colonnes sourceId, destinationId et typeId)
+
+        Returns:
+            Moteur ECL local
+        """
+        terminology = cls.__new__(cls)
+        terminology._build(rel)
+        terminology.release = None
+        terminology.fsns = None
+        return terminology
+
+    def _build(self, rel: pd.DataFrame) -> None:
+        """Construit les index de la hiérarchie à partir des relations actives.
+
+        Args:
+            rel: Relations actives (colonnes sourceId, destinationId et typeId)
+        """
+        # Index des concepts actifs : les concepts sont ensuite manipulés par leur
+        # position dans ce tableau trié
+        self.concepts = _unique(np.concatenate([rel.loc[:, "sourceId"].values,
+                                                rel.loc[:, "destinationId"].values]))
+        n = self.concepts.size
+        source = np.searchsorted(self.concepts, rel.loc[:, "sourceId"].values)
+        destination = np.searchsorted(self.concepts,
+                                      rel.loc[:, "destinationId"].values)
+        isa = (rel.loc[:, "typeId"] == IS_A).values
+
+        # Relations 'Is a' dans les deux sens (enfants et parents)
+        self._children = _csr(destination[isa], source[isa], n)
+        self._parents = _csr(source[isa], destination[isa], n)
+        # Index des relations d'attributs (hors 'Is a') par type d'attribut
+        types = np.searchsorted(self.concepts, rel.loc[~isa, "typeId"].values)
+        known = (self.concepts[types.clip(max=n - 1)]
+                 == rel.loc[~isa, "typeId"].values)
+        pairs = np.stack([source[~isa], destination[~isa]], axis=1)[known]
+        self._attributes = _csr(types[known], pairs, n)
+        self._attribute_types = np.bincount(types[known], minlength=n) > 0
+        # La fermeture transitive n'est calculée que par `save`
+        self._descendants = None
+
+    def _open(self, path: str) -> None:
+        """Projette en mémoire (mmap) une fermeture transitive précalculée : les
+        tableaux ne sont lus qu'à la demande et les pages sont partagées entre les
+        processus utilisant le même fichier.
+
+        Args:
+            path: Chemin vers la fermeture transitive précalculée
+        """
+        with open(path, "rb") as f:
+            f.seek(len(MAGIC))
+            size = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(size))
+
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        start = _align(len(MAGIC) + 8 + size)
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            offset = start + spec["offset"]
+            length = int(np.prod(spec["shape"])) * dtype.itemsize
+            arrays[name] = data[offset:offset + length].view(dtype) \
+                .reshape(spec["shape"])
+
+        self.concepts = arrays["concepts"]
+        self._children = (arrays["children_indptr"], arrays["children"])
+        self._parents = (arrays["parents_indptr"], arrays["parents"])
+        self._attributes = (arrays["attributes_indptr"], arrays["attributes"])
+        self._attribute_types = arrays["attribute_types"]
+        self._descendants = (arrays["descendants_indptr"], arrays["descendants"])
+        self.release = header.get("release")
+
+    def save(self, path: str) -> None:
+        """Calcule la fermeture transitive de la hiérarchie (descendants de chaque
+        concept) et l'enregistre, avec les autres index, dans un fichier binaire
+        pouvant être projeté en mémoire par les exécutions suivantes.
+
+        Args:
+            path: Chemin du fichier à créer
+        """
+        if self._descendants is None:
+            self._descendants = _transitive_closure(self._parents,
+                                                    self.concepts.size)
+
+        arrays = {"concepts": self.concepts,
+                  "children_indptr": self._children[0],
+                  "children": self._children[1],
+                  "parents_indptr": self._parents[0],
+                  "parents": self._parents[1],
+                  "attributes_indptr": self._attributes[0],
+                  "attributes": self._attributes[1],
+                  "attribute_types": self._attribute_types,
+                  "descendants_indptr": self._descendants[0],
+                  "descendants": self._descendants[1]}
+        header, offset = {"release": self.release, "arrays": {}}, 0
+        for name, array in arrays.items():
+            header["arrays"][name] = {"dtype": array.dtype.str,
+                                      "shape": list(array.shape), "offset": offset}
+            offset = _align(offset + array.nbytes)
+        header = json.dumps(header).encode()
+
+        with open(path, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            for array in arrays.values():
+                f.write(b"\0" * (_align(f.tell()) - f.tell()))
+                f.write(np.ascontiguousarray(array).tobytes())
+
+    def _index(self, sctid: str) -> np.ndarray:
+        position = np.searchsorted(self.concepts, int(sctid))
+        if position < self.concepts.size and self.concepts[position] == int(sctid):
+            return np.array([position])
+        return np.array([], dtype=np.int64)
+
+    def _closure(self, csr: Tuple[np.ndarray, np.ndarray], rows: np.ndarray,
+                 depth: int = -1) -> np.ndarray:
+        """Parcourt la hiérarchie (descendants ou ancêtres) à partir de concepts.
+
+        Args:
+            csr: Relations 'Is a' à parcourir (enfants ou parents)
+            rows: Positions des concepts de départ
+            depth: Profondeur maximale du parcours (-1 pour la fermeture complète)
+
+        Returns:
+            Filtre booléen sur `concepts` des concepts atteints, hors concepts de
+            départ
+        """
+        seen = np.zeros(self.concepts.size, dtype=bool)
+        frontier = rows
+        while frontier.size and depth != 0:
+            frontier = _unique(_rows(*csr, frontier))
+            frontier = frontier[~seen[frontier]]
+            seen[frontier] = True
+            depth -= 1
+
+        return seen
+
+    def _evaluate(self, node: ecl_.Node) -> np.ndarray:
+        """Évalue l'arbre syntaxique d'une requête ECL.
+
+        Args:
+            node: Arbre syntaxique de la requête
+
+        Returns:
+            Filtre booléen sur `concepts` des concepts correspondant à la requête
+        """
+        if isinstance(node, ecl_.Concept):
+            if node.sctid == "*":
+                return np.ones(self.concepts.size, dtype=bool)
+            rows = self._index(node.sctid)
+            operator = node.operator
+            csr = self._children if operator.startswith("<") else self._parents
+            mask = np.zeros(self.concepts.size, dtype=bool)
+            if operator in ("<<", "<") and self._descendants is not None:
+                mask[_rows(*self._descendants, rows)] = True
+            elif operator:
+                mask |= self._closure(csr, rows, 1 if operator.endswith("!") else -1)
+            if operator in ("", "<<", ">>", "<<!", ">>!"):
+                mask[rows] = True
+            return mask
+
+        if isinstance(node, ecl_.Compound):
+            left, right = self._evaluate(node.left), self._evaluate(node.right)
+            if node.operator == "AND":
+                return left & right
+            if node.operator == "OR":
+                return left | right
+            return left & ~right
+
+        mask = self._evaluate(node.focus)
+        for attribute in node.attributes:
+            types = np.flatnonzero(self._evaluate(attribute.name)
+                                   & self._attribute_types)
+            value = self._evaluate(attribute.value)
+            pairs = _rows(*self._attributes, types)
+            if attribute.comparison == "=":
+                pairs = pairs[value[pairs[:, 1]]]
+            else:
+                pairs = pairs[~value[pairs[:, 1]]]
+            matches = np.zeros(self.concepts.size, dtype=bool)
+            matches[pairs[:, 0]] = True
+            mask &= matches
+
+        return mask
+
+    def ecl(self, ecl: str) -> pd.Index:
+        """Évalue une requête ECL localement
+
+        Args:
+            ecl: Requête ECL
+
+        Returns:
+            Index (immuable et sans doublon) des SCTID correspondant à la requête
+            ECL, à tester avec `server.isin`
+        """
+        codes = self.concepts[self._evaluate(ecl_.parse(ecl))]
+        return pd.Index(codes.astype(np.int64))
+
+    def ecl_many(self, ecls: Iterable[str],
+                 candidates: Optional[Iterable[int]] = None) -> Dict[str, pd.Index]:
+        """Évalue localement plusieurs requêtes ECL
+
+        Args:
+            ecls: Requêtes ECL
+            candidates: Ignoré : l'évaluation locale des hiérarchies entières est
+                déjà immédiate
+
+        Returns:
+            Dictionnaire associant chaque requête ECL à l'index des SCTID
+            correspondants
+        """
+        return {ecl: self.ecl(ecl) for ecl in dict.fromkeys(ecls)}
+
+    def fsn(self, concepts: Iterable[int]) -> pd.Series:
+        """Récupère le FSN de concepts dans le fichier de descriptions chargé
+
+        Args:
+            concepts: SCTID des concepts
+
+        Returns:
+            FSN de chaque concept (indexés par SCTID, sans doublon), absents pour
+            les concepts sans FSN actif
+
+        Raises:
+            ValueError: Aucun fichier de descriptions n'a été chargé
+        """
+        if self.fsns is None:
+            raise ValueError("Les FSN ne sont pas disponibles : aucun fichier de "
+                             "descriptions RF2 n'est chargé")
+        concepts = pd.Index(list(dict.fromkeys(concepts)), dtype=np.int64,
+                            name="conceptId")
+        return self.fsns.reindex(concepts).astype(object)
+
+    def version(self) -> Optional[str]:
+        """Date la release à partir de la relation la plus récente
+
+        Returns:
+            URI de version de l'édition internationale, ou None pour une
+            hiérarchie construite par `from_relationships`
+        """
+        if self.release is None:
+            return None
+        return f"{backend.INTERNATIONAL}/version/{self.release}"
+
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser(
+        description="Précalcule la fermeture transitive d'une édition internationale")
+    cli.add_argument("rf2", type=str,
+                     help="Chemin vers le fichier sct2_Relationship_Snapshot (ou \
+                     vers l'archive ZIP de la release)")
+    cli.add_argument("output", type=str,
+                     help="Emplacement et nom du fichier de fermeture transitive")
+    args = cli.parse_args()
+
+    print("\nCalcul de la fermeture transitive...", end="\r")
+    LocalTerminology(args.rf2).save(args.output)
+    print(f"Calcul de la fermeture transitive ({args.output}) - OK")
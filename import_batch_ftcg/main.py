@@ -1,33 +1,155 @@
 #!/usr/bin/env python3
 
 import argparse
+import requests
 
-from import_batch_ftcg import control, io, server
+from import_batch_ftcg import aio, control, io, local, server, snowstorm
+from import_batch_ftcg.cache import ExpansionCache
 
 if __name__ == "__main__":
     cli = argparse.ArgumentParser()
     cli.add_argument("cf_path", type=str,
-                     help="Chemin vers le dossier Snapshot de la Common French")
+                     help="Chemin vers l'archive ZIP de la release de la Common \
+                     French ou vers son dossier Snapshot")
     cli.add_argument("cf_date", type=str, help="Date de release de la Common French")
     cli.add_argument("fr_path", type=str, help="Chemin vers le fichier de descriptions \
-                     FR de l'édition nationale")
+                     FR de l'édition nationale (ou vers l'archive ZIP de sa release)")
     cli.add_argument("unpub_fr_path", type=str,
                      help="Chemin vers l'extrait du rapport New and change components")
     cli.add_argument("endpoint", type=str,
-                     help="Endpoint du FTS contenant l'édition internationale dont \
-                        dépend l'édition nationale non publiée")
+                     help="Endpoint du FTS (ou de l'API REST Snowstorm) contenant \
+                        l'édition internationale dont dépend l'édition nationale \
+                        non publiée")
     cli.add_argument("output", type=str, help="Emplacement et nom du fichier de sortie")
+    cli.add_argument("--cache", type=str, default=None,
+                     help="Chemin vers le fichier SQLite de cache des expansions ECL")
+    cli.add_argument("--cache-ttl", type=float, default=168,
+                     help="Durée de validité des expansions en cache (en heures)")
+    cli.add_argument("--cache-size", type=int, default=512,
+                     help="Taille maximale du cache des expansions (en Mo)")
+    cli.add_argument("--input-cache", type=str, default=None,
+                     help="Dossier du cache des fichiers d'entrée déjà lus (format \
+                        Arrow, nécessite pyarrow)")
+    cli.add_argument("--state", type=str, default=None,
+                     help="Chemin vers le fichier SQLite de l'état de l'import \
+                        incrémental : seules les descriptions modifiées depuis la \
+                        dernière exécution sont traitées")
+    cli.add_argument("--since", type=str, default=None,
+                     help="Date (YYYYMMDD) de la release précédente de la Common \
+                        French : seules les descriptions plus récentes sont \
+                        traitées (par défaut, celle de l'état de --state)")
+    cli.add_argument("--delta", type=str, default=None,
+                     help="Chemin vers l'archive ZIP (ou le dossier) de la release \
+                        contenant les fichiers Delta de la Common French : seules \
+                        les descriptions modifiées dans ces fichiers sont traitées")
+    cli.add_argument("--memory-size", type=int, default=None,
+                     help="Nombre maximal de codes d'expansion conservés en mémoire \
+                        (5 000 000 par défaut)")
+    cli.add_argument("--timeout", type=float, nargs=2, default=(10, 300),
+                     metavar=("CONNEXION", "LECTURE"),
+                     help="Délais maximaux de connexion et de lecture du FTS (en s)")
+    cli.add_argument("--retries", type=int, default=5,
+                     help="Nombre maximal de nouvelles tentatives sur erreur du FTS")
+    cli.add_argument("--page-size", type=int, default=5000,
+                     help="Nombre de codes demandés par page d'expansion ECL")
+    cli.add_argument("--max-in-flight", type=int, default=8,
+                     help="Nombre maximal de requêtes envoyées simultanément au FTS")
+    cli.add_argument("--membership", action="store_true",
+                     help="N'interroge le FTS que sur les concepts à importer au \
+                        lieu d'expanser les hiérarchies entières")
+    cli.add_argument("--batch", action="store_true",
+                     help="Envoie les requêtes ECL au FTS dans un seul Bundle FHIR \
+                        de type batch")
+    cli.add_argument("--http2", action="store_true",
+                     help="Utilise le client asynchrone du FTS : les expansions et \
+                        leurs pages sont multiplexées sur une connexion HTTP/2")
+    cli.add_argument("--edition-version", type=str, default=None,
+                     help="URI de version de l'édition internationale interrogée \
+                        sur le FTS (ex: \
+                        http://snomed.info/sct/900000000000207008/version/20240101)")
+    cli.add_argument("--trace", type=str, default=None,
+                     help="Chemin vers un fichier JSON lines traçant chaque requête \
+                        ECL envoyée au FTS")
+    cli.add_argument("--backend", choices=("fhir", "snowstorm", "rf2"), default=None,
+                     help="Source de terminologie : serveur FHIR (par défaut), API \
+                        REST d'un serveur Snowstorm ou fichiers RF2 (avec --rf2)")
+    cli.add_argument("--branch", type=str, default="MAIN",
+                     help="Branche Snowstorm interrogée avec --backend snowstorm")
+    cli.add_argument("--rf2", type=str, default=None,
+                     help="Chemin vers le fichier sct2_Relationship_Snapshot de \
+                        l'édition internationale : les requêtes ECL sont alors \
+                        évaluées localement, sans FTS")
+    cli.add_argument("--rf2-descriptions", type=str, default=None,
+                     help="Chemin vers le fichier sct2_Description_Snapshot-en de \
+                        l'édition internationale : les FSN absents de la Common \
+                        French sont complétés localement avec --backend rf2")
     args = cli.parse_args()
+    if args.backend is None:
+        args.backend = "rf2" if args.rf2 is not None else "fhir"
+    if args.backend == "rf2" and args.rf2 is None:
+        cli.error("--backend rf2 nécessite --rf2")
+    if args.edition_version is not None and args.backend != "fhir":
+        # Seul le FTS permet de choisir la version expansée : Snowstorm interroge
+        # la branche et le moteur local les fichiers RF2 donnés
+        cli.error("--edition-version nécessite --backend fhir")
+    if args.http2:
+        # Le client asynchrone n'expanse que des hiérarchies entières, sans cache
+        # mémoire borné ni mesures des requêtes
+        if args.backend != "fhir":
+            cli.error("--http2 nécessite --backend fhir")
+        for option in ("membership", "batch", "trace", "memory_size"):
+            if getattr(args, option) not in (None, False):
+                cli.error(f"--{option.replace('_', '-')} n'est pas disponible avec "
+                          "--http2")
+    if args.memory_size is None:
+        args.memory_size = 5_000_000
 
-    # Initialisation de la classe de gestion du FTS
-    fts = server.Fts(args.endpoint)
+    # Initialisation du cache des expansions ECL
+    cache = None
+    if args.cache is not None:
+        cache = ExpansionCache(args.cache, ttl=args.cache_ttl * 3600,
+                               max_size=args.cache_size * 1024 * 1024)
+    # Initialisation de la source de terminologie : FTS, Snowstorm ou moteur ECL
+    # local
+    if args.backend == "rf2":
+        print("\nChargement des relations RF2...", end="\r")
+        fts = local.LocalTerminology(args.rf2, args.rf2_descriptions)
+        print(f"Chargement des relations RF2 ({len(fts.concepts)} concepts) - OK")
+    elif args.backend == "snowstorm":
+        fts = snowstorm.Snowstorm(args.endpoint, branch=args.branch, cache=cache,
+                                  timeout=tuple(args.timeout), retries=args.retries,
+                                  max_in_flight=args.max_in_flight,
+                                  memory_size=args.memory_size)
+    elif args.http2:
+        fts = aio.SyncFts(aio.AsyncFts(args.endpoint, cache=cache,
+                                       timeout=tuple(args.timeout),
+                                       retries=args.retries, page_size=args.page_size,
+                                       max_in_flight=args.max_in_flight,
+                                       version=args.edition_version))
+    else:
+        fts = server.Fts(args.endpoint, cache=cache, timeout=tuple(args.timeout),
+                         retries=args.retries, page_size=args.page_size,
+                         max_in_flight=args.max_in_flight,
+                         membership=args.membership, trace_path=args.trace,
+                         memory_size=args.memory_size, batch=args.batch,
+                         version=args.edition_version)
+        if args.batch and not args.membership:
+            # Les expansions toujours nécessaires sont récupérées en un
+            # aller-retour, puis lues en mémoire par la lecture et les contrôles.
+            # Celles de la règle pa3, les plus volumineuses, ne sont récupérées que
+            # si la Common French contient des troubles
+            print("Préchargement des expansions ECL...", end="\r")
+            fts.ecl_many([io.EXCLUDED_ECL, *control.QC_ECL])
+            print("Préchargement des expansions ECL - OK")
     # Lecture et pré-processus de la Common French
     print("\nExtraction Common French...", end="\r")
-    cf = io.read_common_french(args.cf_path, args.cf_date, fts)
+    cf = io.read_common_french(args.cf_path, args.cf_date, fts,
+                               cache_dir=args.input_cache)
     print(f"Extraction Common French ({len(cf)} lignes) - OK")
     # Lecture et pré-processus de l'édition nationale
     print("Extraction édition nationale...", end="\r")
-    fr = io.get_fr_edition(args.fr_path, args.unpub_fr_path)
+    fr = io.get_fr_edition(args.fr_path, args.unpub_fr_path,
+                           cache_dir=args.input_cache)
     print(f"Extraction édition nationale ({len(fr)} SCTID) - OK")
 
     # Conserve seulement les traductions de la Common French pour des concepts dans
@@ -35,12 +157,62 @@ if __name__ == "__main__":
     cf = cf.loc[~cf.loc[:, "conceptId"].isin(fr)]
     print(f"\nRéduction de la Common French à importer ({len(cf)} lignes) - OK")
 
+    # Import incrémental : seuls les concepts modifiés depuis la dernière exécution
+    # sont traités, les résultats des autres sont repris de son état
+    candidates, kept = cf, cf.iloc[:0]
+    state, release, version = None, None, None
+    if args.state is not None:
+        # Les contrôles qualité dépendent des hiérarchies de l'édition : un état
+        # obtenu avec une autre version, ou si elle ne peut pas être récupérée, est
+        # ignoré et toutes les descriptions sont traitées
+        errors = (requests.RequestException,) if aio.httpx is None \
+            else (requests.RequestException, aio.httpx.HTTPError)
+        try:
+            version = fts.version()
+        except errors as error:
+            print(f"Version de l'édition inconnue ({error}) : l'état de l'import "
+                  f"incrémental est ignoré")
+        else:
+            state, release = io.read_state(args.state, version)
+    since = args.since or release
+    if (args.state is None or state is not None) \
+            and (since is not None or args.delta is not None):
+        print("Sélection des descriptions modifiées...", end="\r")
+        changes = io.read_changes(args.delta or args.cf_path, args.cf_date, since,
+                                  delta=args.delta is not None)
+        cf, kept = io.select_changes(cf, state, changes)
+        print(f"Sélection des descriptions modifiées ({len(cf)} lignes à traiter, "
+              f"{len(kept)} conservées) - OK")
+
+    # Complète les FSN absents de la Common French, utilisés par les contrôles
+    if args.backend != "rf2" or args.rf2_descriptions is not None:
+        print("Récupération des FSN manquants...", end="\r")
+        missing = cf.loc[:, "fsn"].isna().sum()
+        cf = io.fill_missing_fsn(cf, fts)
+        print(f"Récupération des FSN manquants ({missing} descriptions) - OK")
+
     # Vérification des règles pour relecture
     print("\nVérification du respect des règles éditoriales...", end="\r")
-    cf = control.run_quality_control(cf, fts)
+    if not cf.empty:
+        cf = control.run_quality_control(cf, fts)
     print("Vérification du respect des règles éditoriales - OK")
 
+    # Fusion avec les résultats conservés de la dernière exécution
+    cf = io.merge_changes(candidates, cf, kept)
+    if args.state is not None:
+        io.write_state(args.state, cf, args.cf_date, version)
+
     # Ecriture du fichier d'import
     print("\nSauvegarde du fichier d'import...", end="\r")
     io.write_batch_file(cf, args.output)
     print(f"Sauvegarde du fichier d'import ({args.output}) - OK")
+
+    # Résumé des requêtes envoyées au FTS
+    if isinstance(fts, server.Fts):
+        summary = fts.summary()
+        print(f"\nRequêtes ECL ({len(summary)} requêtes, "
+              f"{summary.loc[:, 'requests'].sum()} requêtes HTTP, "
+              f"{summary.loc[:, 'bytes'].sum() / 1e6:.1f} Mo) :")
+        print(summary.to_string(index=False))
+    elif isinstance(fts, aio.SyncFts):
+        fts.close()
@@ -0,0 +1,65 @@
+import pandas as pd
+
+from import_batch_ftcg import ecl as ecl_
+from typing import Dict, List, Optional, Tuple
+
+
+def split(ecl: str) -> Tuple[Optional[ecl_.Node], List[str]]:
+    """Décompose une requête ECL en sous-requêtes élémentaires à expanser par le
+    FTS, dont les résultats sont ensuite combinés localement (AND, OR, MINUS).
+
+    Les contraintes sur un concept et les raffinements sont élémentaires : les
+    expansions de `A : x = y` et de `A : x != y` ne se déduisent pas l'une de
+    l'autre ni de celle de `A`.
+
+    args:
+        ecl: Requête ECL
+
+    returns:
+        Arbre syntaxique de la requête (None si sa syntaxe n'est pas prise en
+        charge, elle est alors envoyée telle quelle) et sous-requêtes élémentaires
+        normalisées, sans doublon
+    """
+    try:
+        node = ecl_.parse(ecl)
+    except ValueError:
+        return None, [ecl]
+
+    leaves = []
+    _leaves(node, leaves)
+    return node, list(dict.fromkeys(leaves))
+
+
+def combine(ecl: str, node: Optional[ecl_.Node],
+            expansions: Dict[str, pd.Index]) -> pd.Index:
+    """Calcule l'expansion d'une requête ECL à partir de celles de ses
+    sous-requêtes élémentaires.
+
+    args:
+        ecl: Requête ECL
+        node: Arbre syntaxique de la requête renvoyé par `split`
+        expansions: Expansions des sous-requêtes élémentaires renvoyées par `split`
+
+    returns:
+        Index des SCTID correspondant à la requête ECL
+    """
+    if node is None:
+        return expansions[ecl]
+    if not isinstance(node, ecl_.Compound):
+        return expansions[ecl_.to_string(node)]
+
+    left = combine(ecl, node.left, expansions)
+    right = combine(ecl, node.right, expansions)
+    if node.operator == "OR":
+        return left.union(right, sort=False)
+    if node.operator == "AND":
+        return left.intersection(right, sort=False)
+    return left.difference(right, sort=False)
+
+
+def _leaves(node: ecl_.Node, leaves: List[str]) -> None:
+    if isinstance(node, ecl_.Compound):
+        _leaves(node.left, leaves)
+        _leaves(node.right, leaves)
+    else:
+        leaves.append(ecl_.to_string(node))
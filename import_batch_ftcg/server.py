@@ -1,34 +1,915 @@
+import json
+import numpy as np
+import pandas as pd
 import requests
+import threading
+import time
 
-from typing import List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from import_batch_ftcg import backend, planner
+from import_batch_ftcg.cache import Entry, ExpansionCache, MemoryCache
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict, Generator, Iterable, List, NamedTuple, Optional, Tuple
+from urllib3.util.retry import Retry
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
-class Fts:
+
+class _Retry(Retry):
+    """Politique de nouvelles tentatives comptant les tentatives du thread courant
+    (une requête HTTP est toujours traitée dans un seul thread)"""
+    count = threading.local()
+
+    def increment(self, *args, **kwargs) -> Retry:
+        _Retry.count.value = getattr(_Retry.count, "value", 0) + 1
+        return super().increment(*args, **kwargs)
+
+
+class Page(NamedTuple):
+    """Page d'expansion renvoyée par le FTS"""
+    total: Optional[int]
+    codes: List[str]
+    version: Optional[str] = None
+    etag: Optional[str] = None
+    modified: Optional[str] = None
+
+
+# Paramètres d'une expansion indiquant la version de l'édition utilisée
+VERSION_PARAMETERS = ("version", "used-codesystem")
+
+
+def edition_version(version: Optional[str]) -> Optional[str]:
+    """Normalise la version de l'édition annoncée par le FTS. Dans les expansions,
+    de nombreux serveurs (Ontoserver, Snowstorm) la préfixent par le système
+    (`http://snomed.info/sct|http://snomed.info/sct/.../version/YYYYMMDD`), alors
+    que `CodeSystem/$lookup` renvoie l'URI de version seule.
+
+    Args:
+        version: Version annoncée par le FTS
+
+    Returns:
+        URI de version de l'édition, sans le système
+    """
+    return None if version is None else version.rsplit("|", 1)[-1]
+
+
+def _moment(value: Optional[str]) -> Optional[datetime]:
+    """Lit une date de modification, date HTTP (`Last-Modified`) ou instant FHIR
+    (`Bundle.entry.response.lastModified`, ISO 8601), en UTC."""
+    if value is None:
+        return None
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            moment = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def http_date(value: Optional[str]) -> Optional[str]:
+    """Convertit une date de modification en date HTTP, format des en-têtes
+    `Last-Modified` et `If-Modified-Since` et des expansions en cache.
+
+    Args:
+        value: Date HTTP ou instant FHIR
+
+    Returns:
+        Date HTTP, ou None si la date est absente ou illisible
+    """
+    moment = _moment(value)
+    return None if moment is None else format_datetime(moment, usegmt=True)
+
+
+def fhir_instant(value: Optional[str]) -> Optional[str]:
+    """Convertit une date de modification en instant FHIR, format de
+    `Bundle.entry.request.ifModifiedSince`.
+
+    Args:
+        value: Date HTTP ou instant FHIR
+
+    Returns:
+        Instant ISO 8601, ou None si la date est absente ou illisible
+    """
+    moment = _moment(value)
+    return None if moment is None else moment.isoformat()
+
+
+def page_url(url: str, offset: int, count: int) -> str:
+    """Construit l'URL d'une page d'expansion.
+
+    Args:
+        url: URL de l'expansion de la requête ECL (sans pagination)
+        offset: Position du premier code de la page
+        count: Nombre de codes demandés
+
+    Returns:
+        URL de la page
+    """
+    # Seuls les codes sont conservés : le FTS est invité à ne pas renvoyer les
+    # désignations ni les éléments hors de l'expansion
+    return f"{url}&includeDesignations=false&_elements=expansion" \
+           f"&count={count}&offset={offset}"
+
+
+def expansion(resource: Dict[str, Any]
+              ) -> Tuple[Optional[int], List[str], Optional[str]]:
+    """Extrait le total, les codes et la version d'une expansion déjà lue.
+
+    Args:
+        resource: Élément `expansion` d'une ressource ValueSet
+
+    Returns:
+        Nombre total de codes annoncé par le FTS (s'il est fourni), liste des
+        SCTID de la page et version de l'édition (si elle est fournie)
+    """
+    version = edition_version(next((p.get("valueUri", p.get("valueString"))
+                                    for p in resource.get("parameter", [])
+                                    if p.get("name") in VERSION_PARAMETERS), None))
+    return (resource.get("total"),
+            [r.get("code", "") for r in resource.get("contains", {})], version)
+
+
+def pinned(page: Page, version: Optional[str]) -> Page:
+    """Vérifie qu'une page d'expansion a été obtenue avec la version fixée de
+    l'édition.
+
+    Args:
+        page: Page d'expansion
+        version: URI de version fixée de l'édition, ou None si elle ne l'est pas
+
+    Returns:
+        La page d'expansion
+
+    Raises:
+        ValueError: Le FTS a annoncé une autre version
+    """
+    if version is not None and page.version is not None and page.version != version:
+        raise ValueError(f"Le FTS a expansé la version {page.version} au lieu "
+                         f"de {version}")
+    return page
+
+
+def lookup_parameters(resource: Optional[Dict[str, Any]],
+                      name: str) -> List[Dict[str, Any]]:
+    """Sélectionne les paramètres d'une ressource Parameters par leur nom.
+
+    Args:
+        resource: Ressource Parameters (réponse de `CodeSystem/$lookup`), ou None
+            si le concept est inconnu
+        name: Nom des paramètres
+
+    Returns:
+        Paramètres portant ce nom
+    """
+    if resource is None:
+        return []
+    return [p for p in resource.get("parameter", []) if p.get("name") == name]
+
+
+def session(retries: int = 5, backoff: float = 1,
+            pool_size: int = 10) -> requests.Session:
+    """Crée une session HTTP partagée : les connexions (TCP/TLS) sont réutilisées
+    d'une requête à l'autre, et les erreurs de connexion et réponses 429/5xx sont
+    suivies de nouvelles tentatives avec attente exponentielle.
+
+    Args:
+        retries: Nombre maximal de nouvelles tentatives
+        backoff: Facteur de l'attente exponentielle entre deux tentatives, en
+            secondes
+        pool_size: Nombre maximal de connexions conservées ouvertes
+
+    Returns:
+        Session HTTP acceptant les réponses JSON compressées
+    """
+    # Les seules requêtes POST envoyées sont des Bundle batch de lectures : elles
+    # peuvent être répétées sans risque
+    retry = _Retry(total=retries, backoff_factor=backoff,
+                   allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"POST"},
+                   status_forcelist=(429, 500, 502, 503, 504),
+                   respect_retry_after_header=True, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                          max_retries=retry)
+    s = requests.Session()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    s.headers.update({"Accept-Encoding": "gzip, deflate"})
+    return s
+
+
+class Fts(backend.Terminology):
     """
     Classe regroupant les interactions avec le serveur de Terminologies FHIR de votre
     choix
     """
 
-    def __init__(self, endpoint: str):
+    def __init__(self, endpoint: str, cache: Optional[ExpansionCache] = None,
+                 timeout: Tuple[float, float] = (10, 300), retries: int = 5,
+                 backoff: float = 1, pool_size: int = 10, page_size: int = 5000,
+                 prefetch: int = 4, max_in_flight: int = 8, membership: bool = False,
+                 chunk_size: int = 100, trace_path: Optional[str] = None,
+                 memory_size: int = 5_000_000, batch: bool = False,
+                 version: Optional[str] = None):
         """
         Args:
             endpoint: Endpoint de votre serveur de Terminologies FHIR
+            cache: Cache persistant des expansions ECL. Si absent, chaque requête
+                ECL est envoyée au FTS
+            timeout: Délais maximaux de connexion et de lecture, en secondes
+            retries: Nombre maximal de nouvelles tentatives après une erreur de
+                connexion ou une réponse 429/5xx
+            backoff: Facteur de l'attente exponentielle entre deux tentatives, en
+                secondes
+            pool_size: Nombre maximal de connexions conservées ouvertes vers le FTS
+            page_size: Nombre de codes demandés par page d'expansion
+            prefetch: Nombre maximal de pages d'expansion téléchargées en avance
+            max_in_flight: Nombre maximal de requêtes envoyées simultanément au FTS
+            membership: Si vrai, `ecl_many` n'interroge le FTS que sur les concepts
+                candidats qui lui sont donnés, au lieu d'expanser les hiérarchies
+                entières
+            chunk_size: Nombre de concepts candidats par requête en mode
+                `membership`
+            trace_path: Chemin vers un fichier JSON lines dans lequel chaque
+                requête ECL est tracée dès qu'elle est terminée
+            memory_size: Nombre total maximal de codes des expansions conservées
+                en mémoire
+            batch: Si vrai, `ecl_many` envoie les premières pages de toutes les
+                expansions dans un seul Bundle FHIR de type batch
+            version: URI de version de l'édition interrogée (ex:
+                http://snomed.info/sct/900000000000207008/version/20240101). Si
+                absente, le FTS utilise la version de son choix, et les expansions
+                en cache obtenues avec une autre version sont invalidées
+
+        Raises:
+            ValueError: La version n'est pas une URI de version de l'édition
+                internationale
         """
+        version = edition_version(version)
+        if version is not None \
+                and not version.startswith(f"{backend.INTERNATIONAL}/version/"):
+            raise ValueError(f"Version de l'édition invalide : {version}")
         self.endpoint = endpoint
-        self.ecl_base_url = f"{endpoint}/ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/" # noqa
+        # L'édition interrogée (et la clé des expansions en cache) inclut la version
+        # si elle est fixée
+        self.edition = version or backend.INTERNATIONAL
+        self.pinned = version
+        self.ecl_base_url = f"{endpoint}/ValueSet/$expand?url={self.edition}?fhir_vs=ecl/" # noqa
+        self.cache = cache
+        self.timeout = timeout
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.max_in_flight = max_in_flight
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.membership = membership
+        self.chunk_size = chunk_size
+        self.batch = batch
+        # Expansions des sous-requêtes élémentaires déjà récupérées ou en cours
+        self.memory = MemoryCache(memory_size)
+        # Version de l'édition annoncée par le FTS, récupérée au plus une fois pour
+        # invalider les expansions en cache (voir `_current`)
+        self._current_version: Optional[str] = None
+        self._version_lock = threading.Lock()
+        self._version_checked = False
+        # Mesures de chaque requête ECL (voir `summary`)
+        self.trace: List[Dict[str, Any]] = []
+        self.trace_path = trace_path
+        self._trace_lock = threading.Lock()
+
+        self.session = session(retries, backoff, pool_size)
+        self.session.headers.update({"Accept": "application/fhir+json"})
 
-    def ecl(self, ecl: str) -> List[str]:
-        """Envoie une requête ECL au FTS
+    def ecl(self, ecl: str) -> pd.Index:
+        """Envoie une requête ECL au FTS. Ses sous-requêtes élémentaires (voir
+        `planner.split`) sont expansées une seule fois par instance, et lues dans le
+        cache si elles y sont présentes, puis combinées localement
 
         Args:
             ecl: Requête ECL
 
         Returns:
-            Liste des SCTID correspondant à la requête ECL
+            Index (immuable et sans doublon) des SCTID correspondant à la requête
+            ECL, à tester avec `isin`
+        """
+        node, leaves = planner.split(ecl)
+        return planner.combine(ecl, node, {leaf: self._expand(leaf) for leaf in leaves})
+
+    def ecl_many(self, ecls: Iterable[str],
+                 candidates: Optional[Iterable[int]] = None) -> Dict[str, pd.Index]:
+        """Envoie en parallèle plusieurs requêtes ECL au FTS. Les sous-requêtes
+        élémentaires communes à plusieurs requêtes ne sont expansées qu'une fois
+
+        Args:
+            ecls: Requêtes ECL
+            candidates: Concepts dont l'appartenance aux requêtes ECL est testée.
+                En mode `membership`, seuls ces concepts sont envoyés au FTS et
+                renvoyés ; sinon les requêtes sont expansées entièrement
+
+        Returns:
+            Dictionnaire associant chaque requête ECL à l'index des SCTID
+            correspondants
+        """
+        plans = {ecl: planner.split(ecl) for ecl in ecls}
+        leaves = list(dict.fromkeys(leaf for _, split in plans.values()
+                                    for leaf in split))
+        if self.membership and candidates is not None:
+            expansions = self._members(leaves, candidates)
+        elif self.batch:
+            # Les expansions absentes de la mémoire sont récupérées ensemble puis
+            # y sont ajoutées (sauf si un autre thread les a récupérées entre-temps)
+            missing = [leaf for leaf in leaves if leaf not in self.memory]
+            fetched = self._fetch_many(missing) if len(missing) > 1 else {}
+
+            def expand(leaf: str) -> pd.Index:
+                return self.memory.get(leaf, lambda: fetched[leaf] if leaf in fetched
+                                       else self._fetch(leaf))
+
+            expansions = {leaf: expand(leaf) for leaf in leaves}
+        elif len(leaves) <= 1:
+            expansions = {leaf: self._expand(leaf) for leaf in leaves}
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+                expansions = dict(zip(leaves, pool.map(self._expand, leaves)))
+
+        return {ecl: planner.combine(ecl, node, expansions)
+                for ecl, (node, _) in plans.items()}
+
+    def _expand(self, ecl: str) -> pd.Index:
+        """Expanse une requête ECL élémentaire, au plus une fois par instance tant
+        qu'elle reste dans le cache mémoire : les appels simultanés partagent la
+        même expansion
+
+        Args:
+            ecl: Requête ECL élémentaire
+
+        Returns:
+            Index des SCTID correspondant à la requête ECL
+        """
+        return self.memory.get(ecl, lambda: self._fetch(ecl))
+
+    def _fetch(self, ecl: str) -> pd.Index:
+        """Récupère l'expansion d'une requête ECL élémentaire dans le cache
+        persistant si elle y est présente, sinon auprès du FTS. Une expansion
+        expirée est revalidée : elle n'est pas téléchargée de nouveau si le FTS
+        répond 304 à une requête conditionnelle (`ETag`, `Last-Modified`) ou
+        annonce la même version de l'édition
+
+        Args:
+            ecl: Requête ECL élémentaire
+
+        Returns:
+            Index des SCTID correspondant à la requête ECL
+        """
+        stats = self._start(ecl)
+        entry = self._lookup(ecl, stats)
+        if entry is not None and entry.fresh:
+            self._stop(stats, len(entry.codes))
+            return backend.sctids(entry.codes)
+
+        first = self._page(self._url(ecl), 0, self.page_size, stats,
+                           self._validators(entry))
+        return self._complete(ecl, stats, entry, first)
+
+    def _fetch_many(self, ecls: List[str]) -> Dict[str, pd.Index]:
+        """Récupère les expansions de plusieurs requêtes ECL élémentaires comme
+        `_fetch`, en envoyant leurs premières pages dans un seul Bundle batch. Les
+        pages suivantes des grandes expansions sont ensuite téléchargées
+        séparément, et les requêtes refusées dans le Bundle sont envoyées seules
+
+        Args:
+            ecls: Requêtes ECL élémentaires
+
+        Returns:
+            Dictionnaire associant chaque requête ECL à l'index des SCTID
+            correspondants
+        """
+        stats = {ecl: self._start(ecl) for ecl in ecls}
+        entries = {ecl: self._lookup(ecl, stats[ecl]) for ecl in ecls}
+        expansions = {}
+        for ecl, entry in entries.items():
+            if entry is not None and entry.fresh:
+                self._stop(stats[ecl], len(entry.codes))
+                expansions[ecl] = backend.sctids(entry.codes)
+
+        pending = [ecl for ecl in ecls if ecl not in expansions]
+        firsts = self._batch(pending, entries) if pending else {}
+        for ecl in pending:
+            if ecl in firsts:
+                first = firsts[ecl]
+            else:
+                first = self._page(self._url(ecl), 0, self.page_size, stats[ecl],
+                                   self._validators(entries[ecl]))
+            expansions[ecl] = self._complete(ecl, stats[ecl], entries[ecl], first)
+
+        return expansions
+
+    def _lookup(self, ecl: str, stats: Dict[str, Any]) -> Optional[Entry]:
+        """Recherche une expansion dans le cache persistant, s'il y en a un."""
+        if self.cache is None:
+            return None
+        entry = self.cache.lookup(self.endpoint, self.edition, ecl)
+        if entry is not None and entry.fresh and entry.version is not None \
+                and self.pinned is None:
+            # Une expansion obtenue avec une autre version que celle du FTS est
+            # invalidée, même si elle n'a pas expiré (une expansion expirée est
+            # revalidée par la version annoncée dans sa première page)
+            current = self._current()
+            if current is not None and current != entry.version:
+                entry = None
+        stats["cache"] = "miss" if entry is None else "hit"
+        if entry is not None:
+            stats["version"] = entry.version
+        return entry
+
+    def _current(self) -> Optional[str]:
+        """Récupère, une seule fois par instance, la version de l'édition annoncée
+        par le FTS, et supprime du cache les expansions obtenues avec une autre
+        version.
+
+        Returns:
+            URI de version de l'édition, ou None si le FTS ne l'indique pas
+        """
+        with self._version_lock:
+            if not self._version_checked:
+                try:
+                    self._current_version = self.version()
+                except requests.HTTPError:
+                    # FTS ne prenant pas en charge `CodeSystem/$lookup` : les
+                    # expansions en cache restent valides jusqu'à leur expiration
+                    self._current_version = None
+                if self._current_version is not None:
+                    self.cache.invalidate(self.endpoint, self.edition,
+                                          self._current_version)
+                self._version_checked = True
+            return self._current_version
+
+    @staticmethod
+    def _validators(entry: Optional[Entry]) -> Dict[str, str]:
+        """En-têtes d'une requête conditionnelle revalidant une expansion en
+        cache."""
+        headers = {}
+        if entry is not None and entry.etag is not None:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and http_date(entry.modified) is not None:
+            headers["If-Modified-Since"] = http_date(entry.modified)
+        return headers
+
+    def _complete(self, ecl: str, stats: Dict[str, Any], entry: Optional[Entry],
+                  first: Optional[Page]) -> pd.Index:
+        """Termine l'expansion d'une requête ECL élémentaire à partir de sa
+        première page : l'expansion en cache est conservée si la première page la
+        confirme, sinon les pages suivantes sont téléchargées et mises en cache.
+
+        Args:
+            ecl: Requête ECL élémentaire
+            stats: Mesures de la requête ECL
+            entry: Expansion expirée trouvée dans le cache
+            first: Première page de l'expansion, ou None si le FTS a répondu 304
+
+        Returns:
+            Index des SCTID correspondant à la requête ECL
+        """
+        if first is not None:
+            stats["version"] = first.version
+        if entry is not None and (first is None or self._unchanged(entry, first)):
+            stats["cache"] = "revalidated"
+            stats["version"] = entry.version
+            self.cache.touch(self.endpoint, self.edition, ecl)
+            codes = entry.codes
+        else:
+            if entry is not None:
+                stats["cache"] = "miss"
+            codes = [code for page in self.pages(ecl, stats, first) for code in page]
+            if self.cache is not None:
+                self.cache.set(self.endpoint, self.edition, ecl, codes,
+                               first.etag, first.modified, first.version)
+
+        self._stop(stats, len(codes))
+        return backend.sctids(codes)
+
+    @staticmethod
+    def _unchanged(entry: Entry, first: Page) -> bool:
+        """Teste si une expansion en cache est confirmée par la première page
+        d'une nouvelle expansion (même version de l'édition et même total)."""
+        return first.version is not None and first.version == entry.version \
+            and first.total in (None, len(entry.codes))
+
+    def _members(self, ecls: List[str],
+                 candidates: Iterable[int]) -> Dict[str, pd.Index]:
+        """Teste l'appartenance de concepts candidats à plusieurs requêtes ECL. Les
+        candidats sont envoyés par paquets, sous forme de conjonction avec chaque
+        requête : la taille des réponses dépend du nombre de candidats et non de la
+        taille des hiérarchies.
+
+        Args:
+            ecls: Requêtes ECL
+            candidates: Concepts candidats
+
+        Returns:
+            Dictionnaire associant chaque requête ECL à l'index des candidats
+            correspondants
+        """
+        candidates = sorted({str(c) for c in candidates if str(c).isdigit()})
+        chunks = [" OR ".join(candidates[i:i + self.chunk_size])
+                  for i in range(0, len(candidates), self.chunk_size)]
+        queries = [(ecl, f"({ecl}) AND ({chunk})") for ecl in ecls for chunk in chunks]
+
+        def expand(query: str) -> List[List[str]]:
+            stats = self._start(query)
+            pages = list(self.pages(query, stats))
+            self._stop(stats, sum(len(page) for page in pages))
+            return pages
+
+        members = {ecl: [] for ecl in ecls}
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            pages = pool.map(expand, [query for _, query in queries])
+            for (ecl, _), query_pages in zip(queries, pages):
+                for page in query_pages:
+                    members[ecl].extend(page)
+
+        return {ecl: backend.sctids(codes)
+                for ecl, codes in members.items()}
+
+    def fsn(self, concepts: Iterable[int]) -> pd.Series:
+        """Récupère en parallèle le FSN de concepts (opération
+        `CodeSystem/$lookup`). En mode `batch`, les opérations sont regroupées par
+        paquets de `chunk_size` concepts dans des Bundle batch envoyés en parallèle
+
+        Args:
+            concepts: SCTID des concepts
+
+        Returns:
+            FSN de chaque concept (indexés par SCTID, sans doublon), absents pour
+            les concepts inconnus du FTS
+        """
+        concepts = list(dict.fromkeys(concepts))
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            if self.batch:
+                chunks = [concepts[i:i + self.chunk_size]
+                          for i in range(0, len(concepts), self.chunk_size)]
+                lookups = [parameters
+                           for chunk in pool.map(self._lookup_chunk, chunks)
+                           for parameters in chunk]
+            else:
+                lookups = list(pool.map(self._lookup_code, concepts))
+
+        terms = []
+        for parameters in lookups:
+            term = None
+            for designation in lookup_parameters(parameters, "designation"):
+                parts = {p.get("name"): p for p in designation.get("part", [])}
+                if parts.get("use", {}).get("valueCoding", {}).get("code") \
+                        == backend.FSN:
+                    term = parts.get("value", {}).get("valueString")
+            terms.append(term)
+        return pd.Series(terms, name="fsn", dtype=object,
+                         index=pd.Index(concepts, dtype=np.int64, name="conceptId"))
+
+    def version(self) -> Optional[str]:
+        """Récupère la version de l'édition annoncée par le FTS (opération
+        `CodeSystem/$lookup` sur le concept racine)
+
+        Returns:
+            URI de version de l'édition, ou None si le FTS ne l'indique pas
         """
-        url = f"{self.ecl_base_url}{requests.utils.quote(ecl)}"
-        response = requests.request("GET", url)
+        version = lookup_parameters(self._lookup_code(138875005), "version")
+        return edition_version(next((p.get("valueString", p.get("valueUri"))
+                                     for p in version), None))
+
+    def _lookup_url(self, code: int) -> str:
+        """Construit l'URL (relative à l'endpoint) de l'opération
+        `CodeSystem/$lookup` sur un concept."""
+        return f"CodeSystem/$lookup?system=http://snomed.info/sct" \
+               f"&version={self.edition}&code={code}"
+
+    def _lookup_chunk(self, codes: List[int]) -> List[Optional[Dict[str, Any]]]:
+        """Envoie les opérations `CodeSystem/$lookup` sur plusieurs concepts dans
+        un seul Bundle batch. Si le FTS ne prend pas en charge les Bundle batch, ou
+        refuse certaines entrées, elles sont envoyées séparément.
+
+        Args:
+            codes: SCTID des concepts
+
+        Returns:
+            Ressource Parameters renvoyée pour chaque concept, ou None si le
+            concept est inconnu
+        """
+        bundle = self._post([{"request": {"method": "GET",
+                                          "url": self._lookup_url(code)}}
+                             for code in codes])
+        entries = bundle.get("entry", [])
+        lookups = []
+        for i, code in enumerate(codes):
+            entry = entries[i] if i < len(entries) else {}
+            status = entry.get("response", {}).get("status", "").split(" ")[0]
+            if status.startswith("2") and "resource" in entry:
+                lookups.append(entry["resource"])
+            elif status == "404":
+                lookups.append(None)
+            else:
+                lookups.append(self._lookup_code(code))
+        return lookups
+
+    def _lookup_code(self, code: int) -> Optional[Dict[str, Any]]:
+        """Envoie une opération `CodeSystem/$lookup` sur un concept.
+
+        Args:
+            code: SCTID du concept
+
+        Returns:
+            Ressource Parameters renvoyée par le FTS, ou None si le concept est
+            inconnu
+        """
+        url = f"{self.endpoint}/{self._lookup_url(code)}"
+        with self._in_flight:
+            response = self.session.get(url, timeout=self.timeout)
+        if response.status_code == 404:
+            return None
         response.raise_for_status()
+        return response.json()
+
+    def summary(self) -> pd.DataFrame:
+        """Résume les mesures des requêtes ECL envoyées depuis la création de
+        l'instance, de la plus longue à la plus courte.
+
+        Returns:
+            DataFrame avec une ligne par requête ECL : durée (s), nombre de requêtes
+            HTTP, octets reçus, nouvelles tentatives, codes renvoyés, utilisation
+            du cache ("hit", "miss", "revalidated" ou vide sans cache) et version
+            de l'édition de l'expansion (si le FTS l'indique)
+        """
+        columns = ["ecl", "seconds", "requests", "bytes", "retries", "codes",
+                   "cache", "version"]
+        with self._trace_lock:
+            trace = pd.DataFrame(self.trace, columns=columns)
+        return trace.sort_values("seconds", ascending=False, ignore_index=True)
+
+    def _start(self, ecl: str) -> Dict[str, Any]:
+        """Initialise les mesures d'une requête ECL."""
+        return {"ecl": ecl, "start": time.perf_counter(), "requests": 0, "bytes": 0,
+                "retries": 0, "cache": None, "version": None}
+
+    def _stop(self, stats: Dict[str, Any], codes: int) -> None:
+        """Termine les mesures d'une requête ECL et les ajoute à la trace.
+
+        Args:
+            stats: Mesures de la requête initialisées par `_start`
+            codes: Nombre de codes renvoyés
+        """
+        record = {"ecl": stats["ecl"],
+                  "seconds": round(time.perf_counter() - stats["start"], 6),
+                  "requests": stats["requests"], "bytes": stats["bytes"],
+                  "retries": stats["retries"], "codes": codes,
+                  "cache": stats["cache"], "version": stats["version"]}
+        with self._trace_lock:
+            self.trace.append(record)
+            if self.trace_path is not None:
+                with open(self.trace_path, "a", encoding="UTF-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def pages(self, ecl: str, stats: Optional[Dict[str, Any]] = None,
+              first: Optional[Page] = None) -> Generator[List[str], None, None]:
+        """Récupère l'expansion d'une requête ECL page par page (paramètres `count`
+        et `offset`). Les pages suivantes sont téléchargées en avance, en parallèle,
+        à partir du nombre total de codes annoncé par le FTS (`expansion.total`)
 
-        return [r.get("code", "")
-                for r in response.json()["expansion"].get("contains", {})]
+        Args:
+            ecl: Requête ECL
+            stats: Mesures de la requête ECL, complétées à chaque page
+            first: Première page de l'expansion si elle a déjà été récupérée
+
+        Yields:
+            Listes des SCTID de chaque page, dans l'ordre de l'expansion
+        """
+        url = self._url(ecl)
+        if first is None:
+            first = self._page(url, 0, self.page_size, stats)
+        total, codes = first.total, first.codes
+        yield codes
+        size = len(codes)
+        if total is None:
+            # Sans total annoncé, les pages sont lues l'une après l'autre jusqu'à
+            # la première page vide : une page incomplète peut venir d'un FTS
+            # plafonnant leur taille
+            offset = size
+            while codes:
+                codes = self._next(ecl, first, url, offset, self.page_size, stats)
+                yield codes
+                offset += len(codes)
+            return
+
+        # Le FTS peut plafonner la taille des pages en dessous de celle demandée :
+        # les pages suivantes reprennent la taille de la première
+        received = size
+        if size > 0:
+            with ThreadPoolExecutor(max_workers=self.prefetch) as pool:
+                offsets = iter(range(size, total, size))
+                pending = deque(pool.submit(self._next, ecl, first, url, offset, size,
+                                            stats)
+                                for _, offset in zip(range(self.prefetch), offsets))
+                while pending:
+                    codes = pending.popleft().result()
+                    offset = next(offsets, None)
+                    if offset is not None:
+                        pending.append(pool.submit(self._next, ecl, first, url, offset,
+                                                   size, stats))
+                    received += len(codes)
+                    yield codes
+
+        if received != total:
+            raise ValueError(f"Expansion incomplète pour '{ecl}' : {received} codes "
+                             f"reçus sur {total} annoncés")
+
+    def _next(self, ecl: str, first: Page, url: str, offset: int, count: int,
+              stats: Optional[Dict[str, Any]]) -> List[str]:
+        """Récupère une page suivante d'expansion et vérifie qu'elle a été obtenue
+        avec la même version de l'édition que la première.
+
+        Raises:
+            ValueError: Le FTS a changé de version pendant l'expansion
+        """
+        page = self._page(url, offset, count, stats)
+        if page.version is not None and first.version is not None \
+                and page.version != first.version:
+            raise ValueError(f"Version de l'édition modifiée pendant l'expansion de "
+                             f"'{ecl}' : {first.version} puis {page.version}")
+        return page.codes
+
+    def _batch(self, ecls: List[str], entries: Dict[str, Optional[Entry]]
+               ) -> Dict[str, Optional[Page]]:
+        """Récupère les premières pages de plusieurs expansions dans un seul Bundle
+        FHIR de type batch.
+
+        Args:
+            ecls: Requêtes ECL élémentaires
+            entries: Expansions expirées du cache, revalidées dans le Bundle
+
+        Returns:
+            Dictionnaire associant chaque requête ECL acceptée à sa première page
+            (None si le FTS a répondu 304). Il est vide si le FTS ne prend pas en
+            charge les Bundle batch
+        """
+        items = []
+        for ecl in ecls:
+            request = {"method": "GET",
+                       "url": page_url(self._url(ecl), 0, self.page_size)
+                       [len(self.endpoint) + 1:]}
+            headers = self._validators(entries.get(ecl))
+            if "If-None-Match" in headers:
+                request["ifNoneMatch"] = headers["If-None-Match"]
+            if "If-Modified-Since" in headers:
+                request["ifModifiedSince"] = fhir_instant(headers["If-Modified-Since"])
+            items.append({"request": request})
+
+        stats = self._start(f"batch ({len(ecls)} requêtes)")
+        bundle = self._post(items, stats)
+        firsts = {}
+        for ecl, entry in zip(ecls, bundle.get("entry", [])):
+            response = entry.get("response", {})
+            status = response.get("status", "").split(" ")[0]
+            if status == "304":
+                firsts[ecl] = None
+            elif status.startswith("2") and "expansion" in entry.get("resource", {}):
+                firsts[ecl] = pinned(
+                    Page(*expansion(entry["resource"]["expansion"]),
+                         response.get("etag"), http_date(response.get("lastModified"))),
+                    self.pinned)
+
+        self._stop(stats, sum(len(page.codes) for page in firsts.values()
+                              if page is not None))
+        return firsts
+
+    def _post(self, items: List[Dict[str, Any]],
+              stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Envoie un Bundle FHIR de type batch à la racine du FTS.
+
+        Args:
+            items: Entrées du Bundle
+            stats: Mesures complétées avec celles de la requête
+
+        Returns:
+            Bundle batch-response renvoyé par le FTS, vide si le FTS ne prend pas
+            en charge les Bundle batch
+        """
+        with self._in_flight:
+            _Retry.count.value = 0
+            with self.session.post(self.endpoint, timeout=self.timeout,
+                                   json={"resourceType": "Bundle", "type": "batch",
+                                         "entry": items},
+                                   headers={"Content-Type": "application/fhir+json"},
+                                   stream=True) as response:
+                if 400 <= response.status_code < 500 or response.status_code == 501:
+                    bundle = {}
+                else:
+                    response.raise_for_status()
+                    bundle = response.json()
+                received = response.raw.tell()
+
+        if stats is not None:
+            with self._trace_lock:
+                stats["requests"] += 1
+                stats["bytes"] += received
+                stats["retries"] += _Retry.count.value
+        return bundle
+
+    def _url(self, ecl: str) -> str:
+        """Construit l'URL de l'expansion d'une requête ECL (sans pagination)."""
+        return f"{self.ecl_base_url}{requests.utils.quote(ecl)}"
+
+    def _page(self, url: str, offset: int, count: int,
+              stats: Optional[Dict[str, Any]] = None,
+              headers: Optional[Dict[str, str]] = None) -> Optional[Page]:
+        """Récupère une page d'expansion.
+
+        Args:
+            url: URL de l'expansion de la requête ECL
+            offset: Position du premier code de la page
+            count: Nombre de codes demandés
+            stats: Mesures de la requête ECL, complétées avec celles de la page
+            headers: En-têtes de la requête (requête conditionnelle)
+
+        Returns:
+            Page d'expansion, ou None si le FTS répond qu'elle n'a pas été
+            modifiée (304)
+        """
+        url = page_url(url, offset, count)
+        with self._in_flight:
+            _Retry.count.value = 0
+            with self.session.get(url, timeout=self.timeout, headers=headers,
+                                  stream=True) as response:
+                response.raise_for_status()
+                page = None
+                if response.status_code != 304:
+                    total, codes, version = self._parse(response)
+                    modified = http_date(response.headers.get("Last-Modified"))
+                    page = pinned(Page(total, codes, version,
+                                       response.headers.get("ETag"), modified),
+                                  self.pinned)
+                received = response.raw.tell()
+
+        if stats is not None:
+            with self._trace_lock:
+                stats["requests"] += 1
+                stats["bytes"] += received
+                stats["retries"] += _Retry.count.value
+
+        return page
+
+    @staticmethod
+    def _parse(response: requests.Response
+               ) -> Tuple[Optional[int], List[str], Optional[str]]:
+        """Extrait le total, les codes et la version d'une page d'expansion.
+
+        Args:
+            response: Réponse (en flux) du FTS
+
+        Returns:
+            Nombre total de codes annoncé par le FTS (s'il est fourni), liste des
+            SCTID de la page et version de l'édition (paramètre `version` de
+            l'expansion, s'il est fourni)
+        """
+        if ijson is None:
+            return expansion(response.json()["expansion"])
+
+        # Lecture incrémentale de la réponse : seuls le total, les codes et la
+        # version sont extraits, sans construire l'ensemble du document JSON
+        response.raw.decode_content = True
+        total, codes, version, parameter = None, [], None, {}
+        for prefix, event, value in ijson.parse(response.raw):
+            if prefix == "expansion.contains.item.code":
+                codes.append(value)
+            elif prefix == "expansion.total":
+                total = int(value)
+            elif prefix.startswith("expansion.parameter.item."):
+                parameter[prefix.rsplit(".", 1)[1]] = value
+            elif prefix == "expansion.parameter.item" and event == "end_map":
+                if parameter.get("name") in VERSION_PARAMETERS:
+                    version = edition_version(parameter.get(
+                        "valueUri", parameter.get("valueString")))
+                parameter = {}
+
+        return total, codes, version
+
+
+def isin(concepts: pd.Series, scope: pd.Index) -> pd.Series:
+    """Teste l'appartenance de SCTID à une expansion ECL. Contrairement à
+    `Series.isin`, la table de hachage de l'expansion n'est construite qu'une fois
+    puis réutilisée par pandas à chaque appel.
+
+    Args:
+        concepts: SCTID à tester
+        scope: Expansion ECL renvoyée par `Fts.ecl` ou `Fts.ecl_many`
+
+    Returns:
+        Filtre booléen sur `concepts`
+    """
+    return pd.Series(scope.get_indexer(concepts) >= 0, index=concepts.index,
+                     name=concepts.name)
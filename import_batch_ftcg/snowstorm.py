@@ -0,0 +1,237 @@
+import numpy as np
+import pandas as pd
+import requests
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from import_batch_ftcg import backend, planner, server
+from import_batch_ftcg.cache import ExpansionCache, MemoryCache
+from typing import Any, Dict, Generator, Iterable, List, Optional, Tuple
+
+
+class Snowstorm(backend.Terminology):
+    """
+    Classe regroupant les interactions avec l'API REST native d'un serveur
+    Snowstorm : les expansions ECL ne renvoient que les SCTID (`returnIdOnly`) et
+    sont paginées par curseur (`searchAfter`), sans limite de profondeur
+    """
+
+    def __init__(self, endpoint: str, branch: str = "MAIN",
+                 cache: Optional[ExpansionCache] = None,
+                 timeout: Tuple[float, float] = (10, 300), retries: int = 5,
+                 backoff: float = 1, pool_size: int = 10, page_size: int = 10000,
+                 max_in_flight: int = 8, chunk_size: int = 100,
+                 memory_size: int = 5_000_000):
+        """
+        Args:
+            endpoint: Endpoint de l'API REST de votre serveur Snowstorm
+            branch: Branche interrogée (ex: MAIN ou MAIN/SNOMEDCT-FR)
+            cache: Cache persistant des expansions ECL. Si absent, chaque requête
+                ECL est envoyée au serveur
+            timeout: Délais maximaux de connexion et de lecture, en secondes
+            retries: Nombre maximal de nouvelles tentatives après une erreur de
+                connexion ou une réponse 429/5xx
+            backoff: Facteur de l'attente exponentielle entre deux tentatives, en
+                secondes
+            pool_size: Nombre maximal de connexions conservées ouvertes
+            page_size: Nombre de SCTID demandés par page d'expansion
+            max_in_flight: Nombre maximal de requêtes envoyées simultanément
+            chunk_size: Nombre de concepts par requête de recherche des FSN
+            memory_size: Nombre total maximal de codes des expansions conservées
+                en mémoire
+        """
+        self.endpoint = endpoint.rstrip("/")
+        self.branch = branch
+        self.cache = cache
+        self.timeout = timeout
+        self.page_size = page_size
+        self.max_in_flight = max_in_flight
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.chunk_size = chunk_size
+        self.memory = MemoryCache(memory_size)
+        # Version publiée sur la branche, récupérée au plus une fois pour invalider
+        # les expansions en cache (voir `_current`)
+        self._current_version: Optional[str] = None
+        self._version_lock = threading.Lock()
+        self._version_checked = False
+        self.session = server.session(retries, backoff, pool_size)
+        self.session.headers.update({"Accept": "application/json"})
+
+    def ecl(self, ecl: str) -> pd.Index:
+        """Envoie une requête ECL au serveur. Ses sous-requêtes élémentaires (voir
+        `planner.split`) sont expansées une seule fois par instance, puis
+        combinées localement
+
+        Args:
+            ecl: Requête ECL
+
+        Returns:
+            Index (immuable et sans doublon) des SCTID correspondant à la requête
+            ECL, à tester avec `server.isin`
+        """
+        node, leaves = planner.split(ecl)
+        return planner.combine(ecl, node, {leaf: self._expand(leaf) for leaf in leaves})
+
+    def ecl_many(self, ecls: Iterable[str],
+                 candidates: Optional[Iterable[int]] = None) -> Dict[str, pd.Index]:
+        """Envoie en parallèle plusieurs requêtes ECL au serveur
+
+        Args:
+            ecls: Requêtes ECL
+            candidates: Ignoré : les expansions sans terme sont déjà compactes
+
+        Returns:
+            Dictionnaire associant chaque requête ECL à l'index des SCTID
+            correspondants
+        """
+        plans = {ecl: planner.split(ecl) for ecl in ecls}
+        leaves = list(dict.fromkeys(leaf for _, split in plans.values()
+                                    for leaf in split))
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            expansions = dict(zip(leaves, pool.map(self._expand, leaves)))
+
+        return {ecl: planner.combine(ecl, node, expansions)
+                for ecl, (node, _) in plans.items()}
+
+    def _expand(self, ecl: str) -> pd.Index:
+        """Expanse une requête ECL élémentaire, au plus une fois par instance tant
+        qu'elle reste dans le cache mémoire."""
+        return self.memory.get(ecl, lambda: self._fetch(ecl))
+
+    def _fetch(self, ecl: str) -> pd.Index:
+        """Récupère l'expansion d'une requête ECL élémentaire dans le cache
+        persistant si elle y est présente, sinon auprès du serveur, page par page.
+
+        Args:
+            ecl: Requête ECL élémentaire
+
+        Returns:
+            Index des SCTID correspondant à la requête ECL
+        """
+        if self.cache is None:
+            return backend.sctids([code for page in self.pages(ecl) for code in page])
+
+        entry = self.cache.lookup(self.endpoint, self.branch, ecl)
+        if entry is not None and entry.fresh and entry.version is not None:
+            # Comme `server.Fts._lookup` : une expansion obtenue avec une autre
+            # version que celle publiée sur la branche est invalidée
+            current = self._current()
+            if current is not None and current != entry.version:
+                entry = None
+        if entry is not None and entry.fresh:
+            return backend.sctids(entry.codes)
+
+        codes = [code for page in self.pages(ecl) for code in page]
+        self.cache.set(self.endpoint, self.branch, ecl, codes,
+                       version=self._current())
+        return backend.sctids(codes)
+
+    def _current(self) -> Optional[str]:
+        """Récupère, une seule fois par instance, la version publiée sur la
+        branche, et supprime du cache les expansions obtenues avec une autre
+        version.
+
+        Returns:
+            URI de version de l'édition, ou None si elle n'est pas connue
+        """
+        with self._version_lock:
+            if not self._version_checked:
+                try:
+                    self._current_version = self.version()
+                except requests.HTTPError:
+                    # Serveur ne donnant pas accès aux CodeSystems : les
+                    # expansions en cache restent valides jusqu'à leur expiration
+                    self._current_version = None
+                if self._current_version is not None:
+                    self.cache.invalidate(self.endpoint, self.branch,
+                                          self._current_version)
+                self._version_checked = True
+            return self._current_version
+
+    def pages(self, ecl: str) -> Generator[List[str], None, None]:
+        """Récupère l'expansion d'une requête ECL page par page. Chaque page donne
+        le curseur (`searchAfter`) de la suivante : les pages sont lues l'une
+        après l'autre
+
+        Args:
+            ecl: Requête ECL
+
+        Yields:
+            Listes des SCTID de chaque page
+        """
+        params = {"ecl": ecl, "activeFilter": "true", "returnIdOnly": "true",
+                  "limit": self.page_size}
+        while True:
+            page = self._get(f"{self.branch}/concepts", params)
+            codes = [str(item) if not isinstance(item, dict)
+                     else item.get("conceptId", item.get("id"))
+                     for item in page.get("items", [])]
+            yield codes
+            # Le serveur peut plafonner la taille des pages : seule une page vide
+            # ou sans curseur termine l'expansion
+            if not codes or not page.get("searchAfter"):
+                return
+            params["searchAfter"] = page["searchAfter"]
+
+    def fsn(self, concepts: Iterable[int]) -> pd.Series:
+        """Récupère en parallèle le FSN de concepts, par paquets
+
+        Args:
+            concepts: SCTID des concepts
+
+        Returns:
+            FSN de chaque concept (indexés par SCTID, sans doublon), absents pour
+            les concepts inconnus du serveur
+        """
+        concepts = list(dict.fromkeys(concepts))
+        chunks = [concepts[i:i + self.chunk_size]
+                  for i in range(0, len(concepts), self.chunk_size)]
+
+        def search(chunk: List[int]) -> Dict[int, str]:
+            page = self._get(f"{self.branch}/concepts",
+                             {"conceptIds": chunk, "limit": len(chunk)})
+            return {int(item["conceptId"]): item.get("fsn", {}).get("term")
+                    for item in page.get("items", [])}
+
+        terms = {}
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            for found in pool.map(search, chunks):
+                terms.update(found)
+        return pd.Series([terms.get(c) for c in concepts],
+                         index=pd.Index(concepts, dtype=np.int64, name="conceptId"),
+                         name="fsn", dtype=object)
+
+    def version(self) -> Optional[str]:
+        """Récupère la dernière version publiée sur la branche interrogée
+
+        Returns:
+            URI de version de l'édition, ou None si la branche n'appartient à
+            aucun CodeSystem versionné
+        """
+        # Le CodeSystem de la branche est celui dont la branche est la plus longue
+        # à la contenir (ex: MAIN/SNOMEDCT-FR plutôt que MAIN)
+        codesystems = sorted(self._get("codesystems", {}).get("items", []),
+                             key=lambda c: len(c.get("branchPath", "")), reverse=True)
+        for codesystem in codesystems:
+            if self.branch.startswith(codesystem.get("branchPath", "")) \
+                    and codesystem.get("latestVersion"):
+                module = codesystem.get("defaultModuleId", "900000000000207008")
+                date = codesystem["latestVersion"]["effectiveDate"]
+                return f"http://snomed.info/sct/{module}/version/{date}"
+        return None
+
+    def _get(self, path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Envoie une requête GET à l'API REST.
+
+        Args:
+            path: Chemin de la ressource, relatif à l'endpoint
+            params: Paramètres de la requête
+
+        Returns:
+            Réponse JSON du serveur
+        """
+        with self._in_flight:
+            response = self.session.get(f"{self.endpoint}/{path}", params=params,
+                                        timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
@@ -0,0 +1,343 @@
+import argparse
+import gzip
+import json
+import numpy as np
+import pandas as pd
+import random
+import threading
+import time
+import zlib
+
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from import_batch_ftcg import local
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+# SCTID de la racine des hiérarchies synthétiques ; les autres concepts suivent
+SYNTHETIC_ROOT = 1000000
+
+
+def synthetic(size: int, branching: int = 10) -> local.LocalTerminology:
+    """Construit une hiérarchie synthétique : un arbre de `size` concepts dont
+    chaque concept a `branching` enfants.
+
+    Args:
+        size: Nombre de concepts de la hiérarchie
+        branching: Nombre d'enfants de chaque concept
+
+    Returns:
+        Moteur ECL local de la hiérarchie. La racine a pour SCTID `SYNTHETIC_ROOT`
+        et le i-ème concept `SYNTHETIC_ROOT + i`
+    """
+    children = np.arange(1, size, dtype=np.int64)
+    rel = pd.DataFrame({"sourceId": SYNTHETIC_ROOT + children,
+                        "destinationId": SYNTHETIC_ROOT + (children - 1) // branching,
+                        "typeId": local.IS_A})
+    return local.LocalTerminology.from_relationships(rel)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Traitement des requêtes HTTP du serveur de substitution"""
+    protocol_version = "HTTP/1.1"
+    # Les en-têtes et le corps sont écrits séparément : sans TCP_NODELAY, chaque
+    # réponse d'une connexion persistante attendrait l'acquittement différé du client
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Les requêtes sont tracées dans `StubFts.requests` plutôt que sur stderr
+        pass
+
+    def do_GET(self) -> None:
+        if not self._accept():
+            return
+        if urlsplit(self.path).path.endswith("/CodeSystem/$lookup"):
+            self._send(*self._lookup(self.path))
+        else:
+            self._send(*self._expand(self.path, self.headers.get("If-None-Match")))
+
+    def do_POST(self) -> None:
+        # Bundle de type batch envoyé à la racine du serveur : chaque entrée est
+        # une requête GET traitée comme si elle avait été envoyée seule
+        if not self._accept():
+            return
+        if urlsplit(self.path).path.strip("/"):
+            self._send(404, _outcome("not-found", f"Ressource inconnue : {self.path}"))
+            return
+
+        bundle = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if bundle.get("type") != "batch":
+            self._send(400, _outcome("invalid", "Seuls les Bundle batch sont pris en "
+                                                "charge"))
+            return
+
+        entries = []
+        for entry in bundle.get("entry", []):
+            request = entry.get("request", {})
+            path = f"/{request.get('url', '')}"
+            if urlsplit(path).path.endswith("/CodeSystem/$lookup"):
+                status, body, headers = self._lookup(path)
+            else:
+                status, body, headers = self._expand(path, request.get("ifNoneMatch"))
+            response = {"status": f"{status} {HTTPStatus(status).phrase}"}
+            if "ETag" in headers:
+                response["etag"] = headers["ETag"]
+            entries.append({"response": response} if body is None
+                           else {"resource": body, "response": response})
+        self._send(200, {"resourceType": "Bundle", "type": "batch-response",
+                         "entry": entries})
+
+    def _accept(self) -> bool:
+        """Trace la requête, applique la latence et tire une éventuelle erreur."""
+        stub = self.server.stub
+        stub._received(self.path)
+        try:
+            time.sleep(stub.latency)
+        finally:
+            stub._released()
+        if stub._fail():
+            self._send(503, _outcome("transient", "Erreur injectée"))
+            return False
+        return True
+
+    def _expand(self, path: str, if_none_match: Optional[str]
+                ) -> Tuple[int, Optional[Dict[str, Any]], Dict[str, str]]:
+        """Traite une requête `ValueSet/$expand`.
+
+        Args:
+            path: Chemin et paramètres de la requête
+            if_none_match: En-tête `If-None-Match` de la requête
+
+        Returns:
+            Statut, corps (None pour une réponse 304) et en-têtes de la réponse
+        """
+        stub = self.server.stub
+        split = urlsplit(path)
+        if not split.path.endswith("/ValueSet/$expand"):
+            return 404, _outcome("not-found", f"Ressource inconnue : {split.path}"), {}
+
+        params = parse_qs(split.query)
+        url = params.get("url", [""])[0]
+        if "?fhir_vs=ecl/" not in url:
+            return 400, _outcome("invalid", "Seules les ValueSet implicites ECL sont "
+                                            "prises en charge"), {}
+
+        edition, ecl = url.split("?fhir_vs=ecl/", 1)
+        if "/version/" in edition and edition != stub.version:
+            return 404, _outcome("not-found", f"Version inconnue : {edition}"), {}
+        try:
+            codes = stub._expand(ecl)
+        except ValueError as e:
+            return 400, _outcome("invalid", str(e)), {}
+
+        offset = int(params.get("offset", ["0"])[0])
+        count = min(int(params.get("count", [str(stub.max_count)])[0]), stub.max_count)
+        # La page ne dépend que de la version, de la requête et de la pagination
+        etag = f'"{zlib.crc32(f"{stub.version}|{ecl}|{offset}|{count}".encode()):08x}"'
+        if if_none_match == etag:
+            return 304, None, {"ETag": etag}
+        return 200, {
+            "resourceType": "ValueSet",
+            "status": "active",
+            "expansion": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                **({"total": len(codes)} if stub.total else {}),
+                "offset": offset,
+                # Comme la plupart des serveurs, la version est préfixée par le
+                # système dans les expansions, mais pas dans `$lookup`
+                "parameter": [{"name": "version",
+                               "valueUri": f"http://snomed.info/sct|{stub.version}"}],
+                "contains": [{"system": "http://snomed.info/sct", "code": code,
+                              "display": f"Concept {code}"}
+                             for code in codes[offset:offset + count]]}}, \
+            {"ETag": etag}
+
+    def _lookup(self, path: str
+                ) -> Tuple[int, Optional[Dict[str, Any]], Dict[str, str]]:
+        """Traite une requête `CodeSystem/$lookup` : la version de l'édition est
+        renvoyée, avec le FSN du concept si le moteur ECL local a chargé les
+        descriptions.
+
+        Args:
+            path: Chemin et paramètres de la requête
+
+        Returns:
+            Statut, corps et en-têtes de la réponse
+        """
+        stub = self.server.stub
+        params = parse_qs(urlsplit(path).query)
+        if "code" not in params:
+            return 400, _outcome("required", "Paramètre code manquant"), {}
+        version = params.get("version", [""])[0]
+        if "/version/" in version and version != stub.version:
+            return 404, _outcome("not-found", f"Version inconnue : {version}"), {}
+        parameters = [{"name": "name", "valueString": "SNOMED CT"},
+                      {"name": "version", "valueString": stub.version}]
+        fsns = getattr(stub.terminology, "fsns", None)
+        if fsns is not None:
+            code = params["code"][0]
+            if not code.isdigit() or int(code) not in fsns.index:
+                return 404, _outcome("not-found", f"Concept inconnu : {code}"), {}
+            parameters.append({"name": "designation", "part": [
+                {"name": "use", "valueCoding": {"system": "http://snomed.info/sct",
+                                                "code": "900000000000003001"}},
+                {"name": "value", "valueString": fsns[int(code)]}]})
+        return 200, {"resourceType": "Parameters", "parameter": parameters}, {}
+
+    def _send(self, status: int, body: Optional[Dict[str, Any]],
+              headers: Optional[Dict[str, str]] = None) -> None:
+        content = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header("Content-Type", "application/fhir+json")
+        if body is not None and "gzip" in self.headers.get("Accept-Encoding", ""):
+            content = gzip.compress(content)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def _outcome(code: str, diagnostics: str) -> Dict[str, Any]:
+    return {"resourceType": "OperationOutcome",
+            "issue": [{"severity": "error", "code": code,
+                       "diagnostics": diagnostics}]}
+
+
+class _Server(ThreadingHTTPServer):
+    # Les clients concurrents ouvrent de nombreuses connexions simultanées : une
+    # file d'attente trop courte retarderait leur établissement d'une seconde
+    request_queue_size = 128
+
+
+class StubFts:
+    """
+    Serveur de Terminologies FHIR de substitution, local et sans dépendance, pour
+    les tests et les mesures de performance de `server.Fts`. Il répond aux
+    requêtes `ValueSet/$expand?url=...?fhir_vs=ecl/...` (avec pagination), seules
+    ou regroupées dans un Bundle batch, à partir d'un moteur ECL local, avec une
+    latence et un taux d'erreurs configurables
+    """
+
+    def __init__(self, terminology: local.LocalTerminology, latency: float = 0,
+                 error_rate: float = 0, max_count: int = 10000, total: bool = True,
+                 version: str = "http://snomed.info/sct/900000000000207008/version/20240101", # noqa
+                 host: str = "127.0.0.1", port: int = 0, seed: Optional[int] = None):
+        """
+        Args:
+            terminology: Moteur ECL local utilisé pour les expansions (construit à
+                partir d'un Snapshot RF2 ou par `synthetic`)
+            latency: Latence ajoutée à chaque requête, en secondes
+            error_rate: Proportion de requêtes recevant une erreur 503
+            max_count: Taille maximale des pages d'expansion
+            total: Si faux, le nombre total de codes n'est pas annoncé dans les
+                expansions
+            version: Version de l'édition annoncée dans les expansions
+            host: Adresse d'écoute
+            port: Port d'écoute (0 pour un port libre choisi par le système)
+            seed: Graine du tirage des erreurs
+        """
+        self.terminology = terminology
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_count = max_count
+        self.total = total
+        self.version = version
+        # Chemins des requêtes reçues, dans l'ordre d'arrivée
+        self.requests: List[str] = []
+        # Nombre maximal de requêtes reçues simultanément (pendant leur latence)
+        self.peak = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._expansions: Dict[str, List[str]] = {}
+        self._server = _Server((host, port), _Handler)
+        self._server.stub = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint(self) -> str:
+        """Endpoint FHIR du serveur, à donner à `server.Fts`"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubFts":
+        """Démarre le serveur dans un thread."""
+        # Un intervalle court permet d'arrêter rapidement le serveur (`stop`)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Arrête le serveur."""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "StubFts":
+        return self.start()
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+    def _received(self, path: str) -> None:
+        with self._lock:
+            self.requests.append(path)
+            self._in_flight += 1
+            self.peak = max(self.peak, self._in_flight)
+
+    def _released(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def _fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _expand(self, ecl: str) -> List[str]:
+        # Les expansions sont conservées pour que les pages suivantes d'une même
+        # requête ne soient pas recalculées
+        with self._lock:
+            codes = self._expansions.get(ecl)
+        if codes is None:
+            codes = [str(code) for code in self.terminology.ecl(ecl)]
+            with self._lock:
+                self._expansions[ecl] = codes
+        return codes
+
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser(
+        description="Serveur de Terminologies FHIR de substitution")
+    source = cli.add_mutually_exclusive_group(required=True)
+    source.add_argument("--rf2", type=str,
+                        help="Chemin vers le fichier sct2_Relationship_Snapshot ou \
+                            vers une fermeture transitive précalculée")
+    source.add_argument("--size", type=int,
+                        help="Nombre de concepts d'une hiérarchie synthétique")
+    cli.add_argument("--branching", type=int, default=10,
+                     help="Nombre d'enfants de chaque concept synthétique")
+    cli.add_argument("--port", type=int, default=8080, help="Port d'écoute")
+    cli.add_argument("--latency", type=float, default=0,
+                     help="Latence ajoutée à chaque requête (en s)")
+    cli.add_argument("--error-rate", type=float, default=0,
+                     help="Proportion de requêtes recevant une erreur 503")
+    cli.add_argument("--max-count", type=int, default=10000,
+                     help="Taille maximale des pages d'expansion")
+    args = cli.parse_args()
+
+    if args.rf2 is not None:
+        terminology = local.LocalTerminology(args.rf2)
+    else:
+        terminology = synthetic(args.size, args.branching)
+    stub = StubFts(terminology, latency=args.latency, error_rate=args.error_rate,
+                   max_count=args.max_count, port=args.port)
+    print(f"Serveur de substitution démarré ({stub.endpoint}) - Ctrl+C pour arrêter")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        stub._server.server_close()
@@ -18,7 +18,14 @@ setup(
     url="https://github.com/ansforge/interop-outil-nrc-import-batch-ftcg",
     packages=['import_batch_ftcg', 'test'],
     install_requires=[
+        "numpy",
         "pandas",
+        "requests",
     ],
+    extras_require={
+        "stream": ["ijson"],
+        "async": ["httpx[http2]"],
+        "arrow": ["pyarrow"],
+    },
     long_description=read('README'),
 )
@@ -13,46 +13,47 @@ def pytest_addoption(parser):
 @pytest.fixture
 def fts(pytestconfig) -> Generator[responses.RequestsMock, Any, None]:
     sb = op.join(pytestconfig.getoption("endpoint"),
-                 "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20260787004") # noqa
+                 "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20260787004&includeDesignations=false&_elements=expansion&count=5000&offset=0") # noqa
     bs = op.join(pytestconfig.getoption("endpoint"),
-                 "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20123037004") # noqa
+                 "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20123037004&includeDesignations=false&_elements=expansion&count=5000&offset=0") # noqa
     co = op.join(pytestconfig.getoption("endpoint"),
-                 "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20123037004%20MINUS%20%3C%3C%2064572001") # noqa
+                 "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%2064572001&includeDesignations=false&_elements=expansion&count=5000&offset=0") # noqa
     pa3a = op.join(pytestconfig.getoption("endpoint"),
-                  "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20417746004%3A%20363698007%20%3D%20%3C%3C%2039937001") # noqa
+                  "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20417746004%20%3A%20363698007%20%3D%20%3C%3C%2039937001&includeDesignations=false&_elements=expansion&count=5000&offset=0") # noqa
     pa3b = op.join(pytestconfig.getoption("endpoint"),
-                  "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20417746004%3A%20363698007%20%21%3D%20%3C%3C%2039937001") # noqa
+                  "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20417746004%20%3A%20363698007%20%21%3D%20%3C%3C%2039937001&includeDesignations=false&_elements=expansion&count=5000&offset=0") # noqa
     me = op.join(pytestconfig.getoption("endpoint"),
-                 "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20373873005") # noqa
+                 "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20373873005&includeDesignations=false&_elements=expansion&count=5000&offset=0") # noqa
     hs = op.join(pytestconfig.getoption("endpoint"),
-                 "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20243796009") # noqa
+                 "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20243796009&includeDesignations=false&_elements=expansion&count=5000&offset=0") # noqa
     ec = op.join(pytestconfig.getoption("endpoint"),
-                 "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20123038009") # noqa
+                 "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20123038009&includeDesignations=false&_elements=expansion&count=5000&offset=0") # noqa
 
     with responses.RequestsMock() as mock:
         mock.add(method=responses.GET, url=sb,
-                 json={"expansion": {"contains": [{"code": "C1"}]}})
+                 json={"expansion": {"total": 1, "contains": [{"code": "1"}]}})
 
         mock.add(method=responses.GET, url=bs,
-                 json={"expansion": {"contains": [{"code": "C2"}]}})
+                 json={"expansion": {"total": 2,
+                                     "contains": [{"code": "2"}, {"code": "3"}]}})
 
         mock.add(method=responses.GET, url=co,
-                 json={"expansion": {"contains": [{"code": "C3"}]}})
+                 json={"expansion": {"total": 1, "contains": [{"code": "2"}]}})
 
         mock.add(method=responses.GET, url=pa3a,
-                 json={"expansion": {"contains": [{"code": "C4"}]}})
+                 json={"expansion": {"total": 1, "contains": [{"code": "4"}]}})
 
         mock.add(method=responses.GET, url=pa3b,
-                 json={"expansion": {"contains": []}})
+                 json={"expansion": {"total": 0, "contains": []}})
 
         mock.add(method=responses.GET, url=me,
-                 json={"expansion": {"contains": [{"code": "C5"}]}})
+                 json={"expansion": {"total": 1, "contains": [{"code": "5"}]}})
 
         mock.add(method=responses.GET, url=hs,
-                 json={"expansion": {"contains": [{"code": "C7"}]}})
+                 json={"expansion": {"total": 1, "contains": [{"code": "7"}]}})
 
         mock.add(method=responses.GET, url=ec,
-                 json={"expansion": {"contains": [{"code": "C8"}]}})
+                 json={"expansion": {"total": 1, "contains": [{"code": "8"}]}})
 
         yield mock
 
@@ -60,7 +61,7 @@ def fts(pytestconfig) -> Generator[responses.RequestsMock, Any, None]:
 @pytest.fixture
 def null() -> pd.DataFrame:
     return pd.DataFrame(
-        {"id": ["1"], "conceptId": ["C1"], "acceptabilityId": ["PREFERRED"],
+        {"id": ["1"], "conceptId": [1], "acceptabilityId": ["PREFERRED"],
          "fsn": ["test"], "term": ["test"]}
     )
 
@@ -69,7 +70,7 @@ def null() -> pd.DataFrame:
 def control_cf() -> pd.DataFrame:
     return pd.DataFrame(
         {"id": [str(i) for i in range(1, 9)],
-         "conceptId": [f"C{str(i)}" for i in range(1, 9)],
+         "conceptId": list(range(1, 9)),
          "acceptabilityId": ["PREFERRED"] * 8,
          "fsn": ["test", "test", "test", "test (disorder)", "test", "test (procedure)",
                  "test", "test"],
@@ -497,16 +498,17 @@ def co6_output() -> pd.DataFrame:
 @pytest.fixture
 def fts_pa3(pytestconfig) -> Generator[responses.RequestsMock, Any, None]:
     u_skin_trauma = op.join(pytestconfig.getoption("endpoint"),
-                            "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20417746004%3A%20363698007%20%3D%20%3C%3C%2039937001") # noqa
+                            "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20417746004%20%3A%20363698007%20%3D%20%3C%3C%2039937001&includeDesignations=false&_elements=expansion&count=5000&offset=0") # noqa
     u_trauma = op.join(pytestconfig.getoption("endpoint"),
-                       "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20417746004%3A%20363698007%20%21%3D%20%3C%3C%2039937001") # noqa
+                       "ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20417746004%20%3A%20363698007%20%21%3D%20%3C%3C%2039937001&includeDesignations=false&_elements=expansion&count=5000&offset=0") # noqa
 
     with responses.RequestsMock() as mock:
         mock.add(method=responses.GET, url=u_skin_trauma,
-                 json={"expansion": {"contains": [{"code": "1"}]}})
+                 json={"expansion": {"total": 1, "contains": [{"code": "1"}]}})
 
         mock.add(method=responses.GET, url=u_trauma,
-                 json={"expansion": {"contains": [{"code": "2"}, {"code": "3"}]}})
+                 json={"expansion": {"total": 2,
+                                     "contains": [{"code": "2"}, {"code": "3"}]}})
 
         yield mock
 
@@ -515,7 +517,7 @@ def fts_pa3(pytestconfig) -> Generator[responses.RequestsMock, Any, None]:
 def pa3() -> pd.DataFrame:
     return pd.DataFrame(
         {"id": [str(i) for i in range(1, 13)],
-         "conceptId": ["1", "1", "1", "2", "2", "2", "2", "3", "3", "3", "3", "4"],
+         "conceptId": [1, 1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 4],
          "fsn": ["traumatic skin injury", "traumatic skin injury",
                  "traumatic skin injury", "traumatic liver injury",
                  "traumatic liver injury", "traumatic liver injury",
@@ -533,7 +535,7 @@ def pa3() -> pd.DataFrame:
 def pa3_output() -> pd.DataFrame:
     return pd.DataFrame(
         {"id": [str(i) for i in range(1, 13)],
-         "conceptId": ["1", "1", "1", "2", "2", "2", "2", "3", "3", "3", "3", "4"],
+         "conceptId": [1, 1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 4],
          "fsn": ["traumatic skin injury", "traumatic skin injury",
                  "traumatic skin injury", "traumatic liver injury",
                  "traumatic liver injury", "traumatic liver injury",
@@ -1175,3 +1177,93 @@ def ec4_output() -> pd.DataFrame:
          "term": ["échantillon de liquide", "liquide", "test"],
          "ec4": [float("nan"), "1", float("nan")]}
     )
+
+
+#########################################
+# Fixtures pour le moteur ECL local RF2 #
+#########################################
+@pytest.fixture
+def relationships(tmp_path) -> str:
+    # (sourceId, destinationId, typeId, active)
+    rows = [("404684003", "138875005", "116680003", "1"),
+            ("123037004", "138875005", "116680003", "1"),
+            ("363698007", "138875005", "116680003", "1"),
+            ("417746004", "404684003", "116680003", "1"),
+            ("39937001", "123037004", "116680003", "1"),
+            ("20", "123037004", "116680003", "1"),
+            ("21", "39937001", "116680003", "1"),
+            ("10", "417746004", "116680003", "1"),
+            ("10", "39937001", "363698007", "1"),
+            ("11", "417746004", "116680003", "1"),
+            ("11", "20", "363698007", "1"),
+            ("12", "417746004", "116680003", "1"),
+            ("12", "39937001", "363698007", "1"),
+            ("12", "20", "363698007", "1"),
+            ("13", "417746004", "116680003", "1"),
+            ("13", "21", "363698007", "1"),
+            ("14", "417746004", "116680003", "0")]
+    path = tmp_path / "sct2_Relationship_Snapshot_INT_20240101.txt"
+    with open(path, "w") as f:
+        f.write("id\teffectiveTime\tactive\tmoduleId\tsourceId\tdestinationId\t"
+                "relationshipGroup\ttypeId\tcharacteristicTypeId\tmodifierId\n")
+        for i, (source, destination, type_id, active) in enumerate(rows):
+            f.write(f"{i}\t20240101\t{active}\t900000000000207008\t{source}\t"
+                    f"{destination}\t0\t{type_id}\t900000000000011006\t"
+                    f"900000000000451002\n")
+    return str(path)
+
+
+@pytest.fixture
+def descriptions(tmp_path) -> str:
+    # (conceptId, typeId, term, active)
+    rows = [("10", "900000000000003001", "Traumatic injury (disorder)", "1"),
+            ("10", "900000000000013009", "Traumatic injury", "1"),
+            ("11", "900000000000003001", "Old name (disorder)", "0"),
+            ("11", "900000000000003001", "Injury of joint (disorder)", "1"),
+            ("12", "900000000000013009", "Synonym only", "1")]
+    path = tmp_path / "sct2_Description_Snapshot-en_INT_20240101.txt"
+    with open(path, "w") as f:
+        f.write("id\teffectiveTime\tactive\tmoduleId\tconceptId\tlanguageCode\t"
+                "typeId\tterm\tcaseSignificanceId\n")
+        for i, (concept, type_id, term, active) in enumerate(rows):
+            f.write(f"{i}\t20240101\t{active}\t900000000000207008\t{concept}\ten\t"
+                    f"{type_id}\t{term}\t900000000000448009\n")
+    return str(path)
+
+
+################################################
+# Fixtures pour la lecture de la Common French #
+################################################
+@pytest.fixture
+def common_french(tmp_path) -> str:
+    # (id, active, conceptId, typeId, term, caseSignificanceId)
+    descriptions = [("1", "1", "10", "900000000000003001", 'Injury "A" (disorder)',
+                     "900000000000448009"),
+                    ("2", "1", "10", "900000000000013009", 'lésion "A',
+                     "900000000000017005"),
+                    ("3", "0", "11", "900000000000013009", "inactif",
+                     "900000000000448009"),
+                    ("4", "1", "11", "900000000000013009", "lésion B",
+                     "900000000000020002"),
+                    ("5", "1", "308916002", "900000000000013009", "lieu",
+                     "900000000000448009"),
+                    ("6", "1", "12", "900000000000013009", "lésion C", "0")]
+    # (referencedComponentId, acceptabilityId)
+    language = [("2", "900000000000548007"), ("4", "900000000000549004"),
+                ("5", "900000000000548007"), ("6", "0")]
+    path = tmp_path / "Snapshot"
+    (path / "Terminology").mkdir(parents=True)
+    (path / "Refset" / "Language").mkdir(parents=True)
+    with open(path / "Terminology" / "sct2_Description_Snapshot_CommonFrench-Extension_20240101.txt", "w") as f: # noqa
+        f.write("id\teffectiveTime\tactive\tmoduleId\tconceptId\tlanguageCode\t"
+                "typeId\tterm\tcaseSignificanceId\n")
+        for id_, active, concept, type_id, term, case in descriptions:
+            f.write(f"{id_}\t20240101\t{active}\t11000241103\t{concept}\tfr\t"
+                    f"{type_id}\t{term}\t{case}\n")
+    with open(path / "Refset" / "Language" / "der2_cRefset_LanguageSnapshot_CommonFrench-Extension_20240101.txt", "w") as f: # noqa
+        f.write("id\teffectiveTime\tactive\tmoduleId\trefsetId\t"
+                "referencedComponentId\tacceptabilityId\n")
+        for i, (description, acceptability) in enumerate(language):
+            f.write(f"l{i}\t20240101\t1\t11000241103\t21000241105\t{description}\t"
+                    f"{acceptability}\n")
+    return str(path)
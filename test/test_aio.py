@@ -0,0 +1,139 @@
+import asyncio
+import pandas as pd
+import pytest
+
+from import_batch_ftcg import backend, control, local, stub
+from import_batch_ftcg.cache import ExpansionCache
+from pathlib import Path
+from typing import Generator
+
+aio = pytest.importorskip("import_batch_ftcg.aio")
+httpx = pytest.importorskip("httpx")
+
+ROOT = stub.SYNTHETIC_ROOT
+
+
+@pytest.fixture(scope="module")
+def terminology() -> local.LocalTerminology:
+    return stub.synthetic(1111, branching=10)
+
+
+@pytest.fixture
+def fts(terminology: local.LocalTerminology) -> Generator[stub.StubFts, None, None]:
+    with stub.StubFts(terminology, max_count=100, latency=0.05) as s:
+        yield s
+
+
+def test_ecl_many(fts: stub.StubFts) -> None:
+    """Vérifie que les expansions et leurs pages sont demandées simultanément, et
+    que chaque sous-requête élémentaire n'est expansée qu'une fois.
+
+    args:
+        fts: Serveur de substitution (pages de 100 codes, 50 ms de latence)
+    """
+    ecls = [f"<< {ROOT}", f"<< {ROOT + 1}", f"<< {ROOT} MINUS << {ROOT + 1}"]
+
+    async def run() -> tuple:
+        async with aio.AsyncFts(fts.endpoint, page_size=500) as client:
+            # Une première requête ouvre la connexion avant la mesure
+            await client.ecl(f"<< {ROOT + 11}")
+            fts.peak = 0
+            scopes = await client.ecl_many(ecls)
+            assert len(await client.ecl(f"<< {ROOT + 1}")) == 111
+            return scopes
+
+    scopes = asyncio.run(run())
+
+    assert [len(scopes[ecl]) for ecl in ecls] == [1111, 111, 1000]
+    # 12 pages pour << ROOT et 2 pour << ROOT + 1, demandées simultanément
+    assert len(fts.requests) == 1 + 14
+    assert fts.peak > 1
+
+
+def test_retries(terminology: local.LocalTerminology) -> None:
+    """Vérifie que les erreurs 503 sont suivies de nouvelles tentatives.
+
+    args:
+        terminology: Hiérarchie synthétique de 1111 concepts
+    """
+    with stub.StubFts(terminology, error_rate=0.3, max_count=100, seed=1) as s:
+        client = aio.SyncFts(aio.AsyncFts(s.endpoint, retries=20, backoff=0))
+        assert len(client.ecl(f"<< {ROOT}")) == 1111
+        client.close()
+        assert len(s.requests) > 12
+
+
+def test_paging_without_total(terminology: local.LocalTerminology) -> None:
+    """Vérifie que l'expansion n'est pas tronquée lorsque le serveur plafonne la
+    taille des pages sans annoncer de total.
+
+    args:
+        terminology: Hiérarchie synthétique de 1111 concepts
+    """
+    with stub.StubFts(terminology, max_count=100, total=False) as s:
+        client = aio.SyncFts(aio.AsyncFts(s.endpoint, page_size=500))
+        codes = client.ecl(f"<< {ROOT}")
+        client.close()
+        assert len(codes) == 1111
+        assert len(s.requests) == 13
+
+
+def test_sync_facade(relationships: str, control_cf: pd.DataFrame) -> None:
+    """Vérifie que la façade synchrone s'utilise comme `server.Fts` par les
+    contrôles qualité.
+
+    args:
+        relationships: Chemin vers un fichier de relations RF2 de test
+        control_cf: Traductions à contrôler
+    """
+    terminology = local.LocalTerminology(relationships)
+    with stub.StubFts(terminology) as s:
+        client = aio.SyncFts(aio.AsyncFts(s.endpoint))
+        result = control.run_quality_control(control_cf.copy(), client)
+        client.close()
+
+    pd.testing.assert_frame_equal(
+        result, control.run_quality_control(control_cf.copy(), terminology))
+
+
+def test_version_change(fts: stub.StubFts, tmp_path: Path) -> None:
+    """Vérifie que les expansions sont mises en cache avec la version annoncée par
+    le FTS, invalidées lorsqu'il en annonce une nouvelle, et que la version fixée
+    est vérifiée.
+
+    args:
+        fts: Serveur de substitution
+        tmp_path: Répertoire temporaire du cache
+    """
+    ecl = f"<< {ROOT + 1}"
+    cache = ExpansionCache(tmp_path / "cache.sqlite")
+
+    def expand(**kwargs: str) -> pd.Index:
+        client = aio.SyncFts(aio.AsyncFts(fts.endpoint, cache=cache, **kwargs))
+        try:
+            return client.ecl(ecl)
+        finally:
+            client.close()
+
+    assert len(expand()) == 111
+    assert cache.lookup(fts.endpoint, backend.INTERNATIONAL, ecl).version \
+        == fts.version
+    sent = len(fts.requests)
+    assert len(expand()) == 111
+    assert len(fts.requests) == sent + 1
+    assert "/CodeSystem/$lookup" in fts.requests[-1]
+
+    fts.version = "http://snomed.info/sct/900000000000207008/version/20240701"
+    sent = len(fts.requests)
+    assert len(expand()) == 111
+    assert len(fts.requests) == sent + 1 + 2
+    assert cache.lookup(fts.endpoint, backend.INTERNATIONAL, ecl).version \
+        == fts.version
+
+    assert len(expand(version=fts.version)) == 111
+    assert cache.get(fts.endpoint, fts.version, ecl) is not None
+    other = "http://snomed.info/sct/900000000000207008/version/20230101"
+    with pytest.raises(httpx.HTTPStatusError):
+        expand(version=other)
+    with pytest.raises(ValueError):
+        aio.AsyncFts(fts.endpoint, version="20240101")
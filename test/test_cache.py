@@ -0,0 +1,284 @@
+import json
+import pandas as pd
+import pytest
+import responses
+import sqlite3
+import threading
+import time
+import zlib
+
+from import_batch_ftcg import ecl, server
+from import_batch_ftcg.cache import ExpansionCache, MemoryCache
+from pathlib import Path
+
+
+def test_normalize() -> None:
+    """Vérifie que deux écritures équivalentes d'une requête ECL donnent la même clé
+    de cache"""
+    assert ecl.normalize("<<123037004 |Body structure| minus   <<64572001") \
+        == ecl.normalize("<< 123037004 MINUS << 64572001")
+    assert ecl.normalize("<< 417746004: 363698007 != << 39937001") \
+        == "<< 417746004 : 363698007 != << 39937001"
+    # Les requêtes non prises en charge par l'analyseur ne sont pas interprétées
+    assert ecl.normalize('<< 1 {{ term = "heart" }}') \
+        != ecl.normalize('<< 1 {{ term = "HEART" }}')
+    assert ecl.normalize("<< 1 : 2 = #5.5") != ecl.normalize("<< 1 : 2 = #5 5")
+    assert ecl.normalize("<< 1 :  2 = #5.5") == "<< 1 : 2 = #5.5"
+
+
+def test_cache_roundtrip(tmp_path: Path) -> None:
+    """Vérifie qu'une expansion mise en cache est relue à l'identique.
+
+    args:
+        tmp_path: Dossier temporaire contenant le cache
+    """
+    cache = ExpansionCache(str(tmp_path / "cache.db"))
+    assert cache.get("http://fts", "edition", "<< 1") is None
+    cache.set("http://fts", "edition", "<< 1", ["1", "2"])
+    cache.set("http://fts", "edition", "<< 3", [])
+    assert cache.get("http://fts", "edition", "<<1") == ["1", "2"]
+    assert cache.get("http://fts", "edition", "<< 3") == []
+    # La clé dépend de l'endpoint et de l'édition
+    assert cache.get("http://autre", "edition", "<< 1") is None
+    assert cache.get("http://fts", "autre", "<< 1") is None
+
+
+def test_cache_ttl(tmp_path: Path) -> None:
+    """Vérifie qu'une expansion expirée n'est plus renvoyée.
+
+    args:
+        tmp_path: Dossier temporaire contenant le cache
+    """
+    cache = ExpansionCache(str(tmp_path / "cache.db"), ttl=-1)
+    cache.set("http://fts", "edition", "<< 1", ["1"])
+    assert cache.get("http://fts", "edition", "<< 1") is None
+
+
+def test_cache_lru(tmp_path: Path) -> None:
+    """Vérifie que les expansions les moins récemment utilisées sont supprimées
+    lorsque la taille maximale est dépassée.
+
+    args:
+        tmp_path: Dossier temporaire contenant le cache
+    """
+    cache = ExpansionCache(str(tmp_path / "cache.db"))
+    cache.set("http://fts", "edition", "<< 1", ["1"])
+    cache.set("http://fts", "edition", "<< 2", ["2"])
+    cache.get("http://fts", "edition", "<< 1")
+    # La limite ne laisse de la place que pour deux expansions
+    cache.max_size = 2 * len(zlib.compress(b"1"))
+    cache.set("http://fts", "edition", "<< 3", ["3"])
+    assert cache.get("http://fts", "edition", "<< 1") == ["1"]
+    assert cache.get("http://fts", "edition", "<< 2") is None
+    assert cache.get("http://fts", "edition", "<< 3") == ["3"]
+
+
+def test_cache_migration(tmp_path: Path) -> None:
+    """Vérifie qu'un cache créé sans les colonnes des validateurs reste lisible.
+
+    args:
+        tmp_path: Dossier temporaire contenant le cache
+    """
+    path = str(tmp_path / "cache.db")
+    with sqlite3.connect(path) as db:
+        db.execute("""CREATE TABLE expansion (
+                          endpoint TEXT NOT NULL, edition TEXT NOT NULL,
+                          ecl TEXT NOT NULL, codes BLOB NOT NULL,
+                          size INTEGER NOT NULL, created REAL NOT NULL,
+                          accessed REAL NOT NULL,
+                          PRIMARY KEY (endpoint, edition, ecl))""")
+    cache = ExpansionCache(path)
+    cache.set("http://fts", "edition", "<< 1", ["1"], etag='"a"')
+    assert cache.lookup("http://fts", "edition", "<< 1").etag == '"a"'
+
+
+def test_cache_invalidate(tmp_path: Path) -> None:
+    """Vérifie que seules les expansions obtenues avec une autre version de
+    l'édition sont supprimées.
+
+    args:
+        tmp_path: Dossier temporaire contenant le cache
+    """
+    cache = ExpansionCache(str(tmp_path / "cache.db"))
+    cache.set("http://fts", "sct", "<< 1", ["1"], version="v1")
+    cache.set("http://fts", "sct", "<< 2", ["2"], version="v2")
+    cache.set("http://fts", "sct", "<< 3", ["3"])
+    assert cache.invalidate("http://fts", "sct", "v2") == 1
+    assert cache.get("http://fts", "sct", "<< 1") is None
+    assert cache.get("http://fts", "sct", "<< 2") == ["2"]
+    assert cache.get("http://fts", "sct", "<< 3") == ["3"]
+
+
+def test_fts_cache(tmp_path: Path, pytestconfig: pytest.Config) -> None:
+    """Vérifie qu'une seconde exécution avec le même cache n'envoie aucune requête
+    au FTS.
+
+    args:
+        tmp_path: Dossier temporaire contenant le cache
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    path = str(tmp_path / "cache.db")
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET,
+                 url=f"{endpoint}/ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20410607006&includeDesignations=false&_elements=expansion&count=5000&offset=0", # noqa
+                 json={"expansion": {"total": 2,
+                                     "contains": [{"code": "1"}, {"code": "2"}]}})
+        assert list(server.Fts(endpoint, ExpansionCache(path)).ecl("<< 410607006")) \
+            == [1, 2]
+        assert len(mock.calls) == 1
+
+    with responses.RequestsMock() as mock:
+        assert list(server.Fts(endpoint, ExpansionCache(path)).ecl("<<410607006")) \
+            == [1, 2]
+        assert len(mock.calls) == 0
+
+
+def test_memory_lru() -> None:
+    """Vérifie que les expansions les moins récemment utilisées sont supprimées du
+    cache mémoire lorsque le nombre total de codes dépasse la limite."""
+    memory = MemoryCache(max_codes=4)
+    memory.get("<< 1", lambda: pd.Index(["1", "2"]))
+    memory.get("<< 2", lambda: pd.Index(["3"]))
+    memory.get("<< 1", lambda: pytest.fail("Expansion recalculée"))
+    memory.get("<< 3", lambda: pd.Index(["4", "5"]))
+    assert memory.codes == 4
+    assert list(memory.get("<< 2", lambda: pd.Index(["6"]))) == ["6"]
+    # Une expansion plus grande que la limite n'est pas conservée
+    memory.get("<< 4", lambda: pd.Index([str(i) for i in range(5)]))
+    assert len(memory) == 0
+    assert memory.codes == 0
+
+
+def test_memory_single_flight() -> None:
+    """Vérifie que les appels simultanés pour une même clé partagent un seul
+    calcul, et que les erreurs sont transmises sans être conservées."""
+    memory = MemoryCache()
+    calls = []
+
+    def expand() -> pd.Index:
+        calls.append(1)
+        time.sleep(0.1)
+        return pd.Index(["1"])
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(memory.get("<< 1",
+                                                                         expand)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert [list(r) for r in results] == [["1"]] * 4
+
+    def fail() -> pd.Index:
+        raise ValueError("Erreur")
+
+    with pytest.raises(ValueError):
+        memory.get("<< 2", fail)
+    assert list(memory.get("<< 2", lambda: pd.Index(["2"]))) == ["2"]
+
+
+def test_fts_single_flight(pytestconfig: pytest.Config) -> None:
+    """Vérifie que des appels simultanés à `Fts.ecl` pour une même requête
+    n'envoient qu'une requête au FTS.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+
+    def slow(request):
+        time.sleep(0.1)
+        return 200, {}, '{"expansion": {"total": 1, "contains": [{"code": "1"}]}}'
+
+    with responses.RequestsMock() as mock:
+        mock.add_callback(method=responses.GET,
+                          url=f"{endpoint}/ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20410607006&includeDesignations=false&_elements=expansion&count=5000&offset=0", # noqa
+                          callback=slow)
+        fts = server.Fts(endpoint)
+        threads = [threading.Thread(target=fts.ecl, args=("<< 410607006",))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(mock.calls) == 1
+        assert len(fts.summary()) == 1
+
+
+def test_fts_revalidation(tmp_path: Path, pytestconfig: pytest.Config) -> None:
+    """Vérifie qu'une expansion expirée est confirmée par la version annoncée dans
+    la première page, sans télécharger les pages suivantes, et que ses
+    validateurs sont envoyés au FTS.
+
+    args:
+        tmp_path: Dossier temporaire contenant le cache
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    cache = ExpansionCache(str(tmp_path / "cache.db"), ttl=-1)
+    first = f"{endpoint}/ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20410607006&includeDesignations=false&_elements=expansion&count=2&offset=0" # noqa
+    second = first.replace("offset=0", "offset=2")
+    version = [{"name": "version",
+                "valueUri": "http://snomed.info/sct/900000000000207008/version/1"}]
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=first,
+                 headers={"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"},
+                 json={"expansion": {"total": 3, "parameter": version,
+                                     "contains": [{"code": "1"}, {"code": "2"}]}})
+        mock.add(method=responses.GET, url=second,
+                 json={"expansion": {"total": 3, "contains": [{"code": "3"}]}})
+        server.Fts(endpoint, cache, page_size=2).ecl("<< 410607006")
+        assert len(mock.calls) == 2
+
+        fts = server.Fts(endpoint, cache, page_size=2)
+        assert list(fts.ecl("<< 410607006")) == [1, 2, 3]
+        assert len(mock.calls) == 3
+        assert mock.calls[2].request.headers["If-Modified-Since"] \
+            == "Mon, 01 Jan 2024 00:00:00 GMT"
+        assert fts.summary().loc[0, "cache"] == "revalidated"
+
+
+def test_fts_batch_revalidation(tmp_path: Path, pytestconfig: pytest.Config) -> None:
+    """Vérifie que la date de modification est convertie entre le format HTTP des
+    en-têtes et l'instant FHIR des Bundle batch, quel que soit le client ayant mis
+    l'expansion en cache.
+
+    args:
+        tmp_path: Dossier temporaire contenant le cache
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    cache = ExpansionCache(str(tmp_path / "cache.db"), ttl=-1)
+    first = f"{endpoint}/ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%3C%3C%20410607006&includeDesignations=false&_elements=expansion&count=2&offset=0" # noqa
+    version = [{"name": "version",
+                "valueUri": "http://snomed.info/sct/900000000000207008/version/2"}]
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=first,
+                 headers={"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"},
+                 json={"expansion": {"total": 1, "contains": [{"code": "1"}]}})
+        server.Fts(endpoint, cache, page_size=2).ecl("<< 410607006")
+
+        # Le FTS annonce une nouvelle version : l'expansion est remplacée
+        entries = [{"response": {"status": "200 OK",
+                                 "lastModified": "2024-02-01T00:00:00Z"},
+                    "resource": {"expansion": {"total": 1, "parameter": version,
+                                               "contains": [{"code": code}]}}}
+                   for code in ("2", "3")]
+        mock.add(method=responses.POST, url=endpoint,
+                 json={"type": "batch-response", "entry": entries})
+        fts = server.Fts(endpoint, cache, page_size=2, batch=True)
+        scopes = fts.ecl_many(["<< 410607006", "<< 1"])
+        assert [list(scope) for scope in scopes.values()] == [[2], [3]]
+        requests = [entry["request"]
+                    for entry in json.loads(mock.calls[1].request.body)["entry"]]
+        assert requests[0]["ifModifiedSince"] == "2024-01-01T00:00:00+00:00"
+        assert "ifModifiedSince" not in requests[1]
+        assert cache.lookup(endpoint, fts.edition, "<< 410607006").modified \
+            == "Thu, 01 Feb 2024 00:00:00 GMT"
+
+        server.Fts(endpoint, cache, page_size=2).ecl("<< 410607006")
+        assert mock.calls[2].request.headers["If-Modified-Since"] \
+            == "Thu, 01 Feb 2024 00:00:00 GMT"
@@ -18,3 +18,12 @@ def test_no_missing_arguments(control_cf: pd.DataFrame, fts: Generator,
     fts = server.Fts(pytestconfig.getoption("endpoint"))
     pd.testing.assert_frame_equal(control.run_quality_control(control_cf, fts),
                                   control_cf)
+
+
+def test_rules() -> None:
+    """Vérifie que `control.RULES` liste la colonne de chaque fonction de contrôle,
+    dans l'ordre de `run_quality_control`"""
+    calls = [name.replace("_check_", "").replace("_", ".")
+             for name in control.run_quality_control.__code__.co_names
+             if name.startswith("_check_")]
+    assert list(control.RULES) == calls
@@ -0,0 +1,45 @@
+import pytest
+
+from import_batch_ftcg import ecl
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("<< 123037004 |Body structure| minus << 64572001",
+     ecl.Compound("MINUS", ecl.Concept("<<", "123037004"),
+                  ecl.Concept("<<", "64572001"))),
+    ("<< 417746004: 363698007 != << 39937001",
+     ecl.Refinement(ecl.Concept("<<", "417746004"),
+                    (ecl.Attribute(ecl.Concept("", "363698007"), "!=",
+                                   ecl.Concept("<<", "39937001")),))),
+    ("(<< 1 OR << 2) AND 3",
+     ecl.Compound("AND", ecl.Compound("OR", ecl.Concept("<<", "1"),
+                                      ecl.Concept("<<", "2")),
+                  ecl.Concept("", "3"))),
+    ("<< 1 OR << 2 OR 3",
+     ecl.Compound("OR", ecl.Compound("OR", ecl.Concept("<<", "1"),
+                                     ecl.Concept("<<", "2")),
+                  ecl.Concept("", "3"))),
+])
+def test_parse(query: str, expected: ecl.Node) -> None:
+    """Vérifie l'analyse d'une requête ECL et son écriture normalisée.
+
+    args:
+        query: Requête ECL
+        expected: Arbre syntaxique attendu
+    """
+    assert ecl.parse(query) == expected
+    assert ecl.parse(ecl.to_string(expected)) == expected
+
+
+@pytest.mark.parametrize("query", ["^ 723264001", "<< 1 :", "(<< 1", "<< (1 OR 2)",
+                                   "<< 1 : 2 >= 3", "<< 1 2",
+                                   "<< 1 OR << 2 AND << 3", "<< 1 AND 2 MINUS 3",
+                                   "<< 1 MINUS 2 MINUS 3"])
+def test_parse_unsupported(query: str) -> None:
+    """Vérifie qu'une syntaxe ECL non prise en charge lève une erreur.
+
+    args:
+        query: Requête ECL
+    """
+    with pytest.raises(ValueError):
+        ecl.parse(query)
@@ -0,0 +1,292 @@
+import gzip
+import numpy as np
+import pandas as pd
+import pytest
+import shutil
+import zipfile
+
+from import_batch_ftcg import io, local
+from pathlib import Path
+
+
+class Excluded(local.LocalTerminology):
+    """Source de terminologie dont la seule hiérarchie exclue est le concept
+    308916002"""
+
+    def __init__(self):
+        pass
+
+    def ecl(self, ecl: str) -> pd.Index:
+        return pd.Index([308916002])
+
+
+@pytest.fixture(params=["arrow", "pandas"])
+def reader(request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch) -> str:
+    if request.param == "arrow":
+        pytest.importorskip("pyarrow")
+    else:
+        monkeypatch.setattr(io, "pa", None)
+    return request.param
+
+
+def test_read_common_french(reader: str, common_french: str) -> None:
+    """Vérifie la lecture de la Common French avec les deux lecteurs RF2 :
+    guillemets conservés, casse et acceptabilité recodées (None si inconnues).
+
+    args:
+        reader: Lecteur RF2 utilisé (Arrow ou pandas)
+        common_french: Chemin vers le dossier Snapshot d'une Common French de test
+    """
+    cf = io.read_common_french(common_french, "20240101", Excluded())
+    expected = pd.DataFrame({
+        "id": [2, 4, 6],
+        "conceptId": [10, 11, 12],
+        "term": ['lésion "A', "lésion B", "lésion C"],
+        "caseSignificanceId": ["CS", "cI", None],
+        "fsn": ['Injury "A" (disorder)', None, None],
+        "acceptabilityId": ["PREFERRED", "ACCEPTABLE", None]}).astype(
+            {"id": np.int64, "conceptId": np.int64})
+    pd.testing.assert_frame_equal(cf.reset_index(drop=True), expected)
+    assert list(cf.dtypes.iloc[:2]) == [np.int64, np.int64]
+
+
+def test_read_common_french_chunks(reader: str, common_french: str,
+                                   monkeypatch: pytest.MonkeyPatch) -> None:
+    """Vérifie que la lecture par petits morceaux donne les mêmes descriptions
+    que la lecture en un seul morceau.
+
+    args:
+        reader: Lecteur RF2 utilisé (Arrow ou pandas)
+        common_french: Chemin vers le dossier Snapshot d'une Common French de test
+        monkeypatch: Réduit la taille des morceaux lus
+    """
+    expected = io.read_common_french(common_french, "20240101", Excluded())
+    desc_path = next(Path(common_french).glob("Terminology/*.txt"))
+    monkeypatch.setattr(io, "CHUNK_SIZE", 256)
+    assert len(list(io.read_rf2_chunks(str(desc_path), ["id"]))) > 1
+    pd.testing.assert_frame_equal(
+        io.read_common_french(common_french, "20240101", Excluded()), expected)
+
+
+def test_read_release_zip(reader: str, common_french: str, tmp_path: Path) -> None:
+    """Vérifie la lecture de la Common French dans l'archive ZIP de la release,
+    sans l'extraire, les fichiers Snapshot étant localisés par leur nom.
+
+    args:
+        reader: Lecteur RF2 utilisé (Arrow ou pandas)
+        common_french: Chemin vers le dossier Snapshot d'une Common French de test
+        tmp_path: Dossier temporaire contenant l'archive
+    """
+    expected = io.read_common_french(common_french, "20240101", Excluded())
+    release = tmp_path / "SnomedCT_CommonFrench_20240101.zip"
+    with zipfile.ZipFile(release, "w") as archive:
+        for path in Path(common_french).rglob("*.txt"):
+            name = f"Release/Snapshot/{path.relative_to(common_french)}"
+            if "Description" in path.name:
+                # Fichier compressé par gzip, accompagné du fichier Full à ignorer
+                archive.writestr(f"{name}.gz", gzip.compress(path.read_bytes()))
+                archive.write(path, name.replace("Snapshot", "Full"))
+            else:
+                archive.write(path, name)
+
+    pd.testing.assert_frame_equal(
+        io.read_common_french(str(release), "20240101", Excluded()), expected)
+    # Le dossier de la release extraite convient également
+    shutil.copytree(common_french, tmp_path / "Release" / "Snapshot")
+    pd.testing.assert_frame_equal(
+        io.read_common_french(str(tmp_path / "Release"), "20240101", Excluded()),
+        expected)
+    with pytest.raises(ValueError, match="Aucun fichier"):
+        io.read_common_french(str(release), "20240102", Excluded())
+
+
+def test_locate(tmp_path: Path) -> None:
+    """Vérifie la localisation d'un fichier RF2 par le motif de son nom.
+
+    args:
+        tmp_path: Dossier temporaire contenant les fichiers RF2
+    """
+    (tmp_path / "sct2_Description_Snapshot-fr_FR_20240101.txt").write_text("")
+    (tmp_path / "sct2_Description_Snapshot-en_FR_20240101.txt").write_text("")
+    assert io.locate(str(tmp_path), "sct2_Description_Snapshot-fr*.txt") \
+        == str(tmp_path / "sct2_Description_Snapshot-fr_FR_20240101.txt")
+    with pytest.raises(ValueError, match="Plusieurs fichiers"):
+        io.locate(str(tmp_path), "sct2_Description_Snapshot*.txt")
+    # Un fichier est renvoyé tel quel
+    assert io.locate(str(tmp_path / "report.tsv"), "*.txt") \
+        == str(tmp_path / "report.tsv")
+
+
+def test_read_rf2(reader: str, relationships: str) -> None:
+    """Vérifie le typage des colonnes lues.
+
+    args:
+        reader: Lecteur RF2 utilisé (Arrow ou pandas)
+        relationships: Chemin vers un fichier de relations RF2 de test
+    """
+    rel = io.read_rf2(relationships, ["typeId", "sourceId"],
+                      dtype={"sourceId": "int64"})
+    assert list(rel.columns) == ["typeId", "sourceId"]
+    assert rel.loc[:, "sourceId"].dtype == "int64"
+    assert rel.loc[0, "typeId"] == "116680003"
+
+
+def test_write_batch_file(tmp_path: Path) -> None:
+    """Vérifie que les SCTID, manipulés sous forme d'entiers, sont écrits tels
+    quels dans le fichier d'import, avec les colonnes des contrôles qualité.
+
+    args:
+        tmp_path: Dossier temporaire contenant le fichier d'import
+    """
+    cf = pd.DataFrame({"id": [1, 2], "conceptId": [10, 1234567890123456789],
+                       "term": ["a", "b"], "caseSignificanceId": ["ci", None],
+                       "fsn": ["A (disorder)", None],
+                       "acceptabilityId": ["PREFERRED", "ACCEPTABLE"],
+                       "ar2": [None, "1"]}).astype({"id": np.int64,
+                                                    "conceptId": np.int64})
+    io.write_batch_file(cf, str(tmp_path / "batch.tsv"))
+    batch = pd.read_csv(tmp_path / "batch.tsv", sep="\t", dtype=str,
+                        keep_default_na=False)
+
+    assert batch.loc[:, "conceptId"].dtype == "str"
+    assert list(batch.loc[:, "conceptId"]) == ["10", "1234567890123456789"]
+    assert list(batch.columns[[0, 3, 5, 8, -1]]) \
+        == ["conceptId", "term", "caseSignificanceId", "acceptability1", "ar2"]
+    assert list(batch.loc[:, "ar2"]) == ["", "1"]
+    assert cf.loc[:, "conceptId"].dtype == np.int64
+
+
+def test_input_cache(common_french: str, tmp_path: Path,
+                     monkeypatch: pytest.MonkeyPatch) -> None:
+    """Vérifie que les entrées en cache sont relues sans analyser les fichiers
+    RF2, puis reconstruites lorsqu'un fichier est modifié.
+
+    args:
+        common_french: Chemin vers le dossier Snapshot d'une Common French de test
+        tmp_path: Dossier temporaire contenant le cache des entrées
+        monkeypatch: Remplace le lecteur RF2 pendant la relecture du cache
+    """
+    pytest.importorskip("pyarrow")
+    cache_dir = str(tmp_path / "inputs")
+    fr = tmp_path / "sct2_Description_Snapshot_FR.txt"
+    fr.write_text("id\tconceptId\n1\t10\n2\t10\n3\t11\n")
+    unpub = tmp_path / "report.tsv"
+    unpub.write_text("Id\tisNew\n12\tY\n13\tN\n")
+
+    expected = io.read_common_french(common_french, "20240101", Excluded())
+    assert io.get_fr_edition(str(fr), str(unpub), cache_dir) == {10, 11, 12}
+    cached = io.read_common_french(common_french, "20240101", Excluded(), cache_dir)
+    assert len(list((tmp_path / "inputs").iterdir())) == 3
+
+    with monkeypatch.context() as m:
+        m.setattr(io, "read_rf2", None)
+        m.setattr(io.pd, "read_csv", None)
+        pd.testing.assert_frame_equal(
+            io.read_common_french(common_french, "20240101", Excluded(), cache_dir),
+            cached)
+        assert io.get_fr_edition(str(fr), str(unpub), cache_dir) \
+            == {10, 11, 12}
+    pd.testing.assert_frame_equal(cached, expected)
+    assert list(cached.dtypes.iloc[:2]) == [np.int64, np.int64]
+
+    unpub.write_text("Id\tisNew\n12\tY\n13\tY\n")
+    assert io.get_fr_edition(str(fr), str(unpub), cache_dir) \
+        == {10, 11, 12, 13}
+    assert len(list((tmp_path / "inputs").iterdir())) == 3
+
+
+def test_get_fr_edition_compressed(tmp_path: Path) -> None:
+    """Vérifie la lecture de l'édition nationale dans l'archive ZIP de sa release
+    et du rapport des modifications compressé par gzip.
+
+    args:
+        tmp_path: Dossier temporaire contenant les fichiers
+    """
+    release = tmp_path / "SnomedCT_ManagedServiceFR_20240101.zip"
+    with zipfile.ZipFile(release, "w") as archive:
+        archive.writestr("Snapshot/Terminology/sct2_Description_Snapshot-en_FR_20240101.txt", # noqa
+                         "id\tconceptId\n1\t20\n")
+        archive.writestr("Snapshot/Terminology/sct2_Description_Snapshot-fr_FR_20240101.txt", # noqa
+                         "id\tconceptId\n1\t10\n2\t10\n3\t11\n")
+    unpub = tmp_path / "report.tsv.gz"
+    unpub.write_bytes(gzip.compress(b"Id\tisNew\n12\tY\n13\tN\n"))
+    assert io.get_fr_edition(str(release), str(unpub)) == {10, 11, 12}
+
+
+def test_read_changes(common_french: str, tmp_path: Path) -> None:
+    """Vérifie la détection des concepts et descriptions modifiés, d'après
+    l'effectiveTime de la Snapshot ou d'après les fichiers Delta.
+
+    args:
+        common_french: Chemin vers le dossier Snapshot d'une Common French de test
+        tmp_path: Dossier temporaire contenant la release
+    """
+    desc_path = next(Path(common_french).glob("Terminology/*.txt"))
+    lang_path = next(Path(common_french).glob("Refset/Language/*.txt"))
+    desc_path.write_text(desc_path.read_text().replace("4\t20240101", "4\t20240701"))
+    lang_path.write_text(lang_path.read_text().replace("l0\t20240101",
+                                                       "l0\t20240701"))
+
+    assert io.read_changes(common_french, "20240101", "20240101") == ({11}, {2})
+    assert io.read_changes(common_french, "20240101") \
+        == ({10, 11, 12, 308916002}, {2, 4, 5, 6})
+
+    delta = tmp_path / "Delta"
+    delta.mkdir()
+    (delta / "sct2_Description_Delta_CommonFrench-Extension_20240101.txt").write_text(
+        "id\teffectiveTime\tconceptId\n7\t20240101\t13\n")
+    (delta / "der2_cRefset_LanguageDelta_CommonFrench-Extension_20240101.txt") \
+        .write_text("id\teffectiveTime\treferencedComponentId\nl7\t20240101\t7\n")
+    assert io.read_changes(str(tmp_path), "20240101", delta=True) == ({13}, {7})
+
+
+def test_incremental(tmp_path: Path) -> None:
+    """Vérifie que seuls les concepts modifiés ou nouveaux sont traités, que les
+    résultats des autres sont repris de l'état de la dernière exécution et que
+    cet état est sauvegardé sans perte.
+
+    args:
+        tmp_path: Dossier temporaire contenant l'état
+    """
+    cf = pd.DataFrame({"id": [1, 2, 3, 4], "conceptId": [10, 10, 11, 12],
+                       "term": ["a", "b", "c", "d"],
+                       "caseSignificanceId": ["ci", "CS", "ci", None],
+                       "fsn": ["A (disorder)", "A (disorder)", None, None],
+                       "acceptabilityId": ["PREFERRED", "ACCEPTABLE",
+                                           "PREFERRED", "PREFERRED"]})
+    # Le concept 11 est inchangé, l'acceptabilité de la description 2 a changé, la
+    # description 4 est nouvelle et la description 9 n'est plus à importer
+    state = pd.concat([cf.iloc[:3], cf.iloc[:1].assign(id=9, conceptId=13)],
+                      ignore_index=True)
+    state = state.assign(ar2=[None, None, "1", None])
+    assert io.read_state(str(tmp_path / "state.db")) == (None, None)
+    io.write_state(str(tmp_path / "state.db"), state, "20240101")
+    state, release = io.read_state(str(tmp_path / "state.db"))
+    assert release == "20240101"
+
+    processed, kept = io.select_changes(cf, state, ({11}, {2}))
+    assert list(processed.loc[:, "id"]) == [1, 2, 3, 4]
+    processed, kept = io.select_changes(cf, state, (set(), {2}))
+    assert list(processed.loc[:, "id"]) == [1, 2, 4]
+    assert list(kept.loc[:, "id"]) == [3]
+
+    merged = io.merge_changes(cf, processed.assign(bs2=[None, None, "1"]), kept)
+    assert list(merged.loc[:, "id"]) == [1, 2, 3, 4]
+    assert list(merged.loc[:, "ar2"].isna()) == [True, True, False, True]
+    assert list(merged.loc[:, "bs2"].isna()) == [True, True, True, False]
+    io.write_state(str(tmp_path / "state.db"), merged, "20240701", "v1")
+    state, release = io.read_state(str(tmp_path / "state.db"), "v1")
+    pd.testing.assert_frame_equal(state, merged, check_dtype=False)
+    assert release == "20240701"
+    # L'état obtenu avec une autre version de l'édition est ignoré
+    assert io.read_state(str(tmp_path / "state.db"), "v2") == (None, None)
+
+    # Les règles qui ne sont plus signalées sont supprimées, les autres suivent
+    # l'ordre des contrôles
+    merged = io.merge_changes(cf, processed.assign(ar2=[None, None, "1"]),
+                              kept.loc[:, cf.columns].assign(pr3="1", bs2=None))
+    assert list(merged.columns) == [*cf.columns, "ar2", "pr3"]
+
+    # Sans état, seuls les concepts modifiés sont traités
+    processed, kept = io.select_changes(cf, changes=({12}, set()))
+    assert list(processed.loc[:, "id"]) == [4] and kept.empty
@@ -0,0 +1,132 @@
+import gzip
+import numpy as np
+import pandas as pd
+import pytest
+import zipfile
+
+from import_batch_ftcg import io, local
+from pathlib import Path
+
+
+@pytest.fixture(params=["rf2", "zip", "closure"])
+def terminology(request: pytest.FixtureRequest, relationships: str,
+                tmp_path: Path) -> local.LocalTerminology:
+    """Moteur ECL local construit à partir du fichier RF2, de l'archive ZIP de la
+    release (fichier compressé par gzip) ou de la fermeture transitive
+    précalculée."""
+    if request.param == "rf2":
+        return local.LocalTerminology(relationships)
+    if request.param == "zip":
+        with zipfile.ZipFile(tmp_path / "release.zip", "w") as release:
+            release.writestr(f"Snapshot/Terminology/{Path(relationships).name}.gz",
+                             gzip.compress(Path(relationships).read_bytes()))
+        return local.LocalTerminology(str(tmp_path / "release.zip"))
+    local.LocalTerminology(relationships).save(str(tmp_path / "closure.bin"))
+    return local.LocalTerminology(str(tmp_path / "closure.bin"))
+
+
+@pytest.mark.parametrize("ecl, expected", [
+    ("<< 417746004", {417746004, 10, 11, 12, 13}),
+    ("< 417746004", {10, 11, 12, 13}),
+    ("417746004", {417746004}),
+    ("<! 123037004", {39937001, 20}),
+    (">> 10", {10, 417746004, 404684003, 138875005}),
+    (">! 21", {39937001}),
+    ("<< 123037004 MINUS << 39937001", {123037004, 20}),
+    ("<< 417746004 AND << 123037004", set()),
+    ("< 404684003 OR < 123037004", {417746004, 10, 11, 12, 13,
+                                    39937001, 20, 21}),
+    ("<< 417746004: 363698007 = << 39937001", {10, 12, 13}),
+    ("<< 417746004: 363698007 != << 39937001", {11, 12}),
+    ("<< 417746004: 363698007 = * , 363698007 = 20", {11, 12}),
+    ("<< 14", set()),
+])
+def test_ecl(terminology: local.LocalTerminology, ecl: str, expected: set) -> None:
+    """Vérifie l'évaluation locale des requêtes ECL.
+
+    args:
+        terminology: Moteur ECL local de test
+        ecl: Requête ECL
+        expected: SCTID attendus
+    """
+    assert set(terminology.ecl(ecl)) == expected
+
+
+def test_ecl_many(relationships: str) -> None:
+    """Vérifie que `ecl_many` renvoie l'expansion de chaque requête ECL.
+
+    args:
+        relationships: Chemin vers un fichier de relations RF2 de test
+    """
+    scopes = local.LocalTerminology(relationships).ecl_many(["< 123037004",
+                                                             "<! 39937001"])
+    assert {ecl: set(codes) for ecl, codes in scopes.items()} \
+        == {"< 123037004": {39937001, 20, 21}, "<! 39937001": {21}}
+
+
+def test_unsupported(relationships: str) -> None:
+    """Vérifie qu'une syntaxe ECL non prise en charge lève une erreur.
+
+    args:
+        relationships: Chemin vers un fichier de relations RF2 de test
+    """
+    with pytest.raises(ValueError):
+        local.LocalTerminology(relationships).ecl("^ 723264001")
+
+
+def test_closure(relationships: str, tmp_path: Path) -> None:
+    """Vérifie que la fermeture transitive précalculée est projetée en mémoire et
+    contient les descendants de chaque concept.
+
+    args:
+        relationships: Chemin vers un fichier de relations RF2 de test
+        tmp_path: Dossier temporaire contenant la fermeture transitive
+    """
+    rf2 = local.LocalTerminology(relationships)
+    rf2.save(str(tmp_path / "closure.bin"))
+    closure = local.LocalTerminology(str(tmp_path / "closure.bin"))
+
+    assert isinstance(closure.concepts.base, np.memmap)
+    np.testing.assert_array_equal(closure.concepts, rf2.concepts)
+    indptr, descendants = closure._descendants
+    for i, concept in enumerate(closure.concepts):
+        assert set(closure.concepts[descendants[indptr[i]:indptr[i + 1]]]) \
+            == set(rf2.ecl(f"< {concept}").astype(int))
+
+
+def test_version(terminology: local.LocalTerminology) -> None:
+    """Vérifie que la version est datée par la relation la plus récente.
+
+    args:
+        terminology: Moteur ECL local
+    """
+    assert terminology.version() \
+        == "http://snomed.info/sct/900000000000207008/version/20240101"
+    with pytest.raises(ValueError, match="aucun fichier de descriptions"):
+        terminology.fsn([10])
+
+
+def test_fsn(relationships: str, descriptions: str) -> None:
+    """Vérifie la récupération des FSN actifs dans le fichier de descriptions et
+    le complément des FSN absents de la Common French.
+
+    args:
+        relationships: Chemin vers un fichier de relations RF2 de test
+        descriptions: Chemin vers un fichier de descriptions RF2 de test
+    """
+    terminology = local.LocalTerminology(relationships, descriptions)
+    fsn = terminology.fsn([11, 10, 12, 11])
+    assert list(fsn.index) == [11, 10, 12]
+    assert list(fsn.iloc[:2]) == ["Injury of joint (disorder)",
+                                  "Traumatic injury (disorder)"]
+    assert pd.isna(fsn.iloc[2])
+
+    cf = pd.DataFrame({"id": [1, 2, 3, 4],
+                       "conceptId": [10, 11, 11, 12],
+                       "fsn": [None, "Joint injury (disorder)", None, None]})
+    filled = io.fill_missing_fsn(cf, terminology)
+    assert list(filled.loc[:, "fsn"].iloc[:3]) == ["Traumatic injury (disorder)",
+                                                   "Joint injury (disorder)",
+                                                   "Injury of joint (disorder)"]
+    assert pd.isna(filled.loc[3, "fsn"])
+    assert cf.loc[:, "fsn"].isna().sum() == 3
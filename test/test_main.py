@@ -0,0 +1,137 @@
+import pytest
+import requests
+import runpy
+import subprocess
+import sys
+
+from import_batch_ftcg import local, server, stub
+from pathlib import Path
+from typing import Tuple
+
+ROOT = Path(__file__).parents[1]
+
+
+def run(common_french: str, relationships: str, tmp_path: Path, output: str,
+        *options: str) -> Tuple[str, str]:
+    """Lance l'import en ligne de commande avec le moteur ECL local.
+
+    args:
+        common_french: Chemin vers le dossier Snapshot de la Common French
+        relationships: Chemin vers le fichier de relations RF2
+        tmp_path: Dossier temporaire des fichiers d'entrée et de sortie
+        output: Nom du fichier d'import produit
+        options: Options supplémentaires
+
+    returns:
+        Sortie standard de l'exécution et contenu du fichier d'import
+    """
+    fr = tmp_path / "sct2_Description_Snapshot-fr_FR_20240101.txt"
+    fr.write_text("id\tconceptId\n1\t99\n")
+    unpub = tmp_path / "report.tsv"
+    unpub.write_text("Id\tisNew\n")
+    result = subprocess.run(
+        [sys.executable, "-m", "import_batch_ftcg.main", common_french, "20240101",
+         str(fr), str(unpub), "http://fts.test", str(tmp_path / output),
+         "--rf2", relationships, *options],
+        cwd=ROOT, capture_output=True, text=True, check=True)
+    return result.stdout, (tmp_path / output).read_text()
+
+
+def test_incremental(common_french: str, relationships: str,
+                     tmp_path: Path) -> None:
+    """Vérifie que le fichier d'import produit par l'import incrémental est
+    identique à celui d'une exécution complète, y compris lorsqu'une règle n'est
+    plus signalée ou que la version de l'édition change.
+
+    args:
+        common_french: Chemin vers le dossier Snapshot d'une Common French de test
+        relationships: Chemin vers un fichier de relations RF2 de test
+        tmp_path: Dossier temporaire
+    """
+    state = str(tmp_path / "state.db")
+    desc_path = next(Path(common_french).glob("Terminology/*.txt"))
+    original = desc_path.read_text()
+
+    def compare(expected_columns: str) -> str:
+        _, full = run(common_french, relationships, tmp_path, "full.tsv")
+        stdout, incremental = run(common_french, relationships, tmp_path,
+                                  "incremental.tsv", "--state", state)
+        assert incremental == full
+        assert full.splitlines()[0].endswith(expected_columns)
+        return stdout
+
+    # Première exécution : l'état est créé
+    stdout = compare("notes\tpa3")
+    assert "Sélection des descriptions modifiées" not in stdout
+
+    # La description 4 (concept 11) enfreint la règle ar2 : seul son concept est
+    # traité, la règle pa3 du concept 10 est reprise de l'état
+    desc_path.write_text(original.replace("4\t20240101\t1\t11000241103\t11\tfr\t"
+                                          "900000000000013009\tlésion B",
+                                          "4\t20240701\t1\t11000241103\t11\tfr\t"
+                                          "900000000000013009\tla lésion B"))
+    stdout = compare("notes\tar2\tpa3")
+    assert "(1 lignes à traiter, 3 conservées)" in stdout
+
+    # La description 4 est corrigée : la règle ar2 n'est plus signalée
+    desc_path.write_text(original.replace("4\t20240101", "4\t20240801"))
+    stdout = compare("notes\tpa3")
+    assert "(1 lignes à traiter, 3 conservées)" in stdout
+
+    # Nouvelle version de l'édition : l'état est ignoré
+    Path(relationships).write_text(Path(relationships).read_text()
+                                   .replace("\t20240101\t", "\t20240701\t"))
+    stdout = compare("notes\tpa3")
+    assert "Sélection des descriptions modifiées" not in stdout
+
+
+def test_edition_version(relationships: str, tmp_path: Path) -> None:
+    """Vérifie que la version de l'édition ne peut être fixée qu'avec le FTS.
+
+    args:
+        relationships: Chemin vers un fichier de relations RF2 de test
+        tmp_path: Dossier temporaire
+    """
+    version = "http://snomed.info/sct/900000000000207008/version/20240101"
+    for backend in (["--rf2", relationships], ["--backend", "snowstorm"]):
+        result = subprocess.run(
+            [sys.executable, "-m", "import_batch_ftcg.main", "cf", "20240101", "fr",
+             "unpub", "http://fts.test", str(tmp_path / "out.tsv"), *backend,
+             "--edition-version", version],
+            cwd=ROOT, capture_output=True, text=True)
+        assert result.returncode == 2
+        assert "--edition-version nécessite --backend fhir" in result.stderr
+
+
+def test_unknown_version(common_french: str, relationships: str, tmp_path: Path,
+                         monkeypatch: pytest.MonkeyPatch,
+                         capsys: pytest.CaptureFixture) -> None:
+    """Vérifie que l'état de l'import incrémental est ignoré si la version de
+    l'édition ne peut pas être récupérée auprès du FTS.
+
+    args:
+        common_french: Chemin vers le dossier Snapshot d'une Common French de test
+        relationships: Chemin vers un fichier de relations RF2 de test
+        tmp_path: Dossier temporaire
+        monkeypatch: Remplace la récupération de la version
+        capsys: Capture la sortie standard
+    """
+    def unreachable(self: server.Fts) -> None:
+        raise requests.ConnectionError("FTS injoignable")
+
+    monkeypatch.setattr(server.Fts, "version", unreachable)
+    fr = tmp_path / "sct2_Description_Snapshot-fr_FR_20240101.txt"
+    fr.write_text("id\tconceptId\n1\t99\n")
+    unpub = tmp_path / "report.tsv"
+    unpub.write_text("Id\tisNew\n")
+    with stub.StubFts(local.LocalTerminology(relationships)) as fts:
+        for _ in range(2):
+            monkeypatch.setattr(sys, "argv", [
+                "main.py", common_french, "20240101", str(fr), str(unpub),
+                fts.endpoint, str(tmp_path / "out.tsv"),
+                "--state", str(tmp_path / "state.db")])
+            runpy.run_module("import_batch_ftcg.main", run_name="__main__")
+            stdout = capsys.readouterr().out
+            assert "l'état de l'import incrémental est ignoré" in stdout
+            assert "Sélection des descriptions modifiées" not in stdout
+    assert len((tmp_path / "out.tsv").read_text().splitlines()) == 1 + 4
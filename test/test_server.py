@@ -0,0 +1,362 @@
+import gzip
+import json
+import pandas as pd
+import pytest
+import requests
+import responses
+import threading
+
+from import_batch_ftcg import server
+from import_batch_ftcg.cache import ExpansionCache
+from pathlib import Path
+
+
+def url(endpoint: str, ecl: str, offset: int = 0, count: int = 5000) -> str:
+    return f"{endpoint}/ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/{requests.utils.quote(ecl)}&includeDesignations=false&_elements=expansion&count={count}&offset={offset}" # noqa
+
+
+def page(total: int, codes: range) -> dict:
+    return {"expansion": {"total": total,
+                          "contains": [{"code": str(c)} for c in codes]}}
+
+
+def test_session(pytestconfig: pytest.Config) -> None:
+    """Vérifie que les requêtes passent par la session partagée avec compression.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=url(endpoint, "<< 1"),
+                 json={"expansion": {"total": 1, "contains": [{"code": "1"}]}})
+        assert list(server.Fts(endpoint).ecl("<< 1")) == [1]
+        assert "gzip" in mock.calls[0].request.headers["Accept-Encoding"]
+
+
+def test_retry(pytestconfig: pytest.Config) -> None:
+    """Vérifie qu'une erreur 502 ou 429 est suivie d'une nouvelle tentative.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=url(endpoint, "<< 1"), status=502)
+        mock.add(method=responses.GET, url=url(endpoint, "<< 1"), status=429)
+        mock.add(method=responses.GET, url=url(endpoint, "<< 1"),
+                 json={"expansion": {"total": 1, "contains": [{"code": "1"}]}})
+        assert list(server.Fts(endpoint, backoff=0).ecl("<< 1")) == [1]
+        assert len(mock.calls) == 3
+
+
+def test_retry_exhausted(pytestconfig: pytest.Config) -> None:
+    """Vérifie que l'erreur est remontée une fois les tentatives épuisées.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=url(endpoint, "<< 1"), status=503)
+        with pytest.raises(requests.HTTPError):
+            server.Fts(endpoint, retries=2, backoff=0).ecl("<< 1")
+        assert len(mock.calls) == 3
+
+
+def test_paging(pytestconfig: pytest.Config) -> None:
+    """Vérifie que toutes les pages d'une expansion sont récupérées, dans l'ordre.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    with responses.RequestsMock() as mock:
+        for offset in range(0, 10, 3):
+            mock.add(method=responses.GET,
+                     url=url(endpoint, "<< 1", offset=offset, count=3),
+                     json=page(10, range(offset, min(offset + 3, 10))))
+        fts = server.Fts(endpoint, page_size=3, prefetch=2)
+        assert [len(p) for p in fts.pages("<< 1")] == [3, 3, 3, 1]
+        assert list(fts.ecl("<< 1")) == list(range(10))
+
+
+def test_paging_capped(pytestconfig: pytest.Config) -> None:
+    """Vérifie que la pagination s'adapte à un FTS plafonnant la taille des pages.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=url(endpoint, "<< 1"),
+                 json=page(5, range(0, 2)))
+        for offset in (2, 4):
+            mock.add(method=responses.GET, url=url(endpoint, "<< 1", offset, 2),
+                     json=page(5, range(offset, min(offset + 2, 5))))
+        assert list(server.Fts(endpoint).ecl("<< 1")) == list(range(5))
+
+
+def test_paging_without_total(pytestconfig: pytest.Config) -> None:
+    """Vérifie que les pages sont lues jusqu'à la première page vide lorsque le FTS
+    n'annonce pas de total.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    with responses.RequestsMock() as mock:
+        for offset, codes in ((0, range(0, 2)), (2, range(2, 4)), (4, range(4, 5)),
+                              (5, range(5, 5))):
+            mock.add(method=responses.GET, url=url(endpoint, "<< 1", offset, 2),
+                     json={"expansion": {"contains": [{"code": str(c)}
+                                                      for c in codes]}})
+        assert list(server.Fts(endpoint, page_size=2).ecl("<< 1")) \
+            == list(range(5))
+
+
+def test_paging_incomplete(pytestconfig: pytest.Config) -> None:
+    """Vérifie qu'une expansion tronquée lève une erreur.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=url(endpoint, "<< 1", 0, 2),
+                 json=page(3, range(0, 2)))
+        mock.add(method=responses.GET, url=url(endpoint, "<< 1", 2, 2),
+                 json=page(3, range(0, 0)))
+        with pytest.raises(ValueError):
+            server.Fts(endpoint, page_size=2).ecl("<< 1")
+
+
+def test_ecl_many(pytestconfig: pytest.Config) -> None:
+    """Vérifie que les requêtes ECL de `ecl_many` sont envoyées en parallèle et que
+    chaque requête est associée à son expansion.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    # Chaque réponse attend que les trois requêtes soient en cours
+    barrier = threading.Barrier(3, timeout=5)
+
+    def callback(code: str):
+        def expand(request):
+            barrier.wait()
+            return 200, {}, json.dumps({"expansion": {"total": 1,
+                                                      "contains": [{"code": code}]}})
+        return expand
+
+    with responses.RequestsMock() as mock:
+        for code in ("1", "2", "3"):
+            mock.add_callback(method=responses.GET, url=url(endpoint, f"<< {code}"),
+                              callback=callback(code))
+        scopes = server.Fts(endpoint, max_in_flight=3).ecl_many(
+            ["<< 1", "<< 2", "<< 3", "<< 1"])
+        assert {ecl: list(codes) for ecl, codes in scopes.items()} \
+            == {"<< 1": [1], "<< 2": [2], "<< 3": [3]}
+        assert len(mock.calls) == 3
+
+
+def test_planner(pytestconfig: pytest.Config) -> None:
+    """Vérifie que les requêtes composées sont découpées en sous-requêtes
+    élémentaires, expansées une seule fois et combinées localement.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=url(endpoint, "<< 1"),
+                 json={"expansion": {"total": 4,
+                                     "contains": [{"code": c} for c in "1234"]}})
+        mock.add(method=responses.GET, url=url(endpoint, "<< 2"),
+                 json={"expansion": {"total": 2,
+                                     "contains": [{"code": c} for c in "24"]}})
+        mock.add(method=responses.GET, url=url(endpoint, "<< 5 : 6 != << 7"),
+                 json={"expansion": {"total": 2,
+                                     "contains": [{"code": c} for c in "35"]}})
+        fts = server.Fts(endpoint)
+        scopes = fts.ecl_many(["<< 1", "<< 1 MINUS << 2",
+                               "(<< 1 MINUS <<2) AND (<< 5:6 != <<7)"])
+        assert fts.ecl("<< 2 OR (<<5 : 6!=<< 7)").sort_values().tolist() \
+            == [2, 3, 4, 5]
+        assert len(mock.calls) == 3
+
+    assert {ecl: sorted(codes) for ecl, codes in scopes.items()} \
+        == {"<< 1": [1, 2, 3, 4], "<< 1 MINUS << 2": [1, 3],
+            "(<< 1 MINUS <<2) AND (<< 5:6 != <<7)": [3]}
+
+
+def test_planner_unsupported(pytestconfig: pytest.Config) -> None:
+    """Vérifie qu'une requête dont la syntaxe n'est pas prise en charge par le
+    planificateur est envoyée telle quelle au FTS.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=url(endpoint, "^ 1 OR << 2"),
+                 json={"expansion": {"total": 1, "contains": [{"code": "3"}]}})
+        assert list(server.Fts(endpoint).ecl("^ 1 OR << 2")) == [3]
+
+
+def test_batch_unsupported(pytestconfig: pytest.Config) -> None:
+    """Vérifie que les requêtes sont envoyées séparément si le FTS refuse les
+    Bundle batch.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.POST, url=endpoint, status=405)
+        for code in ("1", "2"):
+            mock.add(method=responses.GET, url=url(endpoint, f"<< {code}"),
+                     json={"expansion": {"total": 1, "contains": [{"code": code}]}})
+        scopes = server.Fts(endpoint, batch=True).ecl_many(["<< 1", "<< 2"])
+        assert {ecl: list(codes) for ecl, codes in scopes.items()} \
+            == {"<< 1": [1], "<< 2": [2]}
+        assert json.loads(mock.calls[0].request.body)["type"] == "batch"
+        assert len(mock.calls) == 3
+
+
+def test_isin(pytestconfig: pytest.Config) -> None:
+    """Vérifie que les expansions sont renvoyées sans doublon et que `isin` donne le
+    même filtre que `Series.isin`.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=url(endpoint, "<< 1"),
+                 json={"expansion": {"total": 3,
+                                     "contains": [{"code": "1"}, {"code": "2"},
+                                                  {"code": "1"}]}})
+        scope = server.Fts(endpoint).ecl("<< 1")
+    assert list(scope) == [1, 2]
+    concepts = pd.Series([2, 3, 1], index=[5, 6, 7], name="conceptId")
+    pd.testing.assert_series_equal(server.isin(concepts, scope),
+                                   concepts.isin([1, 2]))
+
+
+def test_membership(pytestconfig: pytest.Config) -> None:
+    """Vérifie qu'en mode `membership`, seuls les concepts candidats sont envoyés au
+    FTS, par paquets.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=url(endpoint, "(<< 1) AND (10 OR 11)"),
+                 json={"expansion": {"total": 1, "contains": [{"code": "11"}]}})
+        mock.add(method=responses.GET, url=url(endpoint, "(<< 1) AND (12)"),
+                 json={"expansion": {"total": 1, "contains": [{"code": "12"}]}})
+        mock.add(method=responses.GET, url=url(endpoint, "(<< 2) AND (10 OR 11)"),
+                 json={"expansion": {"total": 0, "contains": []}})
+        mock.add(method=responses.GET, url=url(endpoint, "(<< 2) AND (12)"),
+                 json={"expansion": {"total": 0}})
+        fts = server.Fts(endpoint, membership=True, chunk_size=2)
+        scopes = fts.ecl_many(["<< 1", "<< 2"],
+                              candidates=pd.Series([12, 10, 11, 10]))
+        assert {ecl: list(codes) for ecl, codes in scopes.items()} \
+            == {"<< 1": [11, 12], "<< 2": []}
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_parsing(streaming: bool, pytestconfig: pytest.Config,
+                 monkeypatch: pytest.MonkeyPatch) -> None:
+    """Vérifie l'extraction des codes d'une réponse compressée, avec la lecture
+    incrémentale (ijson) ou la lecture complète du document JSON.
+
+    args:
+        streaming: Utilise la lecture incrémentale si vrai
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+        monkeypatch: Désactive ijson pour la lecture complète
+    """
+    if streaming:
+        pytest.importorskip("ijson")
+    else:
+        monkeypatch.setattr(server, "ijson", None)
+    endpoint = pytestconfig.getoption("endpoint")
+    body = {"resourceType": "ValueSet",
+            "expansion": {"total": 2, "parameter": [{"name": "version",
+                                                     "valueUri": "http://x"}],
+                          "contains": [{"system": "http://snomed.info/sct",
+                                        "code": "1", "display": "un"},
+                                       {"code": "2", "display": "deux"}]}}
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=url(endpoint, "<< 1"),
+                 body=gzip.compress(json.dumps(body).encode()),
+                 headers={"Content-Encoding": "gzip"},
+                 content_type="application/fhir+json")
+        assert list(server.Fts(endpoint).ecl("<< 1")) == [1, 2]
+
+
+def test_trace(pytestconfig: pytest.Config, tmp_path: Path) -> None:
+    """Vérifie les mesures enregistrées pour chaque requête ECL (durée, requêtes,
+    octets, nouvelles tentatives, codes et cache) et leur écriture en JSON lines.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+        tmp_path: Dossier temporaire contenant le cache et la trace
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    trace = tmp_path / "trace.jsonl"
+    fts = server.Fts(endpoint, cache=ExpansionCache(str(tmp_path / "cache.db")),
+                     backoff=0, page_size=2, trace_path=str(trace))
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=url(endpoint, "<< 1", 0, 2), status=502)
+        mock.add(method=responses.GET, url=url(endpoint, "<< 1", 0, 2),
+                 json=page(3, range(0, 2)))
+        mock.add(method=responses.GET, url=url(endpoint, "<< 1", 2, 2),
+                 json=page(3, range(2, 3)))
+        fts.cache.set(endpoint, fts.edition, "<< 2", ["0", "1", "2"])
+        fts.ecl("<< 1")
+        fts.ecl("<< 2")
+        fts.ecl("<< 1")
+
+    summary = fts.summary()
+    assert list(summary.loc[:, "cache"]) == ["miss", "hit"]
+    assert list(summary.loc[:, "requests"]) == [2, 0]
+    assert list(summary.loc[:, "retries"]) == [1, 0]
+    assert list(summary.loc[:, "codes"]) == [3, 3]
+    assert summary.loc[0, "bytes"] == len(json.dumps(page(3, range(0, 2)))) \
+        + len(json.dumps(page(3, range(2, 3))))
+    records = [json.loads(line) for line in trace.read_text().splitlines()]
+    assert [r["cache"] for r in records] == ["miss", "hit"]
+
+
+def test_lookup(pytestconfig: pytest.Config) -> None:
+    """Vérifie la récupération des FSN et de la version par `CodeSystem/$lookup`.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+
+    def lookup(code: str) -> str:
+        return f"{endpoint}/CodeSystem/$lookup?system=http://snomed.info/sct&version=http://snomed.info/sct/900000000000207008&code={code}" # noqa
+
+    def designation(use: str, value: str) -> dict:
+        return {"name": "designation",
+                "part": [{"name": "use", "valueCoding": {"code": use}},
+                         {"name": "value", "valueString": value}]}
+
+    version = "http://snomed.info/sct/900000000000207008/version/20240101"
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=lookup("1"),
+                 json={"parameter": [designation("900000000000013009", "Un"),
+                                     designation("900000000000003001",
+                                                 "Un (finding)")]})
+        mock.add(method=responses.GET, url=lookup("2"), status=404)
+        mock.add(method=responses.GET, url=lookup("138875005"),
+                 json={"parameter": [{"name": "version", "valueString": version}]})
+        fts = server.Fts(endpoint)
+        assert fts.fsn([1, 2, 1]).to_dict() == {1: "Un (finding)", 2: None}
+        assert fts.version() == version
@@ -0,0 +1,138 @@
+import pytest
+import responses
+
+from import_batch_ftcg import snowstorm
+from import_batch_ftcg.cache import ExpansionCache
+from pathlib import Path
+from responses import matchers
+
+
+def test_ecl(pytestconfig: pytest.Config) -> None:
+    """Vérifie que les expansions sont paginées par curseur et ne demandent que les
+    SCTID.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    params = {"ecl": "<< 1", "activeFilter": "true", "returnIdOnly": "true",
+              "limit": "2"}
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=f"{endpoint}/MAIN/concepts",
+                 match=[matchers.query_param_matcher(params)],
+                 json={"items": ["1", "2"], "total": 3, "searchAfter": "abc"})
+        mock.add(method=responses.GET, url=f"{endpoint}/MAIN/concepts",
+                 match=[matchers.query_param_matcher({**params,
+                                                      "searchAfter": "abc"})],
+                 json={"items": ["3"], "total": 3})
+        mock.add(method=responses.GET, url=f"{endpoint}/MAIN/concepts",
+                 match=[matchers.query_param_matcher({**params, "ecl": "<< 4"})],
+                 json={"items": ["2"], "total": 1})
+        terminology = snowstorm.Snowstorm(endpoint, page_size=2)
+        scopes = terminology.ecl_many(["<< 1", "<< 1 MINUS << 4"])
+        assert list(scopes["<< 1"]) == [1, 2, 3]
+        assert list(scopes["<< 1 MINUS << 4"]) == [1, 3]
+        assert len(mock.calls) == 3
+
+
+def test_ecl_capped(pytestconfig: pytest.Config) -> None:
+    """Vérifie que les pages plus courtes que demandé ne terminent pas l'expansion
+    tant que le serveur donne un curseur.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    params = {"ecl": "<< 1", "activeFilter": "true", "returnIdOnly": "true",
+              "limit": "5"}
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=f"{endpoint}/MAIN/concepts",
+                 match=[matchers.query_param_matcher(params)],
+                 json={"items": ["1", "2"], "searchAfter": "abc"})
+        mock.add(method=responses.GET, url=f"{endpoint}/MAIN/concepts",
+                 match=[matchers.query_param_matcher({**params,
+                                                      "searchAfter": "abc"})],
+                 json={"items": ["3"], "searchAfter": "def"})
+        mock.add(method=responses.GET, url=f"{endpoint}/MAIN/concepts",
+                 match=[matchers.query_param_matcher({**params,
+                                                      "searchAfter": "def"})],
+                 json={"items": []})
+        assert list(snowstorm.Snowstorm(endpoint, page_size=5).ecl("<< 1")) \
+            == [1, 2, 3]
+
+
+def test_fsn(pytestconfig: pytest.Config) -> None:
+    """Vérifie que les FSN sont recherchés par paquets de concepts.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=f"{endpoint}/MAIN/concepts",
+                 match=[matchers.query_param_matcher({"conceptIds": ["1", "2"],
+                                                      "limit": "2"})],
+                 json={"items": [{"conceptId": "1",
+                                  "fsn": {"term": "Un (finding)"}}]})
+        mock.add(method=responses.GET, url=f"{endpoint}/MAIN/concepts",
+                 match=[matchers.query_param_matcher({"conceptIds": "3",
+                                                      "limit": "1"})],
+                 json={"items": [{"conceptId": "3",
+                                  "fsn": {"term": "Trois (organism)"}}]})
+        fsn = snowstorm.Snowstorm(endpoint, chunk_size=2).fsn([1, 2, 3, 1])
+    assert fsn.to_dict() == {1: "Un (finding)", 2: None, 3: "Trois (organism)"}
+
+
+def test_version(pytestconfig: pytest.Config) -> None:
+    """Vérifie que la version est celle du CodeSystem de la branche interrogée.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    with responses.RequestsMock() as mock:
+        mock.add(method=responses.GET, url=f"{endpoint}/codesystems",
+                 json={"items": [
+                     {"shortName": "SNOMEDCT", "branchPath": "MAIN",
+                      "latestVersion": {"effectiveDate": 20240101}},
+                     {"shortName": "SNOMEDCT-FR", "branchPath": "MAIN/SNOMEDCT-FR",
+                      "defaultModuleId": "11000315107",
+                      "latestVersion": {"effectiveDate": 20240615}}]})
+        branch = "MAIN/SNOMEDCT-FR/FR-1"
+        assert snowstorm.Snowstorm(endpoint, branch=branch).version() \
+            == "http://snomed.info/sct/11000315107/version/20240615"
+        assert snowstorm.Snowstorm(endpoint).version() \
+            == "http://snomed.info/sct/900000000000207008/version/20240101"
+
+
+def test_cache_version(pytestconfig: pytest.Config, tmp_path: Path) -> None:
+    """Vérifie que les expansions en cache sont invalidées lorsqu'une nouvelle
+    version est publiée sur la branche.
+
+    args:
+        pytestconfig: Récupère l'argument contenant la base de l'URL du FTS à utiliser
+        tmp_path: Répertoire temporaire du cache
+    """
+    endpoint = pytestconfig.getoption("endpoint")
+    cache = ExpansionCache(tmp_path / "cache.sqlite")
+    params = {"ecl": "<< 1", "activeFilter": "true", "returnIdOnly": "true",
+              "limit": "10000"}
+
+    def expand(date: int, items: list) -> tuple:
+        with responses.RequestsMock(assert_all_requests_are_fired=False) as mock:
+            mock.add(method=responses.GET, url=f"{endpoint}/codesystems",
+                     json={"items": [{"branchPath": "MAIN",
+                                      "latestVersion": {"effectiveDate": date}}]})
+            concepts = mock.add(method=responses.GET, url=f"{endpoint}/MAIN/concepts",
+                                match=[matchers.query_param_matcher(params)],
+                                json={"items": items})
+            codes = list(snowstorm.Snowstorm(endpoint, cache=cache).ecl("<< 1"))
+            return codes, concepts.call_count
+
+    assert expand(20240101, ["1", "2"]) == ([1, 2], 1)
+    assert cache.lookup(endpoint, "MAIN", "<< 1").version \
+        == "http://snomed.info/sct/900000000000207008/version/20240101"
+    assert expand(20240101, ["1", "2", "3"]) == ([1, 2], 0)
+    assert expand(20240701, ["1", "2", "3"]) == ([1, 2, 3], 1)
+    assert cache.lookup(endpoint, "MAIN", "<< 1").version \
+        == "http://snomed.info/sct/900000000000207008/version/20240701"
@@ -0,0 +1,280 @@
+import pytest
+import requests
+
+from import_batch_ftcg import backend, local, server, stub
+from import_batch_ftcg.cache import ExpansionCache
+from pathlib import Path
+from typing import Generator
+
+ROOT = str(stub.SYNTHETIC_ROOT)
+
+
+@pytest.fixture(scope="module")
+def terminology() -> local.LocalTerminology:
+    return stub.synthetic(1111, branching=10)
+
+
+@pytest.fixture
+def fts(terminology: local.LocalTerminology) -> Generator[stub.StubFts, None, None]:
+    with stub.StubFts(terminology, max_count=100) as s:
+        yield s
+
+
+def test_synthetic(terminology: local.LocalTerminology) -> None:
+    """Vérifie la forme de la hiérarchie synthétique.
+
+    args:
+        terminology: Hiérarchie synthétique de 1111 concepts
+    """
+    assert len(terminology.ecl(f"<< {ROOT}")) == 1111
+    assert len(terminology.ecl(f"< {ROOT}")) == 1110
+    assert len(terminology.ecl(f"<! {ROOT}")) == 10
+    assert len(terminology.ecl(f"<< {stub.SYNTHETIC_ROOT + 1}")) == 111
+
+
+def test_paging(fts: stub.StubFts) -> None:
+    """Vérifie que la taille des pages est plafonnée par le serveur et que le
+    client récupère l'expansion complète.
+
+    args:
+        fts: Serveur de substitution (pages de 100 codes au plus)
+    """
+    codes = server.Fts(fts.endpoint, page_size=500).ecl(f"<< {ROOT}")
+    assert len(codes) == 1111
+    assert codes.is_unique
+    assert len(fts.requests) == 12
+
+
+def test_paging_without_total(terminology: local.LocalTerminology) -> None:
+    """Vérifie que l'expansion n'est pas tronquée lorsque le serveur plafonne la
+    taille des pages sans annoncer de total : les pages sont lues jusqu'à la
+    première page vide.
+
+    args:
+        terminology: Hiérarchie synthétique de 1111 concepts
+    """
+    with stub.StubFts(terminology, max_count=100, total=False) as s:
+        codes = server.Fts(s.endpoint, page_size=500).ecl(f"<< {ROOT}")
+        assert len(codes) == 1111
+        assert codes.is_unique
+        assert len(s.requests) == 13
+
+
+def test_errors(fts: stub.StubFts) -> None:
+    """Vérifie les réponses aux requêtes non prises en charge.
+
+    args:
+        fts: Serveur de substitution
+    """
+    response = requests.get(f"{fts.endpoint}/ValueSet/$expand?url=http://snomed.info/sct/900000000000207008?fhir_vs=ecl/%5E%201") # noqa
+    assert response.status_code == 400
+    assert response.json()["resourceType"] == "OperationOutcome"
+    assert requests.get(f"{fts.endpoint}/CodeSystem/$lookup").status_code == 400
+    assert requests.get(f"{fts.endpoint}/CodeSystem").status_code == 404
+
+
+def test_concurrency(terminology: local.LocalTerminology) -> None:
+    """Vérifie que les requêtes indépendantes sont envoyées en parallèle.
+
+    args:
+        terminology: Hiérarchie synthétique de 1111 concepts
+    """
+    ecls = [f"<< {stub.SYNTHETIC_ROOT + i}" for i in range(1, 9)]
+    with stub.StubFts(terminology, latency=0.2) as s:
+        scopes = server.Fts(s.endpoint, max_in_flight=4).ecl_many(ecls)
+
+    assert all(len(scopes[ecl]) == 111 for ecl in ecls)
+    assert 1 < s.peak <= 4
+
+
+def test_retries(terminology: local.LocalTerminology) -> None:
+    """Vérifie que les erreurs 503 injectées sont absorbées par les nouvelles
+    tentatives et comptées dans les mesures.
+
+    args:
+        terminology: Hiérarchie synthétique de 1111 concepts
+    """
+    with stub.StubFts(terminology, error_rate=0.3, max_count=100, seed=1) as s:
+        fts = server.Fts(s.endpoint, retries=20, backoff=0)
+        assert len(fts.ecl(f"<< {ROOT}")) == 1111
+
+    summary = fts.summary()
+    assert summary.loc[0, "retries"] > 0
+    assert summary.loc[0, "requests"] + summary.loc[0, "retries"] == len(s.requests)
+
+
+def test_cache(fts: stub.StubFts, tmp_path: Path) -> None:
+    """Vérifie qu'une seconde exécution avec le cache n'envoie qu'une requête
+    vérifiant la version de l'édition.
+
+    args:
+        fts: Serveur de substitution
+        tmp_path: Répertoire temporaire du cache
+    """
+    ecl = f"<< {stub.SYNTHETIC_ROOT + 1}"
+    cache = ExpansionCache(tmp_path / "cache.sqlite")
+    first = server.Fts(fts.endpoint, cache=cache).ecl(ecl)
+    sent = len(fts.requests)
+    second = server.Fts(fts.endpoint, cache=cache).ecl(ecl)
+
+    assert sent == 2
+    assert len(fts.requests) == sent + 1
+    assert "/CodeSystem/$lookup" in fts.requests[-1]
+    assert list(first) == list(second)
+
+
+def test_version_change(fts: stub.StubFts, tmp_path: Path) -> None:
+    """Vérifie qu'une expansion en cache, même non expirée, est téléchargée de
+    nouveau lorsque le FTS annonce une nouvelle version de l'édition.
+
+    args:
+        fts: Serveur de substitution
+        tmp_path: Répertoire temporaire du cache
+    """
+    ecl = f"<< {stub.SYNTHETIC_ROOT + 1}"
+    cache = ExpansionCache(tmp_path / "cache.sqlite")
+    server.Fts(fts.endpoint, cache=cache).ecl(ecl)
+    fts.version = "http://snomed.info/sct/900000000000207008/version/20240701"
+    client = server.Fts(fts.endpoint, cache=cache)
+    assert len(client.ecl(ecl)) == 111
+
+    assert len(fts.requests) == 2 + 1 + 2
+    assert list(client.summary().loc[:, ["cache", "version"]].iloc[0]) \
+        == ["miss", fts.version]
+    assert cache.lookup(fts.endpoint, client.edition, ecl).version == fts.version
+
+
+def test_pinned_version(fts: stub.StubFts, tmp_path: Path) -> None:
+    """Vérifie que la version fixée de l'édition est demandée au FTS et sépare
+    les expansions en cache.
+
+    args:
+        fts: Serveur de substitution
+        tmp_path: Répertoire temporaire du cache
+    """
+    ecl = f"<< {stub.SYNTHETIC_ROOT + 1}"
+    cache = ExpansionCache(tmp_path / "cache.sqlite")
+    client = server.Fts(fts.endpoint, cache=cache, version=fts.version)
+    assert len(client.ecl(ecl)) == 111
+    assert f"url={fts.version}?fhir_vs=ecl/" in fts.requests[0]
+    assert cache.get(fts.endpoint, fts.version, ecl) is not None
+    assert cache.get(fts.endpoint, backend.INTERNATIONAL, ecl) is None
+
+    other = "http://snomed.info/sct/900000000000207008/version/20230101"
+    with pytest.raises(requests.HTTPError):
+        server.Fts(fts.endpoint, version=other).ecl(ecl)
+    with pytest.raises(ValueError):
+        server.Fts(fts.endpoint, version="20240101")
+
+
+def test_version_with_system(fts: stub.StubFts, tmp_path: Path) -> None:
+    """Vérifie que la version annoncée dans les expansions sous la forme
+    `système|version` est comparée à l'URI de version seule, renvoyée par
+    `$lookup` ou fixée : le cache n'est pas invalidé et la version fixée est
+    acceptée.
+
+    args:
+        fts: Serveur de substitution (version préfixée par le système)
+        tmp_path: Répertoire temporaire du cache
+    """
+    ecl = f"<< {stub.SYNTHETIC_ROOT + 1}"
+    cache = ExpansionCache(tmp_path / "cache.sqlite")
+    client = server.Fts(fts.endpoint, cache=cache, version=fts.version)
+    assert len(client.ecl(ecl)) == 111
+    assert cache.lookup(fts.endpoint, fts.version, ecl).version == fts.version
+
+    server.Fts(fts.endpoint, cache=cache).ecl(ecl)
+    sent = len(fts.requests)
+    server.Fts(fts.endpoint, cache=cache).ecl(ecl)
+    assert len(fts.requests) == sent + 1
+    assert cache.lookup(fts.endpoint, backend.INTERNATIONAL, ecl).version \
+        == fts.version
+
+    expansion = {"parameter": [{"name": "used-codesystem",
+                                "valueUri": f"http://snomed.info/sct|{fts.version}"}]}
+    assert server.expansion(expansion)[2] == fts.version
+
+
+def test_revalidation(fts: stub.StubFts, tmp_path: Path) -> None:
+    """Vérifie qu'une expansion expirée est revalidée par une requête
+    conditionnelle (304) et téléchargée de nouveau si l'édition a changé.
+
+    args:
+        fts: Serveur de substitution
+        tmp_path: Répertoire temporaire du cache
+    """
+    ecl = f"<< {stub.SYNTHETIC_ROOT + 1}"
+    # Toutes les expansions du cache sont expirées
+    cache = ExpansionCache(tmp_path / "cache.sqlite", ttl=-1)
+    server.Fts(fts.endpoint, cache=cache).ecl(ecl)
+    assert len(fts.requests) == 2
+
+    client = server.Fts(fts.endpoint, cache=cache)
+    assert len(client.ecl(ecl)) == 111
+    assert len(fts.requests) == 3
+    assert client.summary().loc[0, "cache"] == "revalidated"
+
+    fts.version = "http://snomed.info/sct/900000000000207008/version/20250101"
+    client = server.Fts(fts.endpoint, cache=cache)
+    assert len(client.ecl(ecl)) == 111
+    assert len(fts.requests) == 5
+    assert client.summary().loc[0, "cache"] == "miss"
+    assert cache.lookup(fts.endpoint, client.edition, ecl).version == fts.version
+
+
+def test_batch(fts: stub.StubFts, tmp_path: Path) -> None:
+    """Vérifie que les premières pages des expansions sont récupérées dans un seul
+    Bundle batch, y compris pour revalider les expansions expirées du cache.
+
+    args:
+        fts: Serveur de substitution (pages de 100 codes au plus)
+        tmp_path: Répertoire temporaire du cache
+    """
+    ecls = [f"<< {stub.SYNTHETIC_ROOT + i}" for i in range(11, 15)] \
+        + [f"<< {stub.SYNTHETIC_ROOT + 1} MINUS << {stub.SYNTHETIC_ROOT + 11}"]
+    cache = ExpansionCache(tmp_path / "cache.sqlite", ttl=-1)
+    client = server.Fts(fts.endpoint, cache=cache, batch=True)
+    scopes = client.ecl_many(ecls)
+    assert [len(scopes[ecl]) for ecl in ecls] == [11, 11, 11, 11, 100]
+    # Un Bundle pour les cinq premières pages, puis la seconde page de << 1000001
+    assert [path.split("?")[0] for path in fts.requests] \
+        == ["/", "/ValueSet/$expand"]
+
+    client = server.Fts(fts.endpoint, cache=cache, batch=True)
+    assert [len(codes) for codes in client.ecl_many(ecls).values()] \
+        == [11, 11, 11, 11, 100]
+    assert len(fts.requests) == 3
+    summary = client.summary().set_index("ecl")
+    assert summary.loc[f"<< {stub.SYNTHETIC_ROOT + 1}", "cache"] == "revalidated"
+
+
+def test_fsn(relationships: str, descriptions: str) -> None:
+    """Vérifie que les opérations `CodeSystem/$lookup` sont regroupées par
+    paquets dans des Bundle batch en mode `batch`.
+
+    args:
+        relationships: Chemin vers un fichier de relations RF2 de test
+        descriptions: Chemin vers un fichier de descriptions RF2 de test
+    """
+    concepts = ["10", "11", "12", "13", "10"]
+    with stub.StubFts(local.LocalTerminology(relationships, descriptions)) as s:
+        client = server.Fts(s.endpoint, batch=True, chunk_size=2)
+        fsn = client.fsn(concepts)
+        assert s.requests == ["/", "/"]
+        assert fsn.equals(server.Fts(s.endpoint).fsn(concepts))
+        assert len(s.requests) == 2 + 4
+
+    assert list(fsn.iloc[:2]) == ["Traumatic injury (disorder)",
+                                  "Injury of joint (disorder)"]
+    assert fsn.iloc[2:].isna().all()
+
+
+def test_threads(fts: stub.StubFts) -> None:
+    """Vérifie que le serveur s'arrête sans laisser de thread actif.
+
+    args:
+        fts: Serveur de substitution
+    """
+    s = stub.StubFts(fts.terminology).start()
+    s.stop()
+    assert not s._thread.is_alive()